@@ -1,2 +1,28 @@
-import internals
-internals.client.run_bot()
+import os
+import signal
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+shard_count = int(os.environ.get("LITHIL_SHARD_COUNT", 1))
+
+if shard_count > 1 and "LITHIL_SHARD_ID" not in os.environ:
+    # Supervisor, runs one bot process per shard. They share data/ through the sqlite ledger
+    shards = []
+
+    def stop_shards(signum, frame):
+        for shard in shards:
+            shard.send_signal(signal.SIGTERM)
+
+    signal.signal(signal.SIGTERM, stop_shards)
+    for shard_id in range(shard_count):
+        shards.append(subprocess.Popen([sys.executable, str(Path(__file__).absolute())],
+                                       env=dict(os.environ, LITHIL_SHARD_ID=str(shard_id))))
+        # Discord allows one IDENTIFY every 5 seconds per bot
+        if shard_id < shard_count - 1:
+            time.sleep(5)
+    sys.exit(max(shard.wait() for shard in shards))
+else:
+    import internals
+    internals.client.run_bot()
@@ -0,0 +1,104 @@
+import contextlib
+import itertools
+from typing import Dict, List, Optional
+
+# Minimal stand-ins for the discord objects the bot reads. They only implement the attributes and coroutines
+# the code under benchmark touches, every outbound request is just counted
+
+snowflakes = itertools.count(10 ** 17)
+
+
+class FakeRole:
+    def __init__(self, id: int = None):
+        self.id: int = id or next(snowflakes)
+
+
+class FakeMember:
+    # Slotted because the ledger benchmarks create up to a million of them
+    __slots__ = ("id", "name", "display_name", "mention", "bot", "guild", "roles", "voice")
+
+    def __init__(self, id: int = None, name: str = None, guild: 'FakeGuild' = None, bot: bool = False):
+        self.id: int = id or next(snowflakes)
+        self.name: str = name or "user{}".format(self.id)
+        self.display_name: str = self.name
+        self.mention: str = "<@{}>".format(self.id)
+        self.bot: bool = bot
+        self.guild: 'FakeGuild' = guild
+        self.roles: List[FakeRole] = []
+        self.voice: Optional['FakeVoiceState'] = None
+
+    def __str__(self):
+        return self.name
+
+
+class FakeGuild:
+    def __init__(self, id: int = None):
+        self.id: int = id or next(snowflakes)
+        self.members: Dict[int, FakeMember] = {}
+        self.text_channels: List['FakeTextChannel'] = []
+        self.voice_channels: List['FakeVoiceChannel'] = []
+
+    def add_member(self, member: FakeMember) -> FakeMember:
+        member.guild = self
+        self.members[member.id] = member
+        return member
+
+    def get_member(self, user_id: int) -> Optional[FakeMember]:
+        return self.members.get(user_id)
+
+
+class FakeMessage:
+    def __init__(self, content: str, author: FakeMember, channel: 'FakeTextChannel'):
+        self.id: int = next(snowflakes)
+        self.content: str = content
+        self.author: FakeMember = author
+        self.channel: 'FakeTextChannel' = channel
+        self.guild: FakeGuild = channel.guild
+        self.mentions: List[FakeMember] = []
+
+    async def edit(self, content: str = None, **kwargs):
+        self.channel.requests["edit"] += 1
+        self.content = content
+
+    async def delete(self, delay: float = None):
+        self.channel.requests["delete"] += 1
+
+
+class FakeTextChannel:
+    def __init__(self, guild: FakeGuild, id: int = None, name: str = "general"):
+        self.id: int = id or next(snowflakes)
+        self.name: str = name
+        self.mention: str = "<#{}>".format(self.id)
+        self.guild: FakeGuild = guild
+        self.requests: Dict[str, int] = {"send": 0, "edit": 0, "delete": 0, "typing": 0, "purge": 0}
+        self.bot_user: FakeMember = FakeMember(name="lithil", bot=True)
+        guild.text_channels.append(self)
+
+    def typing(self):
+        self.requests["typing"] += 1
+        return contextlib.nullcontext()
+
+    async def send(self, content: str = None, **kwargs) -> FakeMessage:
+        self.requests["send"] += 1
+        return FakeMessage(content, self.bot_user, self)
+
+    async def purge(self, **kwargs):
+        self.requests["purge"] += 1
+
+
+class FakeVoiceChannel:
+    def __init__(self, guild: FakeGuild, id: int = None, name: str = "voz"):
+        self.id: int = id or next(snowflakes)
+        self.name: str = name
+        self.guild: FakeGuild = guild
+        self.members: List[FakeMember] = []
+        guild.voice_channels.append(self)
+
+
+class FakeVoiceState:
+    def __init__(self, channel: Optional[FakeVoiceChannel], muted: bool = False):
+        self.channel: Optional[FakeVoiceChannel] = channel
+        self.self_mute: bool = muted
+        self.self_deaf: bool = False
+        self.mute: bool = False
+        self.deaf: bool = False
@@ -0,0 +1,345 @@
+import asyncio
+import datetime
+import itertools
+import json
+import random
+import re
+import threading
+import time
+from collections import Counter
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from aiohttp import web, WSMsgType
+
+# Local stand-in for the discord gateway and REST API, enough for discord.py 1.x to log in, receive a recorded or
+# synthetic event stream and send, edit, delete and purge messages. REST routes are rate limited per bucket like
+# discord does, with the same headers, so a client that ignores them gets 429s
+
+snowflakes = itertools.count(9 * 10 ** 17)
+
+# (requests, seconds) per route, the default applies to everything else
+route_limits: Dict[str, Tuple[int, float]] = {
+    "POST /channels/{}/messages": (5, 5),
+    "PATCH /channels/{}/messages/{}": (5, 5),
+    "DELETE /channels/{}/messages/{}": (5, 1),
+    "POST /channels/{}/messages/bulk-delete": (1, 1),
+    "POST /channels/{}/typing": (5, 5),
+}
+default_limit: Tuple[int, float] = (10, 10)
+global_limit: Tuple[int, float] = (50, 1)
+
+# Ids that select the bucket in the discord API, the rest are replaced by {} in the route
+major_parameters = ("channels", "guilds", "webhooks")
+snowflake = re.compile(r"^\d+$")
+
+
+def timestamp() -> str:
+    return datetime.datetime.now(datetime.timezone.utc).isoformat()
+
+
+def user_payload(user_id: int, name: str, bot: bool = False) -> Dict[str, Any]:
+    return {"id": str(user_id), "username": name, "discriminator": "0001", "avatar": None, "bot": bot}
+
+
+def member_payload(user: Dict[str, Any]) -> Dict[str, Any]:
+    return {"user": user, "roles": [], "joined_at": timestamp(), "deaf": False, "mute": False}
+
+
+def message_payload(channel_id: int, guild_id: Optional[int], author: Dict[str, Any], content: str,
+                    message_id: int = None) -> Dict[str, Any]:
+    payload = {"id": str(message_id or next(snowflakes)), "channel_id": str(channel_id), "type": 0,
+               "content": content, "author": author, "attachments": [], "embeds": [], "mentions": [],
+               "mention_roles": [], "pinned": False, "mention_everyone": False, "tts": False,
+               "timestamp": timestamp(), "edited_timestamp": None, "flags": 0}
+    if guild_id is not None:
+        payload["guild_id"] = str(guild_id)
+        payload["member"] = {key: value for key, value in member_payload(author).items() if key != "user"}
+    return payload
+
+
+def json_response(body: Any, status: int = 200, headers: Dict[str, str] = None) -> web.Response:
+    # discord.py only parses the body when the content type is exactly application/json, without a charset
+    return web.Response(body=json.dumps(body).encode("utf-8"), status=status,
+                        headers=dict(headers or {}, **{"Content-Type": "application/json"}))
+
+
+class RateLimiter:
+    def __init__(self):
+        self.windows: Dict[str, Tuple[float, int]] = {}
+
+    def hit(self, key: str, limit: Tuple[int, float], now: float) -> Tuple[bool, int, float]:
+        # (allowed, remaining, seconds until reset), fixed windows like the discord buckets
+        requests, period = limit
+        window_start, used = self.windows.get(key, (now, 0))
+        if now - window_start >= period:
+            window_start, used = now, 0
+        reset_after = period - (now - window_start)
+        if used >= requests:
+            return False, 0, reset_after
+        self.windows[key] = (window_start, used + 1)
+        return True, requests - used - 1, reset_after
+
+
+class MockDiscord:
+    def __init__(self, setup_events: List[Dict[str, Any]], events: List[Dict[str, Any]], speed: float = 1,
+                 on_sent: Callable[[str, Dict[str, Any], float], None] = None, host: str = "127.0.0.1", port: int = 0):
+        # setup_events (READY and GUILD_CREATE) are sent as soon as the client identifies, events are then sent at
+        # their recorded offset divided by speed, or as fast as possible with speed 0
+        self.setup_events = setup_events
+        self.events = events
+        self.speed: float = speed
+        self.on_sent = on_sent
+        self.host: str = host
+        self.port: int = port
+        ready = next(event for event in setup_events if event["event"] == "READY")
+        self.bot_user: Dict[str, Any] = ready["data"]["user"]
+        self.messages: Dict[int, Dict[str, Any]] = {}
+        self.rate_limiter = RateLimiter()
+        self.requests: Counter = Counter()
+        self.rate_limited: Counter = Counter()
+        # Requests made while connecting, before the first replayed event
+        self.setup_requests: Counter = Counter()
+        self.events_sent: int = 0
+        self.replay_started: float = None
+        self.replay_finished = threading.Event()
+        self.listening = threading.Event()
+        self.loop: asyncio.AbstractEventLoop = None
+        self.thread: threading.Thread = None
+        self.runner: web.AppRunner = None
+
+    # region Server
+    def start(self):
+        # Runs on its own thread and loop so serving the bot doesn't show up as lag in the bot's loop
+        self.thread = threading.Thread(target=self._run, name="mock-discord", daemon=True)
+        self.thread.start()
+        self.listening.wait()
+
+    def _run(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_until_complete(self._serve())
+        self.listening.set()
+        self.loop.run_forever()
+
+    async def _serve(self):
+        app = web.Application()
+        app.router.add_get("/gateway", self.gateway)
+        app.router.add_route("*", "/api/{version}/{path:.*}", self.rest)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, self.host, self.port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+
+    def stop(self):
+        if self.loop is not None:
+            asyncio.run_coroutine_threadsafe(self.runner.cleanup(), self.loop).result(10)
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.thread.join(10)
+
+    @property
+    def api_base(self) -> str:
+        return "http://{}:{}/api/v7".format(self.host, self.port)
+    # endregion
+
+    # region Gateway
+    async def gateway(self, request: web.Request) -> web.WebSocketResponse:
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        send_lock = asyncio.Lock()
+        sequence = itertools.count(1)
+        identified = asyncio.Event()
+
+        async def send(payload: Dict[str, Any]):
+            async with send_lock:
+                await ws.send_str(json.dumps(payload))
+
+        async def dispatch(event: Dict[str, Any]):
+            await send({"op": 0, "t": event["event"], "s": next(sequence), "d": event["data"]})
+
+        async def replay():
+            await identified.wait()
+            for event in self.setup_events:
+                await dispatch(event)
+            self.setup_requests = Counter(self.requests)
+            self.replay_started = time.perf_counter()
+            for event in self.events:
+                if self.speed:
+                    delay = self.replay_started + event["offset"] / self.speed - time.perf_counter()
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                # Reported before sending, the bot runs on another thread and may handle the event before send returns
+                if self.on_sent is not None:
+                    self.on_sent(event["event"], event["data"], time.perf_counter())
+                await dispatch(event)
+                self.events_sent += 1
+                if not self.speed and self.events_sent % 100 == 0:
+                    # At max speed still let the heartbeats and REST handlers through
+                    await asyncio.sleep(0)
+            self.replay_finished.set()
+
+        await send({"op": 10, "d": {"heartbeat_interval": 41250}})
+        replay_task = asyncio.ensure_future(replay())
+        try:
+            async for message in ws:
+                if message.type != WSMsgType.TEXT:
+                    continue
+                payload = json.loads(message.data)
+                if payload["op"] == 1:
+                    await send({"op": 11})
+                elif payload["op"] == 2:
+                    identified.set()
+        finally:
+            replay_task.cancel()
+        return ws
+    # endregion
+
+    # region REST
+    @staticmethod
+    def route_of(method: str, path: str) -> Tuple[str, str]:
+        # (route, bucket key): the route keeps only the resource names, the bucket also the major parameter
+        parts = path.strip("/").split("/")
+        route_parts = []
+        major = ""
+        for i, part in enumerate(parts):
+            if snowflake.match(part) or part == "@me":
+                route_parts.append("{}")
+                if i > 0 and parts[i - 1] in major_parameters and not major:
+                    major = part
+            else:
+                route_parts.append(part)
+        route = "{} /{}".format(method, "/".join(route_parts))
+        return route, "{}:{}".format(route, major)
+
+    async def rest(self, request: web.Request) -> web.Response:
+        path = "/" + request.match_info["path"]
+        route, bucket = self.route_of(request.method, path)
+        self.requests[route] += 1
+        now = time.monotonic()
+        allowed_globally, _, global_reset = self.rate_limiter.hit("global", global_limit, now)
+        limit = route_limits.get(route, default_limit)
+        allowed, remaining, reset_after = self.rate_limiter.hit(bucket, limit, now) if allowed_globally \
+            else (False, 0, global_reset)
+        if not allowed:
+            self.rate_limited[route] += 1
+            return json_response(
+                {"message": "You are being rate limited.", "retry_after": reset_after * 1000,
+                 "global": not allowed_globally},
+                status=429, headers={"Via": "1.1 mock", "Retry-After": str(int(reset_after) + 1),
+                                     "X-RateLimit-Global": str(not allowed_globally).lower()})
+        headers = {"X-RateLimit-Limit": str(limit[0]), "X-RateLimit-Remaining": str(remaining),
+                   "X-RateLimit-Reset-After": "{:.3f}".format(reset_after),
+                   "X-RateLimit-Reset": "{:.3f}".format(time.time() + reset_after),
+                   "X-RateLimit-Bucket": bucket}
+        status, body = await self.handle(request, route, path)
+        if body is None:
+            return web.Response(status=status, headers=headers)
+        return json_response(body, status=status, headers=headers)
+
+    async def handle(self, request: web.Request, route: str, path: str) -> Tuple[int, Any]:
+        parts = path.strip("/").split("/")
+        if route == "GET /gateway" or route == "GET /gateway/bot":
+            return 200, {"url": "ws://{}:{}/gateway".format(self.host, self.port), "shards": 1}
+        elif route == "GET /users/{}":
+            return 200, self.bot_user
+        elif route == "POST /channels/{}/messages":
+            body = await request.json()
+            channel_id = int(parts[1])
+            message = message_payload(channel_id, None, self.bot_user, body.get("content") or "")
+            self.messages[int(message["id"])] = message
+            return 200, message
+        elif route == "GET /channels/{}/messages":
+            channel_id = parts[1]
+            limit = int(request.query.get("limit", 50))
+            before = int(request.query.get("before", 2 ** 63))
+            history = sorted((message for message_id, message in self.messages.items()
+                              if message["channel_id"] == channel_id and message_id < before),
+                             key=lambda message: int(message["id"]), reverse=True)
+            return 200, history[:limit]
+        elif route in ("GET /channels/{}/messages/{}", "PATCH /channels/{}/messages/{}",
+                       "DELETE /channels/{}/messages/{}"):
+            message = self.messages.get(int(parts[3]))
+            if message is None:
+                return 404, {"message": "Unknown Message", "code": 10008}
+            if request.method == "PATCH":
+                body = await request.json()
+                if "content" in body:
+                    message["content"] = body["content"]
+                message["edited_timestamp"] = timestamp()
+            elif request.method == "DELETE":
+                del self.messages[int(parts[3])]
+                return 204, None
+            return 200, message
+        elif route == "POST /channels/{}/messages/bulk-delete":
+            body = await request.json()
+            for message_id in body.get("messages", []):
+                self.messages.pop(int(message_id), None)
+            return 204, None
+        return 204, None
+    # endregion
+
+
+def synthetic_stream(users: int = 200, messages: int = 2000, voice_events: int = 500, rate: float = 100,
+                     command_ratio: float = 0.05, text_channels: int = 3, voice_channels: int = 3,
+                     seed: int = 0) -> List[Dict[str, Any]]:
+    # A READY, one GUILD_CREATE and a mix of chat, commands and voice moves at rate events per second, in the same
+    # format the recorder writes
+    randomizer = random.Random(seed)
+    guild_id = next(snowflakes)
+    bot_user = user_payload(next(snowflakes), "lithil", bot=True)
+    people = [user_payload(next(snowflakes), "user{}".format(i)) for i in range(users)]
+    channels = [{"id": str(next(snowflakes)), "type": 0, "name": name, "position": i, "permission_overwrites": [],
+                 "guild_id": str(guild_id)}
+                for i, name in enumerate(["general", "ranking"] + ["texto{}".format(i) for i in range(text_channels)])]
+    voices = [{"id": str(next(snowflakes)), "type": 2, "name": "voz{}".format(i), "position": i,
+               "permission_overwrites": [], "guild_id": str(guild_id), "bitrate": 64000, "user_limit": 0}
+              for i in range(voice_channels)]
+    stream = [{"offset": 0, "event": "READY",
+               "data": {"v": 6, "user": bot_user, "session_id": "mock", "guilds": [{"id": str(guild_id),
+                                                                                   "unavailable": True}],
+                        "private_channels": [], "relationships": []}},
+              {"offset": 0, "event": "GUILD_CREATE",
+               "data": {"id": str(guild_id), "name": "mock", "owner_id": people[0]["id"], "member_count": users + 1,
+                        "roles": [{"id": str(guild_id), "name": "@everyone", "permissions": "104324673",
+                                   "position": 0, "color": 0, "hoist": False, "managed": False,
+                                   "mentionable": False}],
+                        "channels": channels + voices,
+                        "members": [member_payload(person) for person in people + [bot_user]],
+                        "voice_states": [], "presences": [], "emojis": [], "features": [], "large": False}}]
+    commands = ["_currency me", "_currency position", "_currency ranking", "_help", "_asd hola mundo"]
+    voice_positions: Dict[str, Optional[str]] = {}
+    events = messages + voice_events
+    for i in range(events):
+        offset = i / rate
+        if randomizer.random() < voice_events / events:
+            person = randomizer.choice(people)
+            channel_id = None if voice_positions.get(person["id"]) and randomizer.random() < 0.3 \
+                else randomizer.choice(voices)["id"]
+            voice_positions[person["id"]] = channel_id
+            stream.append({"offset": offset, "event": "VOICE_STATE_UPDATE",
+                           "data": {"guild_id": str(guild_id), "channel_id": channel_id, "user_id": person["id"],
+                                    "member": member_payload(person), "session_id": "mock", "deaf": False,
+                                    "mute": False, "self_deaf": False, "self_mute": randomizer.random() < 0.1,
+                                    "self_video": False, "suppress": False}})
+        else:
+            content = randomizer.choice(commands) if randomizer.random() < command_ratio \
+                else "mensaje de prueba {}".format(i)
+            channel = randomizer.choice(channels[2:] or channels)
+            stream.append({"offset": offset, "event": "MESSAGE_CREATE",
+                           "data": message_payload(int(channel["id"]), guild_id, randomizer.choice(people), content)})
+    return stream
+
+
+def split_stream(stream: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    # The READY and the GUILD_CREATEs right after it are the connection setup, everything else is replayed on time
+    setup = []
+    events = []
+    for event in stream:
+        if not events and event["event"] in ("READY", "GUILD_CREATE"):
+            setup.append(event)
+        else:
+            events.append(event)
+    if events:
+        start = events[0]["offset"]
+        events = [dict(event, offset=event["offset"] - start) for event in events]
+    return setup, events
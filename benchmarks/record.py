@@ -0,0 +1,68 @@
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+from typing import Any, Dict, TextIO
+
+import discord
+import yaml
+
+bot_path = Path(__file__).absolute().parent.parent
+
+# Records the gateway dispatches a bot receives to a json lines file that benchmarks.replay can play back.
+# It opens its own gateway session with the bot token, so it can record next to a running bot
+
+
+class Recorder(discord.Client):
+    setup_events = ("READY", "GUILD_CREATE")
+
+    def __init__(self, output: TextIO, duration: float, **kwargs):
+        super().__init__(**kwargs)
+        self.output: TextIO = output
+        self.duration: float = duration
+        self.started: float = None
+        self.recorded: int = 0
+        self.setup_done: bool = False
+
+    async def on_socket_response(self, message: Dict[str, Any]):
+        if message.get("op") != 0:
+            return
+        event = message.get("t")
+        if event in self.setup_events:
+            # A reconnection sends them again, replaying them mid stream would reset the bot's cache
+            if self.setup_done:
+                return
+        else:
+            self.setup_done = True
+        now = time.perf_counter()
+        if self.started is None:
+            self.started = now
+        self.output.write(json.dumps({"offset": now - self.started, "event": event, "data": message.get("d")}) + "\n")
+        self.recorded += 1
+        if self.recorded % 100 == 0:
+            self.output.flush()
+        if self.duration and now - self.started >= self.duration:
+            await self.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Records the gateway events the bot receives for benchmarks.replay")
+    parser.add_argument("output", type=Path, help="json lines file to write")
+    parser.add_argument("--duration", type=float, default=600, help="seconds to record, 0 until interrupted")
+    parser.add_argument("--config", type=Path, default=bot_path / "config" / "config.yml",
+                        help="config with the bot token")
+    args = parser.parse_args()
+
+    token = yaml.load(args.config.read_text(), yaml.FullLoader)["token"]
+    with args.output.open("w", encoding="utf-8") as output:
+        # Same intents as the bot so the stream holds what it would receive
+        recorder = Recorder(output, args.duration)
+        try:
+            recorder.run(token)
+        finally:
+            print("Recorded {} events to {}".format(recorder.recorded, args.output), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
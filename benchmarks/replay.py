@@ -0,0 +1,212 @@
+import argparse
+import asyncio
+import json
+import shutil
+import tempfile
+import threading
+import time
+from collections import defaultdict, deque
+from pathlib import Path
+from typing import Any, Callable, Deque, Dict, Hashable, List, Optional
+
+import discord.http
+
+from benchmarks.run import make_client, git_commit
+from benchmarks.mock_discord import MockDiscord, synthetic_stream, split_stream
+from internals import LithilClient, DataIO
+
+# Replays a recorded (benchmarks.record) or synthetic event stream against the bot through MockDiscord and reports
+# how long each event took to handle, the REST calls and 429s it caused and how late the event loop ran.
+# The bot code is not modified: discord.py is pointed at the mock and the on_ handlers are wrapped to time them
+
+
+class LatencyTracker:
+    # Matches the moment the mock sent an event with the moment the bot finished handling it. Events are matched by
+    # message id or, for voice, by user in order, both are unique enough for the stream of a single guild
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pending: Dict[Hashable, Deque[float]] = defaultdict(deque)
+        self.samples: Dict[str, List[float]] = defaultdict(list)
+
+    @staticmethod
+    def key_of_event(event: str, data: Dict[str, Any]) -> Optional[Hashable]:
+        if event == "MESSAGE_CREATE":
+            return event, int(data["id"])
+        elif event == "VOICE_STATE_UPDATE":
+            return event, int(data["user_id"])
+        return None
+
+    def sent(self, event: str, data: Dict[str, Any], sent_at: float):
+        key = self.key_of_event(event, data)
+        if key is not None:
+            with self.lock:
+                self.pending[key].append(sent_at)
+
+    def handled(self, key: Hashable) -> Optional[float]:
+        with self.lock:
+            sent = self.pending.get(key)
+            if not sent:
+                return None
+            sent_at = sent.popleft()
+            if not sent:
+                del self.pending[key]
+            return sent_at
+
+    def instrument(self, handler: Callable, event: str, key_of_call: Callable[..., Hashable]) -> Callable:
+        async def timed(*args):
+            sent_at = self.handled((event, key_of_call(*args)))
+            try:
+                await handler(*args)
+            finally:
+                if sent_at is not None:
+                    self.samples[event].append(time.perf_counter() - sent_at)
+        return timed
+
+    def unmatched(self) -> int:
+        with self.lock:
+            return sum(len(sent) for sent in self.pending.values())
+
+
+def percentiles(samples: List[float], scale: float = 1000) -> Dict[str, Any]:
+    if not samples:
+        return {"count": 0}
+    samples = sorted(samples)
+    count = len(samples)
+    return {"count": count,
+            "mean": sum(samples) / count * scale,
+            "p50": samples[count // 2] * scale,
+            "p90": samples[min(count - 1, int(count * 0.9))] * scale,
+            "p99": samples[min(count - 1, int(count * 0.99))] * scale,
+            "max": samples[-1] * scale}
+
+
+async def sample_loop_lag(samples: List[float], interval: float, stop: asyncio.Event):
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        samples.append(max(time.perf_counter() - start - interval, 0))
+
+
+def load_stream(file: Path) -> List[Dict[str, Any]]:
+    with file.open(encoding="utf-8") as file_io:
+        return [json.loads(line) for line in file_io if line.strip()]
+
+
+def guild_channels(setup: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    return [channel for event in setup if event["event"] == "GUILD_CREATE"
+            for channel in event["data"].get("channels", []) if channel.get("type") == 0]
+
+
+async def replay(client: LithilClient, mock: MockDiscord, tracker: LatencyTracker, args) -> Dict[str, Any]:
+    loop_lag: List[float] = []
+    stop_sampling = asyncio.Event()
+    sampler = asyncio.ensure_future(sample_loop_lag(loop_lag, args.lag_interval, stop_sampling))
+    connection = asyncio.ensure_future(client.start("replay"))
+    await client.wait_until_ready()
+    await client.loop.run_in_executor(None, mock.replay_finished.wait)
+    replay_time = time.perf_counter() - mock.replay_started
+
+    # Let the bot catch up with the last events, then give the watchers time to flush what they batch
+    deadline = time.perf_counter() + args.drain_timeout
+    while tracker.unmatched() and time.perf_counter() < deadline:
+        await asyncio.sleep(0.05)
+    await asyncio.sleep(args.settle)
+    stop_sampling.set()
+    await sampler
+
+    # Same order as stop_bot, the close handlers close the ledgers a THREAD watcher may still be writing
+    await asyncio.gather(*(watcher.stop_and_wait() for watcher in client.watchers))
+    await client.events.dispatch("close")
+    await client.close()
+    try:
+        await asyncio.wait_for(connection, 10)
+    except asyncio.TimeoutError:
+        pass
+
+    replay_requests = mock.requests - mock.setup_requests
+    total_requests = sum(replay_requests.values())
+    return {"events": mock.events_sent,
+            "replay_seconds": replay_time,
+            "events_per_second": mock.events_sent / replay_time if replay_time else None,
+            "event_latency_ms": {event: percentiles(samples) for event, samples in tracker.samples.items()},
+            "unmatched_events": tracker.unmatched(),
+            "rest": {"setup_requests": sum(mock.setup_requests.values()),
+                     "requests": total_requests,
+                     "requests_per_event": total_requests / mock.events_sent if mock.events_sent else None,
+                     "by_route": dict(replay_requests),
+                     "rate_limited": sum(mock.rate_limited.values()),
+                     "rate_limited_by_route": dict(mock.rate_limited)},
+            "loop_lag_ms": percentiles(loop_lag),
+            "event_handlers": client.events.stats()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replays a gateway event stream against the bot on a mock discord")
+    parser.add_argument("stream", type=Path, nargs="?", help="file written by benchmarks.record, synthetic if missing")
+    parser.add_argument("--speed", type=float, default=1, help="1 for real time, 10 for ten times faster, 0 for max")
+    parser.add_argument("--config", type=Path, help="bot config to use, the sample with the mock channels by default")
+    parser.add_argument("--backend", choices=sorted(DataIO.ledger_backends))
+    parser.add_argument("--users", type=int, default=200, help="synthetic stream: members of the guild")
+    parser.add_argument("--messages", type=int, default=2000, help="synthetic stream: messages")
+    parser.add_argument("--voice-events", type=int, default=500, help="synthetic stream: voice state updates")
+    parser.add_argument("--rate", type=float, default=100, help="synthetic stream: events per second at speed 1")
+    parser.add_argument("--command-ratio", type=float, default=0.05, help="synthetic stream: share of commands")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--drain-timeout", type=float, default=30, help="seconds to wait for unhandled events")
+    parser.add_argument("--settle", type=float, default=12, help="seconds to let the watchers run after the replay")
+    parser.add_argument("--lag-interval", type=float, default=0.05, help="seconds between loop lag samples")
+    parser.add_argument("--output", type=Path, help="write the json report here instead of stdout")
+    args = parser.parse_args()
+
+    if args.stream is not None:
+        stream = load_stream(args.stream)
+    else:
+        stream = synthetic_stream(args.users, args.messages, args.voice_events, args.rate, args.command_ratio,
+                                  seed=args.seed)
+    setup, events = split_stream(stream)
+
+    tracker = LatencyTracker()
+    mock = MockDiscord(setup, events, args.speed, tracker.sent)
+    mock.start()
+    discord.http.Route.BASE = mock.api_base
+
+    overrides = {"metrics": {"file": None}}
+    if args.config is None:
+        channels = guild_channels(setup)
+        overrides["log_channel"] = int(channels[0]["id"])
+        overrides["currency"] = {"ranking_channels": [int(channel["id"]) for channel in channels
+                                                      if channel["name"] == "ranking"]}
+        overrides["commands"] = {"restricted_channels": []}
+
+    work_path = Path(tempfile.mkdtemp(prefix="lithil-replay-"))
+    try:
+        client = make_client(work_path, args.backend, args.config, overrides)
+        client.on_message = tracker.instrument(client.on_message, "MESSAGE_CREATE", lambda message: message.id)
+        client.on_voice_state_update = tracker.instrument(client.on_voice_state_update, "VOICE_STATE_UPDATE",
+                                                          lambda member, before, after: member.id)
+        try:
+            results = client.loop.run_until_complete(replay(client, mock, tracker, args))
+        finally:
+            for watcher in client.watchers:
+                watcher.stop_watching()
+            client.thread_pool.shutdown(wait=True)
+            client.log_pipeline.stop()
+    finally:
+        mock.stop()
+        shutil.rmtree(str(work_path), ignore_errors=True)
+
+    report = {"commit": git_commit(),
+              "timestamp": time.time(),
+              "stream": str(args.stream) if args.stream is not None else "synthetic",
+              "parameters": {key: str(value) if isinstance(value, Path) else value
+                             for key, value in vars(args).items()},
+              "results": results}
+    text = json.dumps(report, indent=2)
+    if args.output is not None:
+        args.output.write_text(text)
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
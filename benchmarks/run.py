@@ -0,0 +1,223 @@
+import argparse
+import json
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List
+
+import yaml
+
+bot_path = Path(__file__).absolute().parent.parent
+if str(bot_path) not in sys.path:
+    sys.path.insert(0, str(bot_path))
+
+# The benchmarks never build the real client (internals.client), they run on their own in a temporary bot directory
+# so the real config/, data/ and lithil.log are never touched
+from internals import Call, DataIO, LithilClient
+from benchmarks.fakes import FakeGuild, FakeMember, FakeTextChannel, FakeVoiceChannel, FakeVoiceState, FakeMessage
+
+
+def make_client(work_path: Path, backend: str = None, config_file: Path = None,
+                overrides: Dict[str, Any] = None) -> LithilClient:
+    # A client on a copy of config_file (the sample by default) with the sections in overrides updated
+    (work_path / "config").mkdir()
+    (work_path / "data").mkdir()
+    (work_path / "commands").symlink_to(bot_path / "commands", target_is_directory=True)
+    sample = bot_path / "config" / "config.yml.sample"
+    shutil.copy(str(sample), str(work_path / "config" / "config.yml.sample"))
+    config = yaml.load((config_file or sample).read_text(), yaml.FullLoader)
+    config["token"] = "benchmark"
+    if backend is not None:
+        config["currency"]["backend"] = backend
+    for section, values in (overrides or {}).items():
+        if isinstance(values, dict):
+            config.setdefault(section, {}).update(values)
+        else:
+            config[section] = values
+    (work_path / "config" / "config.yml").write_text(yaml.dump(config))
+    return LithilClient(work_path)
+
+
+def summarize(samples: List[float], total: float) -> Dict[str, Any]:
+    samples.sort()
+    ops = len(samples)
+    return {"ops": ops,
+            "total_seconds": total,
+            "ops_per_second": ops / total if total else None,
+            "mean_us": total / ops * 1e6,
+            "p50_us": samples[ops // 2] * 1e6,
+            "p99_us": samples[min(ops - 1, int(ops * 0.99))] * 1e6,
+            "max_us": samples[-1] * 1e6}
+
+
+def bench(ops: int, func: Callable[[int], Any]) -> Dict[str, Any]:
+    samples = []
+    perf_counter = time.perf_counter
+    start = perf_counter()
+    for i in range(ops):
+        op_start = perf_counter()
+        func(i)
+        samples.append(perf_counter() - op_start)
+    return summarize(samples, perf_counter() - start)
+
+
+async def bench_async(ops: int, func: Callable[[int], Any]) -> Dict[str, Any]:
+    samples = []
+    perf_counter = time.perf_counter
+    start = perf_counter()
+    for i in range(ops):
+        op_start = perf_counter()
+        await func(i)
+        samples.append(perf_counter() - op_start)
+    return summarize(samples, perf_counter() - start)
+
+
+async def run_suite(client: LithilClient, args) -> Dict[str, Dict[str, Any]]:
+    results = {}
+    randomizer = random.Random(args.seed)
+    guild = FakeGuild()
+    channel = FakeTextChannel(guild)
+    members = [guild.add_member(FakeMember()) for _ in range(args.users)]
+    # Messages are built up front so the benchmarks measure the bot and not the fakes
+    authors = [randomizer.choice(members) for _ in range(args.messages)]
+    chat = [FakeMessage("mensaje de prueba numero {}".format(i), author, channel) for i, author in enumerate(authors)]
+    commands = [FakeMessage("_asd hola mundo {}".format(i % 50), author, channel) for i, author in enumerate(authors)]
+    container = client.command_container
+    bank = client.bank
+
+    results["call_parsing"] = bench(args.messages, lambda i: Call(commands[i], "_", "asd").args)
+    results["dispatch_plain"] = await bench_async(args.messages, lambda i: container.on_message(chat[i]))
+
+    # Cooldowns would turn most calls into throttled ones, dispatch is measured without them
+    aesthetics = container.caller_dictionary["asd"]
+    if not isinstance(aesthetics, type):
+        aesthetics = aesthetics.resolve()
+    cooldown_rate, aesthetics.cooldown_rate = aesthetics.cooldown_rate, None
+    results["dispatch_command"] = await bench_async(args.messages, lambda i: container.on_message(commands[i]))
+    aesthetics.cooldown_rate = cooldown_rate
+
+    results["client_on_message"] = await bench_async(args.messages, lambda i: client.on_message(chat[i]))
+    results["client_on_message"]["target_rate"] = args.rate
+    results["client_on_message"]["sustains_target_rate"] = \
+        results["client_on_message"]["ops_per_second"] >= args.rate
+
+    for member in members:
+        bank.set_currency(member, randomizer.randrange(10 ** 6), store=False)
+    results["add_currency"] = bench(args.messages, lambda i: bank.add_currency(authors[i], 2))
+    results["get_rank"] = bench(args.messages, lambda i: bank.get_rank(authors[i]))
+    results["get_ranking_message"] = bench(args.renders, lambda i: bank.get_ranking_message(guild.id))
+    results["get_ranking_pages"] = bench(args.snapshots, lambda i: bank.get_ranking_pages(guild.id))
+    results["ledger_store"] = bench(args.snapshots, lambda i: bank.store_standings())
+
+    snapshot = bank.get_currency_as_dict(guild.id)
+    snapshot_file = client.data_path / "benchmark.csv"
+    results["data_io_roundtrip"] = bench(args.snapshots, lambda i: DataIO.read_csv_as_dict(
+        DataIO.store_dict_as_csv(snapshot_file, snapshot) or snapshot_file))
+
+    tracker = client.voice_tracker
+    voice_channels = [FakeVoiceChannel(guild) for _ in range(args.voice_channels)]
+    voice_members = members[:args.voice_members]
+    states = {member.id: FakeVoiceState(None) for member in voice_members}
+    transitions = []
+    for _ in range(args.voice_events):
+        member = randomizer.choice(voice_members)
+        before = states[member.id]
+        # Mostly moves between channels and joins, sometimes a leave or a mute toggle
+        roll = randomizer.random()
+        if roll < 0.15:
+            after = FakeVoiceState(None)
+        elif roll < 0.3 and before.channel is not None:
+            after = FakeVoiceState(before.channel, not before.self_mute)
+        else:
+            after = FakeVoiceState(randomizer.choice(voice_channels))
+        states[member.id] = after
+        transitions.append((member, before, after))
+    results["voice_state_update"] = await bench_async(
+        args.voice_events, lambda i: tracker.on_voice_state_update(*transitions[i]))
+    results["voice_state_update"]["open_sessions"] = len(tracker.accruing_since)
+    results["voice_checkpoint"] = bench(args.renders, lambda i: tracker.checkpoint())
+
+    results["outbound_requests"] = dict(channel.requests)
+    return results
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=str(bot_path), stdout=subprocess.PIPE,
+                              stderr=subprocess.DEVNULL, universal_newlines=True).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def compare(results: Dict[str, Any], baseline: Dict[str, Any]) -> List[str]:
+    lines = []
+    for name, result in results["results"].items():
+        old = baseline.get("results", {}).get(name)
+        if not old or "mean_us" not in result or "mean_us" not in old:
+            continue
+        change = (result["mean_us"] - old["mean_us"]) / old["mean_us"] * 100 if old["mean_us"] else 0
+        lines.append("{:<22} {:>12.2f}us -> {:>12.2f}us  {:+.1f}%".format(name, old["mean_us"], result["mean_us"],
+                                                                        change))
+    return lines
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks the bot hot paths offline with fake discord objects")
+    parser.add_argument("--users", type=int, default=1000, help="users in the ledger, 1000 to 1000000")
+    parser.add_argument("--messages", type=int, default=10000, help="messages per message benchmark")
+    parser.add_argument("--rate", type=float, default=10000, help="messages per second client_on_message must reach")
+    parser.add_argument("--renders", type=int, default=200, help="ranking renders and voice checkpoints")
+    parser.add_argument("--snapshots", type=int, default=5, help="full ledger stores, renders and csv round trips")
+    parser.add_argument("--voice-channels", type=int, default=20)
+    parser.add_argument("--voice-members", type=int, default=500)
+    parser.add_argument("--voice-events", type=int, default=10000)
+    parser.add_argument("--backend", choices=sorted(DataIO.ledger_backends), default="csv")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", type=Path, help="write the json results here instead of stdout")
+    parser.add_argument("--compare", type=Path, help="json results of a previous run to compare against")
+    args = parser.parse_args()
+    args.voice_members = min(args.voice_members, args.users)
+
+    work_path = Path(tempfile.mkdtemp(prefix="lithil-benchmark-"))
+    try:
+        # The fake channels have no rate limits, the outbound queue must not add any
+        unlimited = [10 ** 9, 10 ** 9]
+        client = make_client(work_path, args.backend, overrides={"currency": {"ranking_channels": []},
+                                                                 "commands": {"restricted_channels": []},
+                                                                 "metrics": {"file": None},
+                                                                 "outbound": {"route_limits": {
+                                                                     "send": unlimited, "edit": unlimited,
+                                                                     "delete": unlimited}}})
+        try:
+            results = client.loop.run_until_complete(run_suite(client, args))
+        finally:
+            client.bank.close_ledgers()
+            client.thread_pool.shutdown(wait=True)
+            client.log_pipeline.stop()
+    finally:
+        shutil.rmtree(str(work_path), ignore_errors=True)
+
+    report = {"commit": git_commit(),
+              "python": platform.python_version(),
+              "platform": platform.platform(),
+              "timestamp": time.time(),
+              "parameters": {key: str(value) if isinstance(value, Path) else value
+                             for key, value in vars(args).items()},
+              "results": results}
+    text = json.dumps(report, indent=2)
+    if args.output is not None:
+        args.output.write_text(text)
+    else:
+        print(text)
+    if args.compare is not None:
+        for line in compare(report, json.loads(args.compare.read_text())):
+            print(line, file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,11 @@
+import string
+
 from discord import Client
 
-from internals import Command, Call
+from internals import TransformCommand, TextTransform, Call
 
 
-class Aesthetics(Command):
+class Aesthetics(TransformCommand):
     @classmethod
     def get_help_str(cls, call: Call, client: Client) -> str:
         return cls.help
@@ -16,19 +18,9 @@ uso: _aesthetic [texto]"""
     callers = ["aesthetics", "asd"]
     should_delete_caller = True
 
-    @classmethod
-    async def action(cls, call: Call, client: Client) -> str:
-        out: str = ""
-        raw = call.beheaded_content
-        for char in raw:
-            char: str = char.lower()
-            if (char in ['a', 'b', 'c', 'd', 'e', 'f', 'g', 'h', 'i', 'j', 'k', 'l', 'm', 'n', 'o', 'p', 'q', 'r', 's',
-                         't', 'u', 'v', 'w', 'x', 'y', 'z']):
-                out += ":regional_indicator_%c: " % char
-            if char in ['1', '2', '3', '4', '5', '6', '7', '8', '9']:
-                numberdict = {'1': ':one:', '2': ':two:', '3': ':three:', '4': ':four:', '5': ':five:', '6': ':sic:',
-                              '7': ':seven:', '8': ':eight:', '9': ':nine:'}
-                out += "%s " % numberdict[char]
-            if char == ' ':
-                out += '   '
-        return out
+    transform = TextTransform({
+        **{char: ":regional_indicator_{}: ".format(char) for char in string.ascii_lowercase},
+        '1': ':one: ', '2': ':two: ', '3': ':three: ', '4': ':four: ', '5': ':five: ', '6': ':six: ',
+        '7': ':seven: ', '8': ':eight: ', '9': ':nine: ',
+        ' ': '   ',
+    })
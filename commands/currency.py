@@ -7,19 +7,29 @@ class Currency(Command):
     @classmethod
     async def action(cls, call: Call, client: LithilClient) -> str:
         if call.args[0] == "list":
-            currency_dict = client.bank.get_currency_as_dict()
+            partition = client.bank.partition_of_guild(call.server)
+            currency_dict = client.bank.get_currency_as_dict(partition)
             out = "Current standings:\n"
             for key, value in currency_dict.items():
                 out += " %s : %s Papayas\n" % (
-                    call.server.get_member(key),
+                    client.member_directory.display_name(partition, key),
                     value)
 
             return out
         elif call.args[0] == "me":
             return "{} Tienes {} {}".format(call.author.mention, client.bank.get_currency(call.author),
                                             client.bank.currency_name_plural)
+        elif call.args[0] == "position":
+            rank = client.bank.get_rank(call.author)
+            if rank is None:
+                return "{} Todavia no tienes {}".format(call.author.mention, client.bank.currency_name_plural)
+            out = "{} Estas en el puesto {}\n".format(call.author.mention, rank)
+            for position, user_id, balance in client.bank.get_users_around(client.bank.partition_of(call.author),
+                                                                           rank):
+                out += "{0} - <@{1}> {2} {3}\n".format(position, user_id, balance, client.bank.currency_name_plural)
+            return out
         elif call.args[0] == "store":
-            client.bank.store_standings()
+            await client.run_blocking(client.bank.store_standings)
             return "storing..."
         elif call.args[0] == "ranking":
 
@@ -29,7 +39,10 @@ class Currency(Command):
                     channel: TextChannel
                     out += "{}, ".format(channel.mention)
             else:
-                out = client.bank.get_ranking_message()
+                out = client.bank.get_ranking_message(client.bank.partition_of_guild(call.server))
             return out
 
     callers = ["currency"]
+    # The ranking and list subcommands render the whole ledger
+    cooldown_rate = 1 / 5
+    cooldown_burst = 3
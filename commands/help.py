@@ -30,4 +30,9 @@ class Help(Command):
             out = "No tengo ningun comando con ese nombre, si deberia, quejate a bano"
         return out
     callers = ['help']
+    cooldown_rate = 1 / 10
+    cooldown_burst = 2
+    # The listing only changes when the commands are reloaded, which clears the cache
+    cacheable = True
+    cache_ttl = None
     help = """Este comando te ayuda a entender otros comandos"""
@@ -0,0 +1,35 @@
+from typing import TYPE_CHECKING
+
+from internals import Command, NotEnoughCurrencyException
+
+if TYPE_CHECKING:
+    from internals import LithilClient, Call
+
+
+class Pay(Command):
+    help = """Le da parte de tu dinero a otra persona del servidor
+uso: _pay @persona cantidad"""
+    callers = ["pay"]
+    cooldown_rate = 1 / 5
+    cooldown_burst = 3
+
+    @classmethod
+    async def action(cls, call: 'Call', client: 'LithilClient') -> str:
+        bank = client.bank
+        if call.server is None or len(call.targets) != 1 or not call.args:
+            return cls.help
+        target = call.targets[0]
+        try:
+            amount = int(call.args[-1])
+        except ValueError:
+            return cls.help
+        if amount <= 0:
+            return "{} la cantidad tiene que ser positiva".format(call.author.mention)
+        if target.id == call.author.id or target.bot:
+            return "{} no puedes pagarle a {}".format(call.author.mention, target.mention)
+        try:
+            bank.transfer(call.author, target, amount)
+        except NotEnoughCurrencyException:
+            return "{} no tienes {} {}".format(call.author.mention, amount, bank.currency_name_plural)
+        return "{} le ha dado {} {} a {}".format(call.author.mention, amount, bank.currency_name_plural,
+                                                  target.mention)
@@ -0,0 +1,54 @@
+import asyncio
+import logging
+from typing import TYPE_CHECKING
+
+from internals import Command
+
+if TYPE_CHECKING:
+    from internals import LithilClient, Call
+
+logger = logging.getLogger('lithil.commands')
+
+
+class Profile(Command):
+    help = """Perfila el bot durante unos segundos y muestra las funciones que mas tiempo acumulan.
+El perfil completo se guarda en data/ listo para hacer un flamegraph
+uso: _profile [segundos] [funciones]"""
+    callers = ["profile"]
+    execution_type = Command.ExecutionType.RESTRICTIVE
+    default_seconds = 30
+    default_top = 15
+
+    @classmethod
+    async def action(cls, call: 'Call', client: 'LithilClient') -> str:
+        try:
+            seconds = int(call.args[0]) if call.args else cls.default_seconds
+            top = int(call.args[1]) if len(call.args) > 1 else cls.default_top
+        except ValueError:
+            return cls.help
+        if seconds <= 0 or top <= 0:
+            return cls.help
+        profiler = client.profiler
+        if profiler.running:
+            return "{} ya hay un perfil en marcha, espera a que acabe".format(call.author.mention)
+        seconds = min(seconds, profiler.max_seconds)
+        # The session outlives the command, handlers are cancelled long before a long profile ends
+        asyncio.ensure_future(cls.report(profiler.start(seconds), top, call, client))
+        return "{} perfilando durante {} segundos".format(call.author.mention, seconds)
+
+    @classmethod
+    async def report(cls, session: asyncio.Future, top: int, call: 'Call', client: 'LithilClient'):
+        try:
+            report, file = await session
+        except Exception:
+            logger.exception("Profiling session failed")
+            await cls.respond("{} el perfil ha fallado".format(call.author.mention), call, client)
+            return
+        idle = report.idle_samples * 100 / report.samples if report.samples else 0
+        out = "{} **Perfil** guardado en {}\n".format(call.author.mention, file.name)
+        out += "{} muestras, {:.0f}% inactivo\n".format(report.samples, idle)
+        if report.stacks:
+            out += "__Acumulado / propio__\n"
+            for label, cumulative, own in report.top(top):
+                out += "{:.2f}s / {:.2f}s `{}`\n".format(cumulative, own, label)
+        await cls.respond(out, call, client)
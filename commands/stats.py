@@ -0,0 +1,61 @@
+import time
+from typing import TYPE_CHECKING, AnyStr
+
+from internals import Command, Histogram
+
+if TYPE_CHECKING:
+    from internals import LithilClient, Call
+
+
+class Stats(Command):
+    help = """Muestra las metricas internas del bot: watchers, comandos, banco y disco
+uso: _stats"""
+    callers = ["stats"]
+    execution_type = Command.ExecutionType.RESTRICTIVE
+
+    @classmethod
+    async def action(cls, call: 'Call', client: 'LithilClient') -> str:
+        registry = client.metrics
+        uptime = time.time() - registry.started_at
+        out: AnyStr = "**Stats** (uptime {:.0f}s)\n".format(uptime)
+
+        out += "__Watchers__\n"
+        for labels, tick_time in registry.family("lithil_watcher_tick_seconds"):
+            name = labels["watcher"]
+            out += "{}: {} ticks, media {:.1f}ms, max {:.1f}ms, drift {:.2f}s, overruns {:.0f}\n".format(
+                name, tick_time.count, cls.average(tick_time) * 1000, tick_time.max * 1000,
+                registry.gauge("lithil_watcher_drift_seconds", watcher=name).value,
+                registry.counter("lithil_watcher_overruns_total", watcher=name).value)
+
+        out += "__Comandos__\n"
+        total_calls = 0
+        for labels, calls in registry.family("lithil_commands_total"):
+            total_calls += calls.value
+            action_time = registry.histogram("lithil_command_seconds", command=labels["command"])
+            out += "{}: {:.0f} llamadas, media {:.1f}ms\n".format(labels["command"], calls.value,
+                                                                  cls.average(action_time) * 1000)
+        out += "{:.3f} comandos/s\n".format(total_calls / uptime if uptime else 0)
+        cache_results = {}
+        for labels, results in registry.family("lithil_response_cache_total"):
+            cache_results.setdefault(labels["command"], {})[labels["result"]] = results.value
+        for command, results in cache_results.items():
+            out += "cache de {}: {:.0f} aciertos, {:.0f} fallos\n".format(command, results.get("hit", 0),
+                                                                         results.get("miss", 0))
+
+        out += "__Banco__\n"
+        out += "{:.0f} cambios de saldo, {:.0f} actualizaciones del ranking\n".format(
+            registry.counter("lithil_bank_mutations_total").value,
+            registry.counter("lithil_ranking_updates_total").value)
+        for labels, requests in registry.family("lithil_info_channel_requests_total"):
+            out += "mensajes de ranking {}: {:.0f}\n".format(labels["action"], requests.value)
+
+        out += "__Disco__\n"
+        for labels, operation_time in registry.family("lithil_dataio_seconds"):
+            out += "{}: {} veces, media {:.1f}ms, max {:.1f}ms\n".format(
+                labels["operation"], operation_time.count, cls.average(operation_time) * 1000,
+                operation_time.max * 1000)
+        return out
+
+    @staticmethod
+    def average(histogram: Histogram) -> float:
+        return histogram.sum / histogram.count if histogram.count else 0
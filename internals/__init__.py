@@ -1,23 +1,65 @@
+import os
 from pathlib import Path
 
+from .metrics import metrics, MetricsRegistry, Counter, Gauge, Histogram
+from .cooldowns import CooldownScope, CooldownEngine, TokenBucket
+from .outbound_queue import OutboundPriority, OutboundQueue
 from .channel_manager import ChannelManager
 from .call import Call
+from .command_acl import CommandAcl
+from .response_cache import ResponseCache
 from .watcher_class import Watcher
+from .journal import Journal
+from .rank_index import RankIndex
+from .ledger_backends import LedgerBackend, CsvLedgerBackend, SqliteLedgerBackend
 from .data_io import DataIO
-from .config import Config
-from .currency_manager import CurrencyManager
+from .config import Config, ConfigError
+from .log_pipeline import LogPipeline
+from .event_bus import EventBus
+from .accrual import AccrualWindow
+from .currency_manager import CurrencyManager, LedgerTransaction, NotEnoughCurrencyException
+from .voice_tracker import VoiceSessionTracker
+from .member_directory import MemberDirectory
+from .sampling_profiler import SamplingProfiler, ProfileReport
+from .text_transform import TextTransform, TranslationTable, split_message
 from .command_class import Command
+from .transform_command import TransformCommand
+from .command_manifest import LazyCommand, CommandManifest
 from .command_container import CommandContainer
 from .lithil_client import LithilClient
 
 bot_path = Path(__file__).parent.parent
-client = LithilClient(bot_path)
-command_container = client.command_container
+_client: LithilClient = None
 
 
-def watcher(func=None, *, tick_rate,log: bool = False, name=None):
+def get_client() -> LithilClient:
+    # The bot's client is built the first time it is used and not on import, so importing internals (benchmarks,
+    # tests) never reads the real config or writes to data/ and lithil.log
+    global _client
+    if _client is None:
+        # Set by Main.py when it runs one process per shard
+        shard_id = os.environ.get("LITHIL_SHARD_ID")
+        if shard_id is not None:
+            _client = LithilClient(bot_path, shard_id=int(shard_id),
+                                   shard_count=int(os.environ["LITHIL_SHARD_COUNT"]))
+        else:
+            _client = LithilClient(bot_path)
+    return _client
+
+
+def __getattr__(name: str):
+    if name == "client":
+        return get_client()
+    if name == "command_container":
+        return get_client().command_container
+    raise AttributeError("module {} has no attribute {}".format(__name__, name))
+
+
+def watcher(func=None, *, tick_rate,log: bool = False, name=None,
+            execution: Watcher.ExecutionMode = Watcher.ExecutionMode.INLINE):
     def decorator(_func):
-        client.watchers.append(Watcher(name, tick_rate, _func, client, log))
+        # Every client gets its own Watcher for each registered function
+        Watcher.registry.append((name, tick_rate, _func, log, execution))
         return _func
 
     if func is None:
@@ -0,0 +1,94 @@
+from __future__ import annotations
+
+import time
+from typing import Dict, TYPE_CHECKING
+
+from discord import User
+
+from internals import metrics
+
+if TYPE_CHECKING:
+    from internals import CurrencyManager
+
+
+class AccrualWindow:
+    # Rewards are counted per user in memory and paid once per window, one bulk grant per guild, so ledger writes and
+    # ranking updates follow the active users and not the message volume. Messages are also where the caps apply:
+    # the first full_reward_messages of a window pay money_per_message, each later one diminishing_factor times the
+    # previous one, and nobody earns more than max_reward_per_window from messages in a window
+    def __init__(self, bank: 'CurrencyManager', config_dict: Dict):
+        self.bank: 'CurrencyManager' = bank
+        self.window: float = 0
+        self.full_reward_messages: int = 0
+        self.diminishing_factor: float = 1
+        self.max_reward_per_window: int = 0
+        self.configure(config_dict)
+        # By guild partition and user id
+        self.messages: Dict[int, Dict[int, int]] = {}
+        self.amounts: Dict[int, Dict[int, int]] = {}
+        self.window_start: float = time.monotonic()
+        self.events = metrics.counter("lithil_accrual_events_total", "Rewards counted by the accrual window")
+        self.flushes = metrics.counter("lithil_accrual_flushes_total", "Accrual windows paid out")
+        self.paid_users = metrics.counter("lithil_accrual_paid_users_total", "Users paid at the end of a window")
+
+    def configure(self, config_dict: Dict):
+        accrual_config = config_dict.get("accrual") or {}
+        self.window = accrual_config.get("window", 60)
+        self.full_reward_messages = accrual_config.get("full_reward_messages", 0)
+        self.diminishing_factor = accrual_config.get("diminishing_factor", 1)
+        self.max_reward_per_window = accrual_config.get("max_reward_per_window", 0)
+
+    def count_message(self, user: User):
+        self.events.inc()
+        if not self.window:
+            self.bank.add_currency(user, self.message_reward(1))
+            return
+        counts = self.messages.setdefault(self.bank.partition_of(user), {})
+        counts[user.id] = counts.get(user.id, 0) + 1
+
+    def accrue(self, user: User, amount: int):
+        # Rewards that are already an amount (voice time), no caps
+        self.events.inc()
+        if not self.window:
+            self.bank.add_currency(user, amount)
+            return
+        amounts = self.amounts.setdefault(self.bank.partition_of(user), {})
+        amounts[user.id] = amounts.get(user.id, 0) + amount
+
+    def message_reward(self, count: int) -> int:
+        money_per_message = self.bank.money_per_message
+        full = min(count, self.full_reward_messages) if self.full_reward_messages else count
+        reward = full * money_per_message
+        extra = count - full
+        if extra:
+            factor = self.diminishing_factor
+            # factor + factor^2 + ... + factor^extra
+            reward += money_per_message * (extra if factor == 1 else factor * (1 - factor ** extra) / (1 - factor))
+        if self.max_reward_per_window:
+            reward = min(reward, self.max_reward_per_window)
+        return int(reward)
+
+    def pending(self, user: User) -> int:
+        # What the user earned in the current window, shown with the balance but not spendable until paid
+        partition = self.bank.partition_of(user)
+        count = self.messages.get(partition, {}).get(user.id)
+        return (self.message_reward(count) if count else 0) + self.amounts.get(partition, {}).get(user.id, 0)
+
+    def due(self) -> bool:
+        return time.monotonic() - self.window_start >= self.window
+
+    def flush(self) -> int:
+        messages, self.messages = self.messages, {}
+        amounts, self.amounts = self.amounts, {}
+        self.window_start = time.monotonic()
+        paid = 0
+        for partition in set(messages) | set(amounts):
+            payouts = {user_id: self.message_reward(count)
+                       for user_id, count in messages.get(partition, {}).items()}
+            for user_id, amount in amounts.get(partition, {}).items():
+                payouts[user_id] = payouts.get(user_id, 0) + amount
+            self.bank.grant_many(partition, payouts)
+            paid += len(payouts)
+        self.flushes.inc()
+        self.paid_users.inc(paid)
+        return paid
@@ -5,15 +5,43 @@ from discord import Message, Guild, Member, TextChannel
 
 
 class Call:
-    def __init__(self, message: Message, header: str = "_"):
-        beheaded = message.content.replace(header, "", 1)
-        split = beheaded.split(" ")
-        self.command: AnyStr = split[0]
-        self.args: List[AnyStr] = split[1:]
-        self.author: Member = message.author
-        self.targets: List[Member] = message.mentions
-        self.channel: TextChannel = message.channel
-        self.raw_content: AnyStr = message.content
-        self.beheaded_content = beheaded.replace(self.command, "", 1)
+    # Only the header and command are known up front, everything else is read from the message on first use
+    __slots__ = ("message", "header", "command", "_args")
+
+    def __init__(self, message: Message, header: str = "_", command: AnyStr = None):
         self.message: Message = message
-        self.server: Guild = message.guild
+        self.header: str = header
+        if command is None:
+            command = message.content[len(header):].split(" ", 1)[0]
+        self.command: AnyStr = command
+        self._args: List[AnyStr] = None
+
+    @property
+    def args(self) -> List[AnyStr]:
+        if self._args is None:
+            self._args = self.message.content[len(self.header):].split(" ")[1:]
+        return self._args
+
+    @property
+    def beheaded_content(self) -> AnyStr:
+        return self.message.content[len(self.header) + len(self.command):]
+
+    @property
+    def raw_content(self) -> AnyStr:
+        return self.message.content
+
+    @property
+    def author(self) -> Member:
+        return self.message.author
+
+    @property
+    def targets(self) -> List[Member]:
+        return self.message.mentions
+
+    @property
+    def channel(self) -> TextChannel:
+        return self.message.channel
+
+    @property
+    def server(self) -> Guild:
+        return self.message.guild
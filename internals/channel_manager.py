@@ -1,29 +1,130 @@
-from typing import AnyStr, List
+from __future__ import annotations
 
-from discord import TextChannel, Message
+import asyncio
+import hashlib
+import json
+import logging
+from pathlib import Path
+from typing import AnyStr, Dict, List, Tuple, TYPE_CHECKING
+
+import discord
+from discord import TextChannel, Message, AllowedMentions
+
+from internals import metrics
+
+if TYPE_CHECKING:
+    from internals import LithilClient
+
+logger = logging.getLogger('lithil.channels')
+
+info_channel_requests = {action: metrics.counter("lithil_info_channel_requests_total",
+                                                 "Messages sent, edited or deleted to keep info channels up to date",
+                                                 action=action)
+                         for action in ("send", "edit", "delete", "fetch", "purge")}
 
 
 class ChannelManager:
+    message_limit = 2000
+    # Info channels are mostly mentions, sending them must not ping anybody (editing never does)
+    info_mentions = AllowedMentions.none()
+    # Messages read back on startup, an info channel with more than this is not ours alone and gets purged
+    history_limit = 100
+
+    def __init__(self, client: 'LithilClient', file: Path):
+        self.client = client
+        # Ids of the messages each info channel is made of, in order, persisted so a restart can reuse them
+        self.file: Path = file
+        self.owned_messages: Dict[int, List[int]] = {}
+        self.load()
+
+    def load(self):
+        try:
+            owned_messages = json.loads(self.file.read_text(encoding="utf-8"))
+        except FileNotFoundError:
+            return
+        except ValueError:
+            logger.warning("Ignoring unreadable info channel file %s", self.file)
+            return
+        self.owned_messages = {int(channel_id): message_ids for channel_id, message_ids in owned_messages.items()}
+
+    async def store(self):
+        await self.client.run_blocking(self.client.data_manager.store_text, self.file,
+                                       json.dumps(self.owned_messages))
+
+    async def remember(self, channel: TextChannel, messages: List[Message]):
+        message_ids = [message.id for message in messages]
+        if self.owned_messages.get(channel.id) != message_ids:
+            self.owned_messages[channel.id] = message_ids
+            await self.store()
+
+    @staticmethod
+    def content_hash(content: AnyStr) -> str:
+        return hashlib.sha1(content.encode("utf-8")).hexdigest()
 
     @staticmethod
     async def purge_channel(channel: TextChannel):
         await channel.purge()
+        info_channel_requests["purge"].inc()
 
-    @staticmethod
-    async def make_info_channel(channel: TextChannel, content: AnyStr) -> Message:
-        with channel.typing():
-            await ChannelManager.purge_channel(channel)
-            message: Message = await channel.send("WIP")
-            await message.edit(content=content)
-        return message
+    async def send_info_message(self, channel: TextChannel, content: AnyStr) -> Message:
+        info_channel_requests["send"].inc()
+        return await self.client.outbound.send(channel, content, allowed_mentions=self.info_mentions)
 
-    @staticmethod
-    async def make_info_channel_multiple_messages(channel: TextChannel, contents: List[AnyStr]) -> List[Message]:
-        with channel.typing():
-            messages: List[Message]
-            ChannelManager.purge_channel(channel)
-            for content in contents:
-                message: Message = await channel.send("WIP")
-                await message.edit(content=content)
-                messages.append(message)
+    async def reusable_messages(self, channel: TextChannel) -> List[Message]:
+        # The messages of a previous run still in the channel, in order, or None when the channel has to be purged:
+        # it has messages that are not ours or ours are missing
+        owned_ids = self.owned_messages.get(channel.id)
+        try:
+            history = await channel.history(limit=self.history_limit).flatten()
+        except discord.HTTPException:
+            logger.warning("Could not read the history of info channel %s", channel.id, exc_info=True)
+            return None
+        info_channel_requests["fetch"].inc()
+        history.reverse()
+        if owned_ids is None:
+            # Nothing persisted yet, the bot's own messages are the ones a previous version left
+            owned = [message for message in history if message.author == self.client.user]
+        else:
+            by_id = {message.id: message for message in history}
+            owned = [by_id[message_id] for message_id in owned_ids if message_id in by_id]
+            if len(owned) != len(owned_ids):
+                return None
+        if len(history) >= self.history_limit or len(owned) != len(history):
+            return None
+        return owned
+
+    async def make_info_channel(self, channel: TextChannel, content: AnyStr) -> Message:
+        return (await self.make_info_channel_multiple_messages(channel, [content]))[0]
+
+    async def make_info_channel_multiple_messages(self, channel: TextChannel, contents: List[AnyStr]) -> List[Message]:
+        # Reuses the messages from the last run, editing only the ones whose content changed. Purging is the fallback
+        messages = await self.reusable_messages(channel)
+        if messages is None:
+            logger.info("Purging info channel %s", channel.id)
+            await self.purge_channel(channel)
+            messages = []
+        hashes = [self.content_hash(message.content) for message in messages]
+        messages, _ = await self.update_info_channel_multiple_messages(channel, messages, hashes, contents)
         return messages
+
+    async def update_info_channel_multiple_messages(self, channel: TextChannel, messages: List[Message],
+                                                    hashes: List[str], contents: List[AnyStr]
+                                                    ) -> Tuple[List[Message], List[str]]:
+        # Only touches the messages whose content changed, sending or deleting messages when the page count changes.
+        # Edits and deletes are queued together and go out as fast as their routes allow, new pages are sent in order
+        new_hashes = [self.content_hash(content) for content in contents]
+        messages = list(messages)
+        requests = []
+        for i, content in enumerate(contents[:len(messages)]):
+            if hashes[i] != new_hashes[i]:
+                requests.append(self.client.outbound.edit(messages[i], content))
+                info_channel_requests["edit"].inc()
+        for message in messages[len(contents):]:
+            requests.append(self.client.outbound.delete(message))
+            info_channel_requests["delete"].inc()
+        await asyncio.gather(*requests)
+        messages = messages[:len(contents)]
+        for content in contents[len(messages):]:
+            messages.append(await self.send_info_message(channel, content))
+        await self.remember(channel, messages)
+        return messages, new_hashes
@@ -0,0 +1,72 @@
+from collections import OrderedDict
+from typing import Dict, FrozenSet, Iterable, Tuple, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from internals import Call
+
+
+class CommandAcl:
+    # Permissions of one command compiled to sets of ids when the command is loaded. Denials always win, a restrictive
+    # command also needs the author or one of its roles to be allowed, and allowed_channels, when set, is a whitelist.
+    # Decisions are cached per (author, channel, author's roles), a role change is a different key. The config changing
+    # builds new acls
+    def __init__(self, restrictive: bool, allowed_users: Iterable[int] = (), allowed_roles: Iterable[int] = (),
+                 denied_users: Iterable[int] = (), denied_roles: Iterable[int] = (),
+                 allowed_channels: Iterable[int] = (), denied_channels: Iterable[int] = (), cache_size: int = 4096):
+        self.restrictive: bool = restrictive
+        self.allowed_users: FrozenSet[int] = frozenset(allowed_users)
+        self.allowed_roles: FrozenSet[int] = frozenset(allowed_roles)
+        self.denied_users: FrozenSet[int] = frozenset(denied_users)
+        self.denied_roles: FrozenSet[int] = frozenset(denied_roles)
+        self.allowed_channels: FrozenSet[int] = frozenset(allowed_channels)
+        self.denied_channels: FrozenSet[int] = frozenset(denied_channels)
+        self.cache_size: int = cache_size
+        self.decisions: 'OrderedDict[Tuple[int, int, FrozenSet[int]], Tuple[bool, bool]]' = OrderedDict()
+
+    @classmethod
+    def from_config(cls, restrictive: bool, config: Dict, legacy_user_ids: Iterable[int] = (),
+                    legacy_denied_user_ids: Iterable[int] = (), legacy_denied_channel_ids: Iterable[int] = (),
+                    admin_ids: Iterable[int] = (), restricted_channel_ids: Iterable[int] = ()) -> 'CommandAcl':
+        allowed_users = set(config.get('allowed_users') or []) | set(legacy_user_ids)
+        allowed_roles = set(config.get('allowed_roles') or [])
+        if restrictive and not allowed_users and not allowed_roles:
+            allowed_users = set(admin_ids)
+        return cls(restrictive, allowed_users, allowed_roles,
+                   set(config.get('denied_users') or []) | set(legacy_denied_user_ids),
+                   config.get('denied_roles') or [],
+                   config.get('allowed_channels') or [],
+                   set(config.get('denied_channels') or []) | set(legacy_denied_channel_ids) |
+                   set(restricted_channel_ids or []))
+
+    def decide(self, call: 'Call') -> Tuple[bool, bool]:
+        # (author allowed, channel allowed)
+        # Users outside a guild have no roles
+        role_ids = frozenset(role.id for role in getattr(call.author, "roles", ()))
+        key = (call.author.id, call.channel.id, role_ids)
+        decision = self.decisions.get(key)
+        if decision is None:
+            decision = self.decisions[key] = (self._allows_author(call.author.id, role_ids),
+                                              self._allows_channel(call.channel.id))
+            if len(self.decisions) > self.cache_size:
+                self.decisions.popitem(last=False)
+        return decision
+
+    def allows_author(self, call: 'Call') -> bool:
+        return self.decide(call)[0]
+
+    def allows_channel(self, call: 'Call') -> bool:
+        return self.decide(call)[1]
+
+    def _allows_author(self, author_id: int, role_ids: FrozenSet[int]) -> bool:
+        if author_id in self.denied_users:
+            return False
+        if not self.denied_roles.isdisjoint(role_ids):
+            return False
+        if not self.restrictive:
+            return True
+        return author_id in self.allowed_users or not self.allowed_roles.isdisjoint(role_ids)
+
+    def _allows_channel(self, channel_id: int) -> bool:
+        if channel_id in self.denied_channels:
+            return False
+        return not self.allowed_channels or channel_id in self.allowed_channels
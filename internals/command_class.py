@@ -1,14 +1,19 @@
+import asyncio
+import logging
 from abc import ABC, abstractmethod
 from enum import Enum
-from typing import List, TYPE_CHECKING
+from typing import Hashable, List, Optional, TYPE_CHECKING
 
 from discord import Client, TextChannel, Member
 
-from internals import Call
+from internals import Call, Counter, Histogram, CooldownScope, CommandAcl, ChannelManager, OutboundPriority, \
+    split_message
 
 if TYPE_CHECKING:
     from internals import LithilClient, Call
 
+logger = logging.getLogger('lithil.commands')
+
 
 class Command(ABC):
     class ExecutionType(Enum):
@@ -20,24 +25,64 @@ class Command(ABC):
     callers = [""]
     should_delete_caller = False
     execution_type: ExecutionType = ExecutionType.PERMISSIVE
-
+    # Token bucket per cooldown_scope: cooldown_burst calls in a row, then one every 1 / cooldown_rate seconds.
+    # None disables the cooldown
+    cooldown_rate: float = None
+    cooldown_burst: int = 1
+    cooldown_scope: CooldownScope = CooldownScope.USER
+    # Replies of cacheable commands are reused for calls with the same cache_key for cache_ttl seconds (None: until
+    # the commands are reloaded). Only for replies that don't depend on who calls or on state that changes meanwhile
+    cacheable: bool = False
+    cache_ttl: float = 60
+    slow_down_message = "{} mas despacio, espera un poco antes de volver a usar {}"
+
+    # Only read when the command is loaded, they are compiled into acl together with the permissions in the config
     allowed_users: List[Member] = []
     restricted_users: List[Member] = []
     restricted_channels: List[TextChannel] = []
+    allowed_user_ids: List[int] = []
     name: str = None
+    acl: CommandAcl = None
+    # Set by the CommandContainer when the command is loaded
+    calls_counter: Counter = None
+    action_time: Histogram = None
+    cache_hits: Counter = None
+    cache_misses: Counter = None
 
     @classmethod
     async def called(cls, call: 'Call', client: 'LithilClient'):
         cls.log(call, client)
-        with cls.output_channel(call).typing():
-            if cls.can_execute(call, client):
-                reply = await cls.action(call, client)
+        cls.calls_counter.inc()
+        # Permissions are checked before the cache so a cached reply is never given to someone who can't execute
+        if not cls.caller_can_execute(call, client):
+            reply = cls.get_denied_message(call, client)
+        elif cls.cacheable:
+            cache = client.command_container.response_cache
+            key = (cls.name, cls.cache_key(call))
+            reply = cache.get(key)
+            if reply is None:
+                cls.cache_misses.inc()
+                reply = await cls.timed_action(call, client)
+                if reply is not None:
+                    cache.put(key, reply, cls.cache_ttl)
             else:
-                reply = cls.get_denied_message(call, client)
-        await cls.respond(reply, call)
+                cls.cache_hits.inc()
+        else:
+            reply = await cls.timed_action(call, client)
+        await cls.respond(reply, call, client)
         if cls.should_delete_caller:
             await cls.delete(call, client)
 
+    @classmethod
+    async def timed_action(cls, call: 'Call', client: 'LithilClient') -> str:
+        with cls.output_channel(call).typing():
+            with cls.action_time.time():
+                return await cls.action(call, client)
+
+    @classmethod
+    def cache_key(cls, call: 'Call') -> Hashable:
+        return call.command, tuple(call.args)
+
     @classmethod
     @abstractmethod
     async def action(cls, call: 'Call', client: 'LithilClient') -> str:
@@ -49,15 +94,32 @@ class Command(ABC):
 
     @classmethod
     def get_denied_message(cls, call: 'Call', client: 'LithilClient') -> str:
-        return cls.permission_denied_message.format(call.author.mention)
+        return cls.permission_denied_message.format(call.author.mention, call.command)
+
+    @classmethod
+    def get_slow_down_message(cls, call: 'Call', client: 'LithilClient') -> str:
+        return cls.slow_down_message.format(call.author.mention, call.command)
 
     @classmethod
-    async def respond(cls, reply, call: 'Call'):
-        await cls.output_channel(call).send(reply)
+    async def respond(cls, reply, call: 'Call', client: 'LithilClient') -> Optional[asyncio.Future]:
+        # Commands with nothing to say return None or an empty reply. The reply is only queued, waiting for a
+        # throttled route here would keep the event bus slot of the message busy until it is sent
+        if not reply:
+            return None
+        sending = asyncio.ensure_future(cls.send_reply(split_message(reply, ChannelManager.message_limit), call,
+                                                       client))
+        sending.add_done_callback(client.outbound.log_failure)
+        return sending
+
+    @classmethod
+    async def send_reply(cls, chunks: List[str], call: 'Call', client: 'LithilClient'):
+        # One chunk after another so they arrive in order
+        for chunk in chunks:
+            await client.outbound.send(cls.output_channel(call), chunk, OutboundPriority.INTERACTIVE)
 
     @classmethod
     async def delete(cls, call: 'Call', client: 'LithilClient'):
-        await call.message.delete(delay=1)
+        client.outbound.delete(call.message, delay=1)
 
     @classmethod
     def output_channel(cls, call: 'Call') -> TextChannel:
@@ -66,19 +128,16 @@ class Command(ABC):
     @classmethod
     def log(cls, call: 'Call', client: 'LithilClient'):
         # TODO Mirar porque aqui si intento importar el Lithil Client en vez del client normal todo explota
-        client.logger.info("Call for command {0} made by {1}".format(call.command, call.author))
+        logger.info("Call for command %s made by %s", call.command, call.author,
+                    extra={"data": {"command": cls.name, "author_id": call.author.id, "channel_id": call.channel.id}})
 
     @classmethod
     def can_execute(cls, call: 'Call', client: 'LithilClient'):
-
-        if cls.execution_type == cls.ExecutionType.PERMISSIVE:
-            return call.author not in cls.restricted_users
-        elif cls.execution_type == cls.ExecutionType.RESTRICTIVE:
-            return call.author in cls.allowed_users
+        return cls.acl.allows_author(call)
 
     @classmethod
     def command_in_right_channel(cls, call: 'Call', client: 'LithilClient'):
-        return call.channel not in cls.restricted_channels
+        return cls.acl.allows_channel(call)
 
     @classmethod
     def caller_can_execute(cls, call: 'Call', client: 'LithilClient'):
@@ -2,62 +2,229 @@ from __future__ import annotations
 
 import importlib
 import inspect
+import logging
+import re
+import sys
 from pathlib import Path
-from typing import Dict, List, TYPE_CHECKING, AnyStr
+from typing import Dict, List, TYPE_CHECKING, AnyStr, Mapping, Optional, Pattern, Match, Set, Union
 
 from discord import Message
 
-from internals import Command, Call
+from internals import Command, Call, CommandAcl, ResponseCache, CooldownEngine, CooldownScope, LazyCommand, CommandManifest, metrics
 
 if TYPE_CHECKING:
     from internals import LithilClient
 
+logger = logging.getLogger('lithil.commands')
+
 
 class CommandContainer:
     def __init__(self, config: Dict, command_path: Path, client: 'LithilClient'):
         self.client = client
         self.command_headers: List[AnyStr] = []
-        self.command_dictionary: Dict[AnyStr, Command] = {}
-        self.caller_dictionary: Dict[AnyStr, Command] = {}
-        self.restricted_channel_ids: List[int] = config['restricted_channels']
-        self.load_commands(command_path)
+        self.command_path: Path = command_path
+        # Both dictionaries are rebuilt and swapped whole, never mutated, so a reload is atomic for the dispatcher
+        self.command_dictionary: Dict[AnyStr, Union[Command, LazyCommand]] = {}
+        self.caller_dictionary: Dict[AnyStr, Union[Command, LazyCommand]] = {}
+        # Commands and st_mtime_ns of every module, by module name
+        self.module_commands: Dict[str, List[Union[Command, LazyCommand]]] = {}
+        self.module_mtimes: Dict[str, int] = {}
+        self.manifest: CommandManifest = CommandManifest(
+            client.data_path / (config.get('manifest_file') or "command_manifest.json"))
+        self.hot_reload: bool = config.get('hot_reload', True)
+        self.restricted_channel_ids: List[int] = config.get('restricted_channels') or []
+        self.admin_ids: List[int] = config.get('admins') or []
+        # Per command permissions, keyed by the command name (the class name, e.g. Currency)
+        self.permissions_config: Dict[AnyStr, Dict] = config.get('permissions') or {}
+        self.dispatcher: Pattern = None
+        cooldown_config = config.get('cooldowns') or {}
+        self.cooldowns: CooldownEngine = CooldownEngine(cooldown_config.get('max_buckets', 10000),
+                                                        cooldown_config.get('idle_timeout', 600))
+        # The "slow down" reply has its own bucket per user so spamming a command can't turn into spamming replies
+        slow_down_interval = cooldown_config.get('slow_down_reply_interval', 30)
+        self.slow_down_rate: float = 1 / slow_down_interval if slow_down_interval else None
+        self.response_cache: ResponseCache = ResponseCache(config.get('response_cache_size', 512))
+        self.throttled_calls = metrics.counter("lithil_command_throttled_total", "Command calls rejected by cooldowns")
         for header in config['command_headers']:
             self.command_headers.append(header)
+        self.load_commands(command_path)
 
-        self.client.on_message_events.append(self.on_message)
+        self.client.events.subscribe("message", self.on_message)
+        self.client.events.subscribe("config_change", self.on_config_change)
 
     async def call_command(self, call: 'Call', client: 'LithilClient'):
         called_command = self.caller_dictionary[call.command]
+        if isinstance(called_command, LazyCommand):
+            called_command = called_command.resolve()
+        if called_command.cooldown_rate is not None and \
+                not self.cooldowns.try_acquire(called_command.name, called_command.cooldown_rate,
+                                               called_command.cooldown_burst, called_command.cooldown_scope, call):
+            await self.slow_down(called_command, call, client)
+            return
         await called_command.called(call, client)
 
+    async def slow_down(self, command: 'Command', call: 'Call', client: 'LithilClient'):
+        self.throttled_calls.inc()
+        if self.slow_down_rate is not None and \
+                self.cooldowns.try_acquire("slow_down", self.slow_down_rate, 1, CooldownScope.USER, call):
+            await command.respond(command.get_slow_down_message(call, client), call, client)
+
+    def compile_dispatcher(self):
+        # One anchored regex over every header and caller, longest first so "__x" is never read as "_" + "_x".
+        # A caller has to be followed by a space or the end of the message, like the old split(" ")[0] lookup
+        def alternation(options: List[AnyStr]) -> str:
+            return "|".join(re.escape(option) for option in sorted(options, key=len, reverse=True))
+
+        self.dispatcher = re.compile("({})({})(?= |\\Z)".format(alternation(self.command_headers),
+                                                              alternation(list(self.caller_dictionary.keys()))))
+
+    def compile_acl(self, command: 'Command'):
+        command.acl = CommandAcl.from_config(
+            command.execution_type == Command.ExecutionType.RESTRICTIVE,
+            self.permissions_config.get(command.name) or {},
+            legacy_user_ids=[user.id for user in command.allowed_users] + list(command.allowed_user_ids),
+            legacy_denied_user_ids=[user.id for user in command.restricted_users],
+            legacy_denied_channel_ids=[channel.id for channel in command.restricted_channels],
+            admin_ids=self.admin_ids, restricted_channel_ids=self.restricted_channel_ids)
+
+    async def on_config_change(self, config: Mapping, changed: Set[str]):
+        # Only what changed is rebuilt, each piece is swapped whole so calls in flight see the old or the new one
+        commands_config = config["commands"]
+        if "commands.command_headers" in changed:
+            self.command_headers = list(commands_config["command_headers"])
+            self.compile_dispatcher()
+        if changed & {"commands.restricted_channels", "commands.admins", "commands.permissions"}:
+            self.restricted_channel_ids = commands_config.get('restricted_channels') or []
+            self.admin_ids = commands_config.get('admins') or []
+            self.permissions_config = commands_config.get('permissions') or {}
+            # Lazy commands get the new ones when they are imported
+            for command in self.command_dictionary.values():
+                if not isinstance(command, LazyCommand):
+                    self.compile_acl(command)
+        if "commands.cooldowns" in changed:
+            slow_down_interval = (commands_config.get('cooldowns') or {}).get('slow_down_reply_interval', 30)
+            self.slow_down_rate = 1 / slow_down_interval if slow_down_interval else None
+        if "commands.hot_reload" in changed:
+            self.hot_reload = commands_config.get('hot_reload', True)
+
+    def match(self, content: AnyStr) -> Optional[Match]:
+        return self.dispatcher.match(content)
+
     async def on_message(self, message: 'Message'):
-        for header in self.command_headers:
-            if message.content.startswith(header):
-                call = Call(message, header)
-                if call.command in self.caller_dictionary.keys():
-                    await self.call_command(call, self.client)
-                break
+        match = self.dispatcher.match(message.content)
+        if match is not None:
+            await self.call_command(Call(message, match.group(1), match.group(2)), self.client)
 
-    def load_commands(self, command_path: Path):
+    def command_files(self, command_path: Path) -> Dict[str, Path]:
         command_directories = [command_path]
         for x in command_path.iterdir():
             if x.is_dir() and not x.name.startswith("__"):
                 command_directories.append(x)
+        files = {}
         for folder in command_directories:
-            command_files: List[Path] = list(folder.glob("*.py"))
-            for file in command_files:
+            if folder is command_path:
+                package_name = command_path.name
+            else:
+                package_name = "%s.%s" % (command_path.name, folder.name)
+            for file in folder.glob("*.py"):
                 if not file.name.startswith("__"):
-                    module_name = ".%s" % file.name.replace(".py", "")
-                    if folder is command_path:
-                        package_name = command_path.name
-                    else:
-                        package_name = "%s.%s" % (command_path.name, folder.name)
-
-                    command_module = importlib.import_module(module_name, package_name)
-                    commands_in_module = [m[1] for m in inspect.getmembers(command_module, inspect.isclass)
-                                          if m[1].__module__ == command_module.__name__ and issubclass(m[1], Command)]
-                    for command in commands_in_module:
-                        command.name = command.__name__
-                        self.command_dictionary[command.name] = command
-                        for caller in command.callers:
-                            self.caller_dictionary[caller] = command
+                    files["%s.%s" % (package_name, file.stem)] = file
+        return files
+
+    def load_commands(self, command_path: Path):
+        # Modules unchanged since the manifest was written are registered from it without importing them
+        self.manifest.load()
+        files = self.command_files(command_path)
+        for module_name, file in files.items():
+            mtime = file.stat().st_mtime_ns
+            cached_commands = self.manifest.get(module_name, file, mtime)
+            if cached_commands is not None:
+                self.module_commands[module_name] = [LazyCommand(command["name"], command["callers"], module_name,
+                                                                 self) for command in cached_commands]
+            else:
+                self.module_commands[module_name] = self.import_commands(module_name)
+                self.manifest.set(module_name, file, mtime, self.module_commands[module_name])
+            self.module_mtimes[module_name] = mtime
+        for module_name in list(self.manifest.modules):
+            if module_name not in files:
+                self.manifest.remove(module_name)
+        self.register_commands()
+        self.manifest.store()
+
+    def import_commands(self, module_name: str, reload: bool = False) -> List[Command]:
+        command_module = importlib.import_module(module_name)
+        if reload:
+            command_module = importlib.reload(command_module)
+        commands_in_module = [m[1] for m in inspect.getmembers(command_module, inspect.isclass)
+                              if m[1].__module__ == command_module.__name__ and issubclass(m[1], Command)]
+        for command in commands_in_module:
+            command.name = command.__name__
+            command.calls_counter = metrics.counter("lithil_commands_total", "Commands called", command=command.name)
+            command.action_time = metrics.histogram("lithil_command_seconds", "Time spent in command actions",
+                                                    command=command.name)
+            if command.cacheable:
+                command.cache_hits = metrics.counter("lithil_response_cache_total", "Cached command replies",
+                                                     command=command.name, result="hit")
+                command.cache_misses = metrics.counter("lithil_response_cache_total", "Cached command replies",
+                                                       command=command.name, result="miss")
+            self.compile_acl(command)
+        return commands_in_module
+
+    def register_commands(self):
+        command_dictionary = {}
+        caller_dictionary = {}
+        for commands in self.module_commands.values():
+            for command in commands:
+                command_dictionary[command.name] = command
+                for caller in command.callers:
+                    caller_dictionary[caller] = command
+        self.command_dictionary = command_dictionary
+        self.caller_dictionary = caller_dictionary
+        self.compile_dispatcher()
+        # Replies like the help listing depend on which commands exist
+        self.response_cache.invalidate()
+
+    def resolve(self, lazy_command: LazyCommand) -> Command:
+        commands = self.module_commands.get(lazy_command.module_name)
+        if commands is not None and lazy_command not in commands:
+            # Already imported through another proxy of the same module, or reloaded since
+            command = self.command_dictionary.get(lazy_command.name)
+            if command is not None and not isinstance(command, LazyCommand):
+                return command
+        logger.info("Importing command module %s", lazy_command.module_name)
+        self.module_commands[lazy_command.module_name] = self.import_commands(lazy_command.module_name)
+        self.register_commands()
+        command = self.command_dictionary.get(lazy_command.name)
+        if command is None or isinstance(command, LazyCommand):
+            raise LookupError("Command {} is no longer in {}".format(lazy_command.name, lazy_command.module_name))
+        return command
+
+    def reload_changed(self) -> List[str]:
+        # Imports new modules, reloads changed ones in place and drops deleted ones. A module that fails to import
+        # keeps its previous commands until it is fixed
+        if not self.hot_reload:
+            return []
+        files = self.command_files(self.command_path)
+        changed = [module_name for module_name in self.module_commands if module_name not in files]
+        for module_name in changed:
+            del self.module_commands[module_name]
+            del self.module_mtimes[module_name]
+            self.manifest.remove(module_name)
+        for module_name, file in files.items():
+            mtime = file.stat().st_mtime_ns
+            if self.module_mtimes.get(module_name) == mtime:
+                continue
+            self.module_mtimes[module_name] = mtime
+            try:
+                commands = self.import_commands(module_name, reload=module_name in sys.modules)
+            except Exception:
+                logger.exception("Could not reload command module %s", module_name)
+                continue
+            self.module_commands[module_name] = commands
+            self.manifest.set(module_name, file, mtime, commands)
+            changed.append(module_name)
+        if changed:
+            self.register_commands()
+            self.manifest.store()
+            logger.info("Reloaded command modules %s", ", ".join(changed))
+        return changed
@@ -0,0 +1,72 @@
+import json
+import logging
+from pathlib import Path
+from typing import Any, Dict, List, TYPE_CHECKING
+
+from internals import DataIO
+
+if TYPE_CHECKING:
+    from internals import CommandContainer, Command
+
+logger = logging.getLogger('lithil.commands')
+
+
+class LazyCommand:
+    # Stands in for a command whose module has not been imported yet. name and callers come from the manifest, so
+    # registering callers and listing commands don't import anything; any other attribute imports the module and the
+    # container swaps the real class in
+    def __init__(self, name: str, callers: List[str], module_name: str, container: 'CommandContainer'):
+        self.name: str = name
+        self.callers: List[str] = callers
+        self.module_name: str = module_name
+        self.container: 'CommandContainer' = container
+
+    def resolve(self) -> 'Command':
+        return self.container.resolve(self)
+
+    def __getattr__(self, item):
+        if item.startswith("__"):
+            raise AttributeError(item)
+        return getattr(self.resolve(), item)
+
+    def __repr__(self):
+        return "<LazyCommand {} from {}>".format(self.name, self.module_name)
+
+
+class CommandManifest:
+    # What each command module defined the last time it was imported, keyed by module name:
+    # {"file": ..., "mtime": st_mtime_ns, "commands": [{"name": ..., "callers": [...]}]}
+    version = 1
+
+    def __init__(self, file: Path):
+        self.file: Path = file
+        self.modules: Dict[str, Dict[str, Any]] = {}
+
+    def load(self):
+        try:
+            manifest = json.loads(self.file.read_text(encoding="utf-8"))
+        except FileNotFoundError:
+            return
+        except ValueError:
+            logger.warning("Ignoring unreadable command manifest %s", self.file)
+            return
+        if manifest.get("version") == self.version:
+            self.modules = manifest.get("modules", {})
+
+    def store(self):
+        DataIO.store_text(self.file, json.dumps({"version": self.version, "modules": self.modules}, indent=1))
+
+    def get(self, module_name: str, file: Path, mtime: int) -> List[Dict[str, Any]]:
+        # The cached commands of the module, or None when the file changed since they were cached
+        entry = self.modules.get(module_name)
+        if entry is None or entry["mtime"] != mtime or entry["file"] != str(file):
+            return None
+        return entry["commands"]
+
+    def set(self, module_name: str, file: Path, mtime: int, commands: List['Command']):
+        self.modules[module_name] = {"file": str(file), "mtime": mtime,
+                                     "commands": [{"name": command.name, "callers": list(command.callers)}
+                                                  for command in commands]}
+
+    def remove(self, module_name: str):
+        self.modules.pop(module_name, None)
@@ -1,22 +1,120 @@
+import logging
 from pathlib import Path
-from typing import Dict, AnyStr, List
+from types import MappingProxyType
+from typing import Any, Dict, Mapping, Set
 
 import yaml
 import shutil
 
+logger = logging.getLogger('lithil.config')
+
+
+class ConfigError(Exception):
+    pass
+
+
+def freeze(value: Any) -> Any:
+    # Snapshots are shared by the event loop and the watcher threads, nobody may change them in place
+    if isinstance(value, dict):
+        return MappingProxyType({key: freeze(item) for key, item in value.items()})
+    if isinstance(value, list):
+        return tuple(freeze(item) for item in value)
+    return value
+
 
 class Config:
+    # Types of the keys the bot reads, sections are nested dicts. Keys that accept None may also be missing
+    schema: Dict = {
+        "token": (str, type(None)),
+        "log_channel": int,
+        "currency": {
+            "name": str,
+            "name_plural": str,
+            "money_per_message": int,
+            "money_per_minute_on_voice": int,
+            "exclude_muted_on_voice": (bool, type(None)),
+            "ranking_channels": list,
+            "ranking_page_size": (int, type(None)),
+            "accrual": (dict, type(None)),
+        },
+        "commands": {
+            "command_headers": list,
+            "restricted_channels": (list, type(None)),
+            "admins": (list, type(None)),
+            "permissions": (dict, type(None)),
+            "hot_reload": (bool, type(None)),
+            "cooldowns": (dict, type(None)),
+        },
+        "logging": (dict, type(None)),
+    }
 
     def __init__(self, config_path: Path):
         self.config_path: Path = config_path
         self.config_file: Path = config_path / "config.yml"
         self.sample_config_file = config_path / "config.yml.sample"
-        self.config_dict = self.load_config()
+        self.mtime: int = None
+        # Replaced whole on every reload, so whoever holds a snapshot keeps a consistent view of it
+        self.config_dict: Mapping = self.load_config()
 
-    def load_config(self) -> Dict:
+    def load_config(self) -> Mapping:
         if not self.config_file.exists():
             self.create_config_from_sample()
-        return yaml.load(self.config_file.read_text(), yaml.FullLoader)
+        self.mtime = self.config_file.stat().st_mtime_ns
+        document = yaml.load(self.config_file.read_text(), yaml.FullLoader)
+        self.validate(document, self.schema)
+        return freeze(document)
+
+    @classmethod
+    def validate(cls, document: Any, schema: Dict, path: str = "config"):
+        if not isinstance(document, dict):
+            raise ConfigError("{} should be a section".format(path))
+        for key, expected in schema.items():
+            key_path = "{}.{}".format(path, key)
+            if isinstance(expected, dict):
+                if key not in document:
+                    raise ConfigError("{} is missing".format(key_path))
+                cls.validate(document[key], expected, key_path)
+                continue
+            types = expected if isinstance(expected, tuple) else (expected,)
+            if key not in document:
+                if type(None) not in types:
+                    raise ConfigError("{} is missing".format(key_path))
+            elif not isinstance(document[key], types):
+                raise ConfigError("{} should be {}".format(key_path, " or ".join(t.__name__ for t in types)))
+
+    @staticmethod
+    def changed_keys(old: Mapping, new: Mapping) -> Set[str]:
+        # Top level keys and, inside sections, "section.key"
+        changed = set()
+        for key in set(old) | set(new):
+            old_value, new_value = old.get(key), new.get(key)
+            if old_value == new_value:
+                continue
+            changed.add(key)
+            if isinstance(old_value, Mapping) and isinstance(new_value, Mapping):
+                changed.update("{}.{}".format(key, inner_key) for inner_key in set(old_value) | set(new_value)
+                               if old_value.get(inner_key) != new_value.get(inner_key))
+        return changed
+
+    def reload_if_changed(self) -> Set[str]:
+        # An invalid file is logged and skipped until it changes again, the bot keeps the previous snapshot
+        try:
+            mtime = self.config_file.stat().st_mtime_ns
+        except FileNotFoundError:
+            return set()
+        if mtime == self.mtime:
+            return set()
+        try:
+            snapshot = self.load_config()
+        except (yaml.YAMLError, ConfigError) as e:
+            self.mtime = mtime
+            logger.error("Keeping the previous config, %s is not valid: %s", self.config_file, e)
+            return set()
+        changed = self.changed_keys(self.config_dict, snapshot)
+        self.config_dict = snapshot
+        if changed:
+            logger.info("Config reloaded, changed %s", ", ".join(sorted(changed)))
+        return changed
 
     def create_config_from_sample(self):
         shutil.copy(str(self.sample_config_file), str(self.config_file))
@@ -24,3 +122,5 @@ class Config:
     def __getitem__(self, item):
         return self.config_dict[item]
 
+    def get(self, item, default=None):
+        return self.config_dict.get(item, default)
@@ -0,0 +1,74 @@
+import time
+from collections import OrderedDict
+from enum import Enum
+from typing import Hashable, Tuple, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from internals import Call
+
+
+class CooldownScope(Enum):
+    USER = 0
+    CHANNEL = 1
+    GUILD = 2
+    GLOBAL = 3
+
+
+class TokenBucket:
+    __slots__ = ("tokens", "updated")
+
+    def __init__(self, tokens: float, now: float):
+        self.tokens: float = tokens
+        self.updated: float = now
+
+    def consume(self, rate: float, burst: float, now: float) -> bool:
+        # Refilled lazily from the time elapsed since the last use, there is no timer per bucket
+        tokens = min(burst, self.tokens + (now - self.updated) * rate)
+        self.updated = now
+        if tokens >= 1:
+            self.tokens = tokens - 1
+            return True
+        self.tokens = tokens
+        return False
+
+
+class CooldownEngine:
+    # Buckets live in an OrderedDict in least recently used order. A bucket nobody used for idle_timeout seconds has
+    # refilled anyway, so it is dropped and recreated full the next time, and there are never more than max_buckets
+    def __init__(self, max_buckets: int = 10000, idle_timeout: float = 600):
+        self.max_buckets: int = max_buckets
+        self.idle_timeout: float = idle_timeout
+        self.buckets: 'OrderedDict[Tuple[Hashable, int], TokenBucket]' = OrderedDict()
+
+    @staticmethod
+    def scope_id(scope: CooldownScope, call: 'Call') -> int:
+        if scope == CooldownScope.USER:
+            return call.author.id
+        elif scope == CooldownScope.CHANNEL:
+            return call.channel.id
+        elif scope == CooldownScope.GUILD:
+            return call.server.id if call.server is not None else call.channel.id
+        return 0
+
+    def try_acquire(self, namespace: Hashable, rate: float, burst: float, scope: CooldownScope, call: 'Call') -> bool:
+        now = time.monotonic()
+        key = (namespace, self.scope_id(scope, call))
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = self.buckets[key] = TokenBucket(burst, now)
+            self.evict(now)
+        else:
+            self.buckets.move_to_end(key)
+        return bucket.consume(rate, burst, now)
+
+    def evict(self, now: float):
+        while len(self.buckets) > self.max_buckets:
+            self.buckets.popitem(last=False)
+        # Only looks at the oldest buckets, so the cost is paid by the calls that create new ones
+        for _ in range(2):
+            if not self.buckets:
+                return
+            oldest_key = next(iter(self.buckets))
+            if now - self.buckets[oldest_key].updated < self.idle_timeout:
+                return
+            del self.buckets[oldest_key]
@@ -1,19 +1,60 @@
 from __future__ import annotations
 
-from typing import Dict, TYPE_CHECKING, List
+from typing import Dict, TYPE_CHECKING, List, Mapping, Optional, Set, Tuple
 from discord import User, Message, Guild, Member, Emoji, TextChannel
 
 if TYPE_CHECKING:
     from internals import LithilClient
-from internals import ChannelManager
-
-import csv
+from internals import AccrualWindow, ChannelManager, LedgerBackend, metrics, Counter, Histogram
 
 
 class NotEnoughCurrencyException(Exception):
     pass
 
 
+class LedgerTransaction:
+    # Balance changes in one guild's ledger, applied together when the with block ends. Debits are conditional: if
+    # any balance would end below zero NotEnoughCurrencyException is raised and nothing is applied
+    def __init__(self, bank: 'CurrencyManager', partition: int):
+        self.bank: 'CurrencyManager' = bank
+        self.partition: int = partition
+        self.deltas: Dict[int, int] = {}
+        self.debited: Set[int] = set()
+
+    def grant(self, user_id: int, amount: int) -> 'LedgerTransaction':
+        self.deltas[user_id] = self.deltas.get(user_id, 0) + amount
+        return self
+
+    def debit(self, user_id: int, amount: int) -> 'LedgerTransaction':
+        self.debited.add(user_id)
+        return self.grant(user_id, -amount)
+
+    def transfer(self, from_user_id: int, to_user_id: int, amount: int) -> 'LedgerTransaction':
+        return self.debit(from_user_id, amount).grant(to_user_id, amount)
+
+    def commit(self, store: bool = True):
+        deltas = {user_id: delta for user_id, delta in self.deltas.items() if delta}
+        if not deltas:
+            return
+        ledger = self.bank.ledger_for(self.partition)
+        # Only this guild's ledger is locked, the check and the changes can't interleave with other writes to it
+        with ledger.lock:
+            for user_id in self.debited:
+                if ledger.get(user_id) + self.deltas[user_id] < 0:
+                    raise NotEnoughCurrencyException
+            ledger.apply_deltas(deltas, store)
+        self.bank.mutations.inc(len(deltas))
+        self.bank.ranking_update_pending = True
+
+    def __enter__(self) -> 'LedgerTransaction':
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.commit()
+        return False
+
+
 class CurrencyManager:
 
     def __init__(self, client: 'LithilClient', config_dict: Dict):
@@ -23,94 +64,239 @@ class CurrencyManager:
         self.currency_name_plural = config_dict["name_plural"]
         self.money_per_message = config_dict["money_per_message"]
         self.money_per_minute_on_voice = config_dict["money_per_minute_on_voice"]
-        self.data_file = self.client.data_path / (self.currency_name + ".csv")
-        self.ranking_messages: List['Message'] = []
+        self.ledger_config: Dict = config_dict
+        # One ledger per guild, opened the first time the guild is used. Partition 0 holds what happens outside
+        # guilds (direct messages)
+        self.ledgers: Dict[int, LedgerBackend] = {}
+        # The guild that keeps the ledger from before they were split by guild, stored under the plain currency name
+        self.default_guild: Optional[int] = config_dict.get("default_guild")
+        self.ranking_page_size: int = config_dict.get("ranking_page_size", 20)
+        # Per ranking channel id, the messages holding each page and the hash of what they currently show
+        self.ranking_messages: Dict[int, List['Message']] = {}
+        self.ranking_page_hashes: Dict[int, List[str]] = {}
         self.ranking_channels: List['TextChannel'] = []
-        self._currency_dict: Dict[int, int] = {}
         self.ranking_update_pending: bool = False
         self.ranking_channel_ids: List[int] = []
+        # Message and voice rewards are paid once per window instead of on every event
+        self.accrual: AccrualWindow = AccrualWindow(self, config_dict)
+        self.mutations: Counter = metrics.counter("lithil_bank_mutations_total", "Balance changes")
+        self.ranking_updates: Counter = metrics.counter("lithil_ranking_updates_total",
+                                                        "Times a pending ranking change triggered an update")
+        self.ranking_render_time: Histogram = metrics.histogram("lithil_ranking_render_seconds",
+                                                                "Time spent rendering the ranking pages")
 
         for channel_id in config_dict['ranking_channels']:
             self.ranking_channel_ids.append(channel_id)
-        self.load_standings()
         # Register events
-        self.client.on_ready_events.append(self.on_ready)
-        self.client.on_message_events.append(self.on_message)
-        self.client.on_close_events.append(self.on_close)
+        # Accrual is cheap so it goes first, setting up the ranking channels may purge them so it gets more time
+        self.client.events.subscribe("ready", self.on_ready, timeout=300)
+        self.client.events.subscribe("message", self.on_message, priority=10)
+        self.client.events.subscribe("close", self.on_close, timeout=0, ordered=True)
+        self.client.events.subscribe("config_change", self.on_config_change, timeout=300, ordered=True)
+
+    @staticmethod
+    def partition_of_guild(guild: Optional[Guild]) -> int:
+        return guild.id if guild is not None else 0
+
+    @staticmethod
+    def partition_of(user: User) -> int:
+        # Members carry their guild, plain users only come from direct messages
+        guild = getattr(user, "guild", None)
+        return guild.id if guild is not None else 0
+
+    def ledger_name(self, partition: int) -> str:
+        # Without default_guild the old ledger belongs to no guild, never to the direct messages
+        if self.default_guild is not None and partition == self.default_guild:
+            return self.currency_name
+        return "{}.{}".format(self.currency_name, partition)
+
+    def legacy_ledger_exists(self) -> bool:
+        return any((self.client.data_path / (self.currency_name + suffix)).exists()
+                   for suffix in (".csv", ".journal", ".sqlite3"))
+
+    def ledger_for(self, partition: int) -> LedgerBackend:
+        ledger = self.ledgers.get(partition)
+        if ledger is None:
+            ledger = self.client.data_manager.open_ledger(self.ledger_name(partition), self.ledger_config)
+            # Replaced and not changed in place, persistence_tick walks it from a thread
+            self.ledgers = {**self.ledgers, partition: ledger}
+        return ledger
 
     def get_currency(self, user: User) -> int:
-        try:
-            return self._currency_dict[user.id]
-        except KeyError:
-            self._currency_dict[user.id] = 0
-            return 0
+        # Includes what the current accrual window owes them, so rewards show up right away
+        return self.ledger_for(self.partition_of(user)).get(user.id) + self.accrual.pending(user)
 
     def set_currency(self, user: User, value: int, store: bool = True):
-        self._currency_dict[user.id] = value
-        if store:
-            self.store_standings()
+        self.ledger_for(self.partition_of(user)).set(user.id, value, store)
+        self.mutations.inc()
         self.ranking_update_pending = True
 
     def add_currency(self, user: User, value: int, store: bool = True):
-        self.set_currency(user, self.get_currency(user) + value, store, )
+        # An increment and not a set, other shards may be changing the same balance
+        self.ledger_for(self.partition_of(user)).increment(user.id, value, store)
+        self.mutations.inc()
+        self.ranking_update_pending = True
 
     def remove_currency(self, user: User, value: int, store: bool = True):
-        if self.get_currency(user) < value:
-            raise NotEnoughCurrencyException
-        else:
-            self.set_currency(user, self.get_currency(user) - value, store, )
+        transaction = self.transaction(self.partition_of(user))
+        transaction.debit(user.id, value).commit(store)
+
+    def transaction(self, partition: int) -> LedgerTransaction:
+        return LedgerTransaction(self, partition)
+
+    def transfer(self, from_user: Member, to_user: Member, value: int):
+        if self.partition_of(from_user) != self.partition_of(to_user):
+            raise ValueError("Transfers only happen inside a guild")
+        with self.transaction(self.partition_of(from_user)) as transaction:
+            transaction.transfer(from_user.id, to_user.id, value)
+
+    def grant_many(self, partition: int, amounts: Dict[int, int], store: bool = True):
+        # Bulk payouts, one write for all of them
+        transaction = self.transaction(partition)
+        for user_id, amount in amounts.items():
+            transaction.grant(user_id, amount)
+        transaction.commit(store)
+
+    def get_currency_as_dict(self, partition: int) -> Dict[int, int]:
+        return dict(self.ledger_for(partition).items())
+
+    def get_top(self, partition: int, n: int = None) -> List[Tuple[int, int]]:
+        return self.ledger_for(partition).top(n)
+
+    def get_rank(self, user: User) -> Optional[int]:
+        return self.ledger_for(self.partition_of(user)).rank(user.id)
 
-    def get_currency_as_dict(self):
-        return self._currency_dict
+    def get_users_around(self, partition: int, rank: int, radius: int = 2) -> List[Tuple[int, int, int]]:
+        # (rank, user_id, balance) for the users ranked within radius positions of rank
+        start = max(rank - 1 - radius, 0)
+        ranking = self.ledger_for(partition).ranking_slice(start, rank - start + radius)
+        return [(start + i + 1, user_id, balance) for i, (user_id, balance) in enumerate(ranking)]
 
     def store_standings(self) -> None:
-        self.client.data_manager.store_dict_as_csv(self.data_file, self._currency_dict)
+        for ledger in list(self.ledgers.values()):
+            ledger.store()
 
-    def load_standings(self):
-        self._currency_dict = self.client.data_manager.read_csv_as_dict(self.data_file)
+    def close_ledgers(self) -> None:
+        for ledger in list(self.ledgers.values()):
+            ledger.close()
+
+    def persistence_tick(self) -> None:
+        for ledger in list(self.ledgers.values()):
+            ledger.tick()
+
+    def ranking_needs_update(self) -> bool:
+        if not self.ranking_channels:
+            return False
+        # Polled every time so changes made by other shards are noticed even when there are local ones too
+        external_changes = [self.ledger_for(partition).poll_external_changes()
+                            for partition in {self.partition_of_guild(channel.guild)
+                                              for channel in self.ranking_channels}]
+        return self.ranking_update_pending or any(external_changes)
 
     async def update_rankings(self):
-        for message in self.ranking_messages:
-            await message.edit(content=self.get_ranking_message())
+        # Cleared before editing so changes made while the edits are in flight schedule another update
         self.ranking_update_pending = False
+        self.ranking_updates.inc()
+        pages_by_partition: Dict[int, List[str]] = {}
+        for channel in self.ranking_channels:
+            # Each channel shows the ranking of its guild, rendered once for all its channels
+            partition = self.partition_of_guild(channel.guild)
+            if partition not in pages_by_partition:
+                with self.ranking_render_time.time():
+                    pages_by_partition[partition] = self.get_ranking_pages(partition)
+            self.ranking_messages[channel.id], self.ranking_page_hashes[channel.id] = \
+                await self.client.channel_manager.update_info_channel_multiple_messages(
+                    channel, self.ranking_messages[channel.id], self.ranking_page_hashes[channel.id],
+                    pages_by_partition[partition])
 
-    def sort_users_by_ranking(self, users: List[User]) -> List[User]:
-        def sorter(user: User):
-            return self.get_currency(user)
-        users.sort(reverse=True, key=sorter)
-
-    def get_ranking_message(self) -> str:
+    def get_ranking_pages(self, partition: int, max_pages: int = None) -> List[str]:
+        # Pages hold ranking_page_size users, or fewer when a long name_plural would take them past the message limit
+        ranking = self.get_top(partition, None if max_pages is None else max_pages * self.ranking_page_size)
+        limit = ChannelManager.message_limit
+        pages: List[str] = []
         out: str = "__**Ranking de gente con mas papayas:**__\n"
-        user_ids = self.get_currency_as_dict().keys()
-        users: List[User] = []
-        for user_id in user_ids:
-            users.append(self.client.get_user(user_id))
-        self.sort_users_by_ranking(users)
-        for i in range(len(users)):
-            out += "{0} - {1} {2} {3}\n" \
-                .format(i + 1,
-                        users[i].mention,
-                        self.get_currency(users[i]),
-                        self.currency_name_plural)
-        return out
+        in_page = 0
+        for i, (user_id, balance) in enumerate(ranking):
+            line = "{0} - {1} {2} {3}\n".format(i + 1, "<@{}>".format(user_id), balance,
+                                                self.currency_name_plural)[:limit]
+            if in_page == self.ranking_page_size or len(out) + len(line) > limit:
+                pages.append(out)
+                if max_pages is not None and len(pages) == max_pages:
+                    return pages
+                out = ""
+                in_page = 0
+            out += line
+            in_page += 1
+        pages.append(out)
+        return pages
+
+    def get_ranking_message(self, partition: int) -> str:
+        return self.get_ranking_pages(partition, 1)[0]
 
     async def make_ranking_channel(self, channel: TextChannel = None):
-        ranking_message = self.get_ranking_message()
-        ranking_channel = await ChannelManager.make_info_channel(channel, ranking_message)
-        self.ranking_messages.append(ranking_channel)
+        pages = self.get_ranking_pages(self.partition_of_guild(channel.guild))
+        self.ranking_messages[channel.id] = \
+            await self.client.channel_manager.make_info_channel_multiple_messages(channel, pages)
+        self.ranking_page_hashes[channel.id] = [self.client.channel_manager.content_hash(page) for page in pages]
 
     # region Events
     async def on_close(self):
-        self.store_standings()
+        # After the voice tracker's close, its last credits are in this window
+        self.accrual.flush()
+        await self.client.run_blocking(self.close_ledgers)
 
     async def on_message(self, message: Message) -> None:
-        self.add_currency(message.author, self.money_per_message)
+        self.accrual.count_message(message.author)
 
     async def on_ready(self):
+        if self.default_guild is None and len(self.client.guilds) == 1 and not self.client.sharded and \
+                not self.ledgers:
+            # A bot in a single guild keeps using the ledger it had before ledgers were split by guild
+            self.default_guild = self.client.guilds[0].id
+        elif self.default_guild is None and self.legacy_ledger_exists():
+            self.client.logger.error("The ledger from before ledgers were split by guild ({}) is not used by any "
+                                     "guild, set currency.default_guild to the guild it belongs to"
+                                     .format(self.currency_name))
+        # Opened here rather than on the first message, loading a big csv ledger takes a while
+        for guild in self.client.guilds:
+            self.ledger_for(guild.id)
         for channel_id in self.ranking_channel_ids:
-            channel = self.client.get_channel(channel_id)
-            self.ranking_channels.append(channel)
-            await self.make_ranking_channel(channel)
+            await self.add_ranking_channel(channel_id)
+
+    async def add_ranking_channel(self, channel_id: int):
+        channel = self.client.get_channel(channel_id)
+        if channel is None:
+            # Another shard holds its guild and keeps it updated
+            self.client.logger.info("Ranking channel {} is not visible from this client".format(channel_id))
+            return
+        await self.make_ranking_channel(channel)
+        # Only listed once it has messages, update_rankings may be iterating the list meanwhile
+        self.ranking_channels = self.ranking_channels + [channel]
+
+    async def on_config_change(self, config: Mapping, changed: Set[str]):
+        currency_config = config["currency"]
+        if "currency.money_per_message" in changed:
+            # Messages are priced when the window is paid, the ones counted until now get the old rate
+            self.accrual.flush()
+        if "currency.accrual" in changed:
+            self.accrual.configure(currency_config)
+        self.money_per_message = currency_config["money_per_message"]
+        self.money_per_minute_on_voice = currency_config["money_per_minute_on_voice"]
+        if changed & {"currency.name_plural", "currency.ranking_page_size"}:
+            self.currency_name_plural = currency_config["name_plural"]
+            self.ranking_page_size = currency_config.get("ranking_page_size", 20)
+            self.ranking_update_pending = True
+        if "currency.ranking_channels" in changed:
+            channel_ids = list(currency_config["ranking_channels"])
+            self.ranking_channels = [channel for channel in self.ranking_channels if channel.id in channel_ids]
+            new_channel_ids = [channel_id for channel_id in channel_ids if channel_id not in self.ranking_channel_ids]
+            self.ranking_channel_ids = channel_ids
+            # Before on_ready the new list is picked up there
+            if self.client.is_ready():
+                for channel_id in new_channel_ids:
+                    await self.add_ranking_channel(channel_id)
+        for key in changed & {"currency.name", "currency.backend", "currency.persistence"}:
+            self.client.logger.warning("{} changed, it is only read when the bot starts".format(key))
 
 
     # endregion
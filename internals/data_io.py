@@ -1,27 +1,60 @@
 import csv
+import os
 from pathlib import Path
-from typing import Dict, Any, AnyStr
+from typing import Dict, Any, AnyStr, Type
 import logging
 
+from internals import LedgerBackend, CsvLedgerBackend, SqliteLedgerBackend, metrics
+
+store_time = metrics.histogram("lithil_dataio_seconds", "Time spent in DataIO operations", operation="store_csv")
+read_time = metrics.histogram("lithil_dataio_seconds", "Time spent in DataIO operations", operation="read_csv")
+
 
 class DataIO:
+    ledger_backends: Dict[str, Type[LedgerBackend]] = {
+        "csv": CsvLedgerBackend,
+        "sqlite": SqliteLedgerBackend,
+    }
+
     def __init__(self, data_path: Path):
+        self.data_path: Path = data_path
         if not data_path.exists():
             data_path.mkdir()
 
+    def open_ledger(self, name: str, config_dict: Dict) -> LedgerBackend:
+        backend = self.ledger_backends[config_dict.get("backend", "csv")](self, name, config_dict)
+        backend.load()
+        return backend
+
     @classmethod
     def store_dict_as_csv(cls, file: Path, data: Dict[AnyStr, Any]):
-        if not file.exists():
-            file.touch()
-        with file.open("w+") as file_io:
-            fieldnames = ['key', 'value']
-            w = csv.DictWriter(file_io, fieldnames=fieldnames)
-            w.writeheader()
-            for key, value in data.items():
-                w.writerow({'key': key, 'value': value})
+        # Write to a temp file and rename it over the old one so a crash never leaves a half written snapshot.
+        # The temp file carries the pid, shards may store the same file at the same time
+        with store_time.time():
+            temp_file = file.with_name("{}.{}.tmp".format(file.name, os.getpid()))
+            with temp_file.open("w", newline="") as file_io:
+                fieldnames = ['key', 'value']
+                w = csv.DictWriter(file_io, fieldnames=fieldnames)
+                w.writeheader()
+                for key, value in data.items():
+                    w.writerow({'key': key, 'value': value})
+                file_io.flush()
+                os.fsync(file_io.fileno())
+            os.replace(str(temp_file), str(file))
+
+    @classmethod
+    def store_text(cls, file: Path, text: str):
+        temp_file = file.with_name("{}.{}.tmp".format(file.name, os.getpid()))
+        temp_file.write_text(text, encoding="utf-8")
+        os.replace(str(temp_file), str(file))
 
     @classmethod
     def read_csv_as_dict(cls, file: Path):
+        with read_time.time():
+            return cls._read_csv_as_dict(file)
+
+    @classmethod
+    def _read_csv_as_dict(cls, file: Path):
         out = {}
         try:
             with file.open("r+") as openfile:
@@ -30,5 +63,5 @@ class DataIO:
                     out[int(row["key"])] = int(row["value"])
             return out
         except FileNotFoundError:
-            logging.getLogger('discord').info("Tried to read from file {} but it does not exist".format(file))
+            logging.getLogger('lithil.data').info("Tried to read from file {} but it does not exist".format(file))
             return out
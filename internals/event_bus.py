@@ -0,0 +1,97 @@
+import asyncio
+import logging
+import time
+from typing import Any, Callable, Coroutine, Dict, List
+
+from internals import metrics, Histogram
+
+logger = logging.getLogger('lithil.events')
+
+
+class EventHandler:
+    __slots__ = ("name", "callback", "priority", "timeout", "ordered", "calls", "errors", "timeouts", "total_time",
+                 "max_time", "latency")
+
+    def __init__(self, name: str, callback: Callable[..., Coroutine[Any, Any, None]], priority: int,
+                 timeout: float, ordered: bool):
+        self.name: str = name
+        self.callback: Callable[..., Coroutine[Any, Any, None]] = callback
+        self.priority: int = priority
+        self.timeout: float = timeout
+        self.ordered: bool = ordered
+        self.calls: int = 0
+        self.errors: int = 0
+        self.timeouts: int = 0
+        self.total_time: float = 0
+        self.max_time: float = 0
+        self.latency: Histogram = metrics.histogram("lithil_event_handler_seconds", "Time spent in each event handler",
+                                                    handler=name)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"calls": self.calls, "errors": self.errors, "timeouts": self.timeouts,
+                "average_time": self.total_time / self.calls if self.calls else 0, "max_time": self.max_time}
+
+
+class EventBus:
+    # Runs the handlers of an event concurrently, highest priority first, under a global concurrency limit.
+    # Each handler gets its own timeout and its errors are logged instead of aborting the other handlers.
+    # Handlers subscribed with ordered=True run one after another, in priority order, in a single chain.
+    def __init__(self, max_concurrency: int = 16, default_timeout: float = 30):
+        self.handlers: Dict[str, List[EventHandler]] = {}
+        self.default_timeout: float = default_timeout
+        self.semaphore: asyncio.Semaphore = asyncio.Semaphore(max_concurrency)
+
+    def subscribe(self, event: str, callback: Callable[..., Coroutine[Any, Any, None]], priority: int = 0,
+                  timeout: float = None, ordered: bool = False, name: str = None) -> EventHandler:
+        handler = EventHandler(name or callback.__qualname__, callback, priority,
+                               self.default_timeout if timeout is None else timeout, ordered)
+        handlers = self.handlers.setdefault(event, [])
+        handlers.append(handler)
+        handlers.sort(key=lambda h: h.priority, reverse=True)
+        return handler
+
+    def unsubscribe(self, event: str, callback: Callable[..., Coroutine[Any, Any, None]]):
+        self.handlers[event] = [handler for handler in self.handlers.get(event, []) if handler.callback != callback]
+
+    async def dispatch(self, event: str, *args):
+        handlers = self.handlers.get(event)
+        if not handlers:
+            return
+        ordered = [handler for handler in handlers if handler.ordered]
+        runs = [self._run(handler, args) for handler in handlers if not handler.ordered]
+        if ordered:
+            runs.insert(0, self._run_chain(ordered, args))
+        if len(runs) == 1:
+            await runs[0]
+        else:
+            await asyncio.gather(*runs)
+
+    async def _run_chain(self, handlers: List[EventHandler], args: tuple):
+        for handler in handlers:
+            await self._run(handler, args)
+
+    async def _run(self, handler: EventHandler, args: tuple):
+        async with self.semaphore:
+            start = time.perf_counter()
+            try:
+                if handler.timeout:
+                    await asyncio.wait_for(handler.callback(*args), handler.timeout)
+                else:
+                    await handler.callback(*args)
+            except asyncio.TimeoutError:
+                handler.timeouts += 1
+                logger.warning("Handler %s timed out after %s seconds", handler.name, handler.timeout)
+            except Exception:
+                handler.errors += 1
+                logger.exception("Handler %s failed", handler.name)
+            finally:
+                elapsed = time.perf_counter() - start
+                handler.calls += 1
+                handler.total_time += elapsed
+                if elapsed > handler.max_time:
+                    handler.max_time = elapsed
+                handler.latency.observe(elapsed)
+
+    def stats(self) -> Dict[str, Dict[str, Dict[str, Any]]]:
+        return {event: {handler.name: handler.stats() for handler in handlers}
+                for event, handlers in self.handlers.items()}
@@ -0,0 +1,157 @@
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, TextIO, Tuple
+import logging
+
+from internals import metrics
+
+fsync_time = metrics.histogram("lithil_dataio_seconds", "Time spent in DataIO operations", operation="journal_fsync")
+
+
+# Append-only log of "key,value" rows replayed on top of the last snapshot. Changes that must persist together share
+# one row as "key,value;key,value", a torn row is dropped whole.
+# Rows hold absolute values so replaying one twice is harmless, fsync is batched by size or interval.
+# Appends never fsync, flush_if_due is called from the executor. They only take a short lock, the fsync itself runs
+# outside it so a flush never blocks them.
+class Journal:
+
+    def __init__(self, file: Path, flush_interval: float = 5, flush_size: int = 100):
+        self.file: Path = file
+        # Entries written before the snapshot currently being stored, replayed before the live journal
+        self.rotated_file: Path = file.with_name(file.name + ".compacting")
+        self.flush_interval: float = flush_interval
+        self.flush_size: int = flush_size
+        self.pending_entries: int = 0
+        self.entries_since_compaction: int = 0
+        self.last_flush: float = time.monotonic()
+        self._file_io: TextIO = None
+        self._lock = threading.Lock()
+        # Held while fsyncing so the file can't be closed under it
+        self._fsync_lock = threading.Lock()
+
+    def open(self):
+        with self._lock:
+            self._open()
+
+    def _open(self):
+        if self._file_io is None:
+            # A torn row would otherwise be glued to the next one and read back as a valid row
+            self.discard_torn_tail(self.file)
+            self._file_io = self.file.open("a", encoding="utf-8")
+
+    @staticmethod
+    def discard_torn_tail(file: Path):
+        # Cuts the file after its last newline, what follows is a row that was being written when we crashed
+        try:
+            file_io = file.open("rb+")
+        except FileNotFoundError:
+            return
+        with file_io:
+            end = file_io.seek(0, os.SEEK_END)
+            position = end
+            while position > 0:
+                start = max(position - 4096, 0)
+                file_io.seek(start)
+                newline = file_io.read(position - start).rfind(b"\n")
+                if newline != -1:
+                    position = start + newline + 1
+                    break
+                position = start
+            if position != end:
+                logging.getLogger('lithil.bank').warning("Discarding torn journal entry in {}".format(file))
+                file_io.truncate(position)
+                file_io.flush()
+                os.fsync(file_io.fileno())
+
+    def close(self):
+        with self._fsync_lock, self._lock:
+            self._close()
+
+    def _close(self):
+        if self._file_io is not None:
+            self._file_io.flush()
+            os.fsync(self._file_io.fileno())
+            self._file_io.close()
+            self._file_io = None
+            self.pending_entries = 0
+
+    def append(self, key: int, value: int):
+        self.append_many([(key, value)])
+
+    def append_many(self, entries: List[Tuple[int, int]]):
+        with self._lock:
+            self._open()
+            self._file_io.write(";".join("{},{}".format(key, value) for key, value in entries) + "\n")
+            self.pending_entries += len(entries)
+            self.entries_since_compaction += len(entries)
+
+    def flush(self):
+        with self._fsync_lock:
+            with self._lock:
+                if self.pending_entries == 0 or self._file_io is None:
+                    return
+                self._file_io.flush()
+                self.pending_entries = 0
+                self.last_flush = time.monotonic()
+            with fsync_time.time():
+                os.fsync(self._file_io.fileno())
+
+    def flush_due(self) -> bool:
+        return self.pending_entries >= self.flush_size or \
+            (self.pending_entries and time.monotonic() - self.last_flush >= self.flush_interval)
+
+    def flush_if_due(self):
+        if self.flush_due():
+            self.flush()
+
+    def replay(self, data: Dict[int, int]) -> Dict[int, int]:
+        for file in (self.rotated_file, self.file):
+            try:
+                with file.open("r", encoding="utf-8") as file_io:
+                    for line in file_io:
+                        # Only the last line can be torn, it is the one being written when we crashed. A row is
+                        # complete once its newline is written, before that even a row that parses may be cut short
+                        try:
+                            if not line.endswith("\n"):
+                                raise ValueError("no newline")
+                            entries = [(int(key), int(value)) for key, value in
+                                       (entry.split(",") for entry in line[:-1].split(";"))]
+                        except ValueError:
+                            logging.getLogger('lithil.bank').warning("Ignoring torn journal entry in {}".format(file))
+                            continue
+                        # Parsed whole before anything is applied, so a row is never half replayed
+                        data.update(entries)
+            except FileNotFoundError:
+                pass
+        return data
+
+    def rotate(self):
+        # Moves the current entries aside and starts an empty journal. Call it at the moment the snapshot is taken
+        # and discard_rotated once the snapshot is on disk; until then a crash replays both files.
+        with self._fsync_lock, self._lock:
+            self._close()
+            if self.file.exists():
+                if self.rotated_file.exists():
+                    # A previous compaction never finished, its entries are not in any snapshot yet
+                    self.discard_torn_tail(self.rotated_file)
+                    with self.rotated_file.open("a", encoding="utf-8") as rotated_io:
+                        rotated_io.write(self.file.read_text(encoding="utf-8"))
+                        rotated_io.flush()
+                        os.fsync(rotated_io.fileno())
+                    self.file.unlink()
+                else:
+                    self.file.replace(self.rotated_file)
+            self.entries_since_compaction = 0
+            self._open()
+
+    def discard_rotated(self):
+        try:
+            self.rotated_file.unlink()
+        except FileNotFoundError:
+            pass
+
+    def truncate(self):
+        self.rotate()
+        self.discard_rotated()
@@ -0,0 +1,387 @@
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from itertools import islice
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple, TYPE_CHECKING
+import logging
+
+from internals import Journal, RankIndex, metrics
+
+if TYPE_CHECKING:
+    from internals import DataIO
+
+sqlite_flush_time = metrics.histogram("lithil_dataio_seconds", "Time spent in DataIO operations",
+                                      operation="sqlite_flush")
+
+
+class LedgerBackend(ABC):
+    # Ledgers are used from the event loop and from executor threads, every method takes self.lock where needed.
+    # Callers doing read-modify-write sequences hold it around the whole sequence, it is reentrant.
+    def __init__(self, data_io: 'DataIO', name: str, config_dict: Dict):
+        self.data_io: 'DataIO' = data_io
+        self.name: str = name
+        self.lock: threading.RLock = threading.RLock()
+        # Serializes writes to disk, which happen outside self.lock. It is always taken before self.lock, so code
+        # that may already hold self.lock only tries to take it without blocking
+        self.store_lock: threading.Lock = threading.Lock()
+        self.flush_interval: float = config_dict.get("flush_interval", 5)
+        self.flush_size: int = config_dict.get("flush_size", 100)
+
+    @abstractmethod
+    def load(self) -> None:
+        pass
+
+    @abstractmethod
+    def get(self, key: int) -> int:
+        pass
+
+    @abstractmethod
+    def set(self, key: int, value: int, store: bool = True) -> None:
+        pass
+
+    @abstractmethod
+    def items(self) -> Iterable[Tuple[int, int]]:
+        pass
+
+    @abstractmethod
+    def ranking_slice(self, start: int, count: int = None) -> List[Tuple[int, int]]:
+        pass
+
+    @abstractmethod
+    def rank(self, key: int) -> Optional[int]:
+        pass
+
+    def top(self, n: int = None) -> List[Tuple[int, int]]:
+        return self.ranking_slice(0, n)
+
+    def increment(self, key: int, delta: int, store: bool = True) -> None:
+        with self.lock:
+            self.set(key, self.get(key) + delta, store)
+
+    @abstractmethod
+    def apply_deltas(self, deltas: Dict[int, int], store: bool = True) -> None:
+        # Several balance changes that are persisted together or not at all
+        pass
+
+    def poll_external_changes(self) -> bool:
+        # Whether another process changed the ledger since the last call
+        return False
+
+    @abstractmethod
+    def tick(self) -> None:
+        pass
+
+    @abstractmethod
+    def store(self, blocking: bool = True) -> None:
+        pass
+
+    @abstractmethod
+    def close(self) -> None:
+        pass
+
+
+class CsvLedgerBackend(LedgerBackend):
+    # Whole ledger in memory, persisted as a csv snapshot plus an optional write-behind journal
+    def __init__(self, data_io: 'DataIO', name: str, config_dict: Dict):
+        super().__init__(data_io, name, config_dict)
+        self.data_file: Path = data_io.data_path / (name + ".csv")
+        self.journal_file: Path = data_io.data_path / (name + ".journal")
+        self.compaction_interval: float = config_dict.get("compaction_interval", 300)
+        self.last_compaction: float = time.monotonic()
+        self.journal: Journal = None
+        if config_dict.get("persistence", "journal") == "journal":
+            self.journal = Journal(self.journal_file, self.flush_interval, self.flush_size)
+        self._data: Dict[int, int] = {}
+        self._ranking: RankIndex = RankIndex()
+        self._dirty: bool = False
+
+    def load(self) -> None:
+        self._data = self.data_io.read_csv_as_dict(self.data_file)
+        if self.journal is not None:
+            self.journal.replay(self._data)
+            self.store()
+        self._ranking = RankIndex()
+        for key, value in self._data.items():
+            self._ranking.insert((-value, key))
+
+    def get(self, key: int) -> int:
+        return self._data.get(key, 0)
+
+    def set(self, key: int, value: int, store: bool = True) -> None:
+        with self.lock:
+            self._set_in_memory(key, value)
+            if store and self.journal is not None:
+                self.journal.append(key, value)
+            else:
+                # Without a journal the next tick rewrites the snapshot
+                self._dirty = True
+
+    def apply_deltas(self, deltas: Dict[int, int], store: bool = True) -> None:
+        with self.lock:
+            entries = [(key, self._data.get(key, 0) + delta) for key, delta in deltas.items()]
+            for key, value in entries:
+                self._set_in_memory(key, value)
+            # One journal row, replayed whole or not at all
+            if store and self.journal is not None:
+                self.journal.append_many(entries)
+            else:
+                self._dirty = True
+
+    def _set_in_memory(self, key: int, value: int) -> None:
+        old_value = self._data.get(key)
+        if old_value is not None:
+            self._ranking.remove((-old_value, key))
+        self._ranking.insert((-value, key))
+        self._data[key] = value
+
+    def items(self) -> Iterable[Tuple[int, int]]:
+        with self.lock:
+            return list(self._data.items())
+
+    def ranking_slice(self, start: int, count: int = None) -> List[Tuple[int, int]]:
+        with self.lock:
+            return [(key, -negative_value) for negative_value, key in islice(self._ranking.iterate_from(start), count)]
+
+    def rank(self, key: int) -> Optional[int]:
+        with self.lock:
+            try:
+                return self._ranking.rank((-self._data[key], key)) + 1
+            except KeyError:
+                return None
+
+    def tick(self) -> None:
+        if self.journal is None:
+            if self._dirty:
+                self.store()
+            return
+        self.journal.flush_if_due()
+        if (self.journal.entries_since_compaction or self._dirty) and \
+                time.monotonic() - self.last_compaction >= self.compaction_interval:
+            self.store()
+
+    def store(self, blocking: bool = True) -> None:
+        # With a journal this is the compaction step: copy the ledger and rotate the journal at the same instant,
+        # write the copy without holding the lock, then drop the rotated entries it already contains
+        if not self.store_lock.acquire(blocking):
+            return
+        try:
+            with self.lock:
+                snapshot = dict(self._data)
+                if self.journal is not None:
+                    self.journal.rotate()
+                self._dirty = False
+                self.last_compaction = time.monotonic()
+            self.data_io.store_dict_as_csv(self.data_file, snapshot)
+            if self.journal is not None:
+                self.journal.discard_rotated()
+        finally:
+            self.store_lock.release()
+
+    def close(self) -> None:
+        self.store()
+        if self.journal is not None:
+            self.journal.close()
+
+
+class SqliteLedgerBackend(LedgerBackend):
+    # Ledger kept in <name>.sqlite3, only the writes of the current batch live in memory
+    def __init__(self, data_io: 'DataIO', name: str, config_dict: Dict):
+        super().__init__(data_io, name, config_dict)
+        self.database_file: Path = data_io.data_path / (name + ".sqlite3")
+        # One connection per thread, WAL lets the loop keep reading while an executor thread commits a batch
+        self._local = threading.local()
+        self._connections: List[sqlite3.Connection] = []
+        # Writes not committed yet as (absolute, amount): absolute ones replace the balance, the others are added to it
+        # when committed, so increments from several processes sharing the database never overwrite each other
+        self._pending: Dict[int, Tuple[bool, int]] = {}
+        # The batch being committed right now, still visible to get() until the commit finishes
+        self._flushing: Dict[int, Tuple[bool, int]] = {}
+        self._data_version: int = None
+        self.last_flush: float = time.monotonic()
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(str(self.database_file), isolation_level=None, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+            with self.lock:
+                self._connections.append(connection)
+        return connection
+
+    def load(self) -> None:
+        self.connection.execute("CREATE TABLE IF NOT EXISTS ledger ("
+                                "user_id INTEGER PRIMARY KEY, balance INTEGER NOT NULL)")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS ledger_balance ON ledger (balance DESC, user_id)")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        self.migrate_from_csv()
+
+    def migrate_from_csv(self) -> None:
+        # Checked inside the write transaction, every shard runs this at startup and only one may migrate
+        with self.transaction():
+            if self.connection.execute("SELECT 1 FROM meta WHERE key = 'migrated_from_csv'").fetchone():
+                return
+            csv_ledger = CsvLedgerBackend(self.data_io, self.name, {"persistence": "journal"})
+            if not (csv_ledger.data_file.exists() or csv_ledger.journal_file.exists()):
+                self.connection.execute("INSERT INTO meta (key, value) VALUES ('migrated_from_csv', '')")
+                return
+            csv_ledger.load()
+            csv_ledger.journal.close()
+            self.connection.executemany("INSERT OR REPLACE INTO ledger (user_id, balance) VALUES (?, ?)",
+                                        csv_ledger.items())
+            self.connection.execute("INSERT INTO meta (key, value) VALUES ('migrated_from_csv', ?)",
+                                    (str(csv_ledger.data_file),))
+        # Keep the old files around but out of the way, so switching back never loads stale balances
+        csv_ledger.data_file.replace(csv_ledger.data_file.with_name(csv_ledger.data_file.name + ".migrated"))
+        csv_ledger.journal_file.unlink()
+        logging.getLogger('lithil.bank').info("Migrated {} balances from {} to {}"
+                                          .format(len(csv_ledger.items()), csv_ledger.data_file,
+                                                  self.database_file))
+
+    def transaction(self) -> 'SqliteTransaction':
+        return SqliteTransaction(self.connection)
+
+    @staticmethod
+    def combine(first: Optional[Tuple[bool, int]], then: Tuple[bool, int]) -> Tuple[bool, int]:
+        if first is None or then[0]:
+            return then
+        return first[0], first[1] + then[1]
+
+    def get(self, key: int) -> int:
+        # The database is read under the lock so a batch can't be committed and counted twice meanwhile
+        with self.lock:
+            pending = self._pending.get(key)
+            if pending is not None and pending[0]:
+                return pending[1]
+            flushing = self._flushing.get(key)
+            if flushing is not None and flushing[0]:
+                balance = flushing[1]
+            else:
+                row = self.connection.execute("SELECT balance FROM ledger WHERE user_id = ?", (key,)).fetchone()
+                balance = (row[0] if row else 0) + (flushing[1] if flushing is not None else 0)
+            return balance + (pending[1] if pending is not None else 0)
+
+    def set(self, key: int, value: int, store: bool = True) -> None:
+        self._write(key, (True, value), store)
+
+    def increment(self, key: int, delta: int, store: bool = True) -> None:
+        # No read at all, the addition happens in the database when the batch is committed
+        self._write(key, (False, delta), store)
+
+    def apply_deltas(self, deltas: Dict[int, int], store: bool = True) -> None:
+        # All of them land in the same pending batch, so the same sqlite transaction commits them
+        with self.lock:
+            for key, delta in deltas.items():
+                self._pending[key] = self.combine(self._pending.get(key), (False, delta))
+
+    def _write(self, key: int, operation: Tuple[bool, int], store: bool) -> None:
+        # Writes only join the pending batch, tick commits it from the executor
+        with self.lock:
+            self._pending[key] = self.combine(self._pending.get(key), operation)
+
+    def items(self) -> Iterable[Tuple[int, int]]:
+        # The committed balances with the batches not committed yet applied on top, like get()
+        with self.lock:
+            balances = dict(self.connection.execute("SELECT user_id, balance FROM ledger").fetchall())
+            for batch in (self._flushing, self._pending):
+                for key, (absolute, amount) in batch.items():
+                    balances[key] = amount if absolute else balances.get(key, 0) + amount
+        return list(balances.items())
+
+    # The ranking is read from the committed balances, at most flush_interval behind. A commit changes the
+    # data_version poll_external_changes watches, so the rankings are rendered again once it lands
+    def ranking_slice(self, start: int, count: int = None) -> List[Tuple[int, int]]:
+        return self.connection.execute("SELECT user_id, balance FROM ledger ORDER BY balance DESC, user_id "
+                                       "LIMIT ? OFFSET ?", (-1 if count is None else count, start)).fetchall()
+
+    def rank(self, key: int) -> Optional[int]:
+        row = self.connection.execute("SELECT balance FROM ledger WHERE user_id = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        # Range scan over the balance index, only walks the users ranked above this one
+        return self.connection.execute("SELECT COUNT(*) FROM ledger WHERE balance > ? OR (balance = ? AND user_id < ?)",
+                                       (row[0], row[0], key)).fetchone()[0] + 1
+
+    def flush(self, blocking: bool = True) -> None:
+        if not self.store_lock.acquire(blocking):
+            return
+        try:
+            with self.lock:
+                batch, self._pending = self._pending, {}
+                self._flushing = batch
+            if batch:
+                with sqlite_flush_time.time():
+                    self._commit(batch)
+            with self.lock:
+                self._flushing = {}
+                self.last_flush = time.monotonic()
+        finally:
+            self.store_lock.release()
+
+    def _commit(self, batch: Dict[int, Tuple[bool, int]]) -> None:
+        connection = self.connection
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            connection.executemany("INSERT INTO ledger (user_id, balance) VALUES (?, ?) "
+                                   "ON CONFLICT (user_id) DO UPDATE SET balance = excluded.balance",
+                                   [(key, amount) for key, (absolute, amount) in batch.items() if absolute])
+            connection.executemany("INSERT INTO ledger (user_id, balance) VALUES (?, ?) "
+                                   "ON CONFLICT (user_id) DO UPDATE SET balance = balance + excluded.balance",
+                                   [(key, amount) for key, (absolute, amount) in batch.items() if not absolute])
+        except BaseException:
+            connection.execute("ROLLBACK")
+            # Put the batch back under whatever was written meanwhile so the next flush retries it
+            with self.lock:
+                for key, operation in self._pending.items():
+                    batch[key] = self.combine(batch.get(key), operation)
+                self._pending = batch
+                self._flushing = {}
+            raise
+        with self.lock:
+            connection.execute("COMMIT")
+            self._flushing = {}
+
+    def tick(self) -> None:
+        if len(self._pending) >= self.flush_size or \
+                (self._pending and time.monotonic() - self.last_flush >= self.flush_interval):
+            self.flush()
+
+    def poll_external_changes(self) -> bool:
+        # data_version changes whenever another connection, possibly in another shard, commits
+        version = self.connection.execute("PRAGMA data_version").fetchone()[0]
+        changed = self._data_version is not None and version != self._data_version
+        self._data_version = version
+        return changed
+
+    def store(self, blocking: bool = True) -> None:
+        self.flush(blocking)
+        if self.store_lock.acquire(blocking):
+            try:
+                self.connection.execute("PRAGMA wal_checkpoint(PASSIVE)")
+            finally:
+                self.store_lock.release()
+
+    def close(self) -> None:
+        self.store()
+        with self.lock:
+            for connection in self._connections:
+                connection.close()
+            self._connections = []
+            self._local = threading.local()
+
+
+class SqliteTransaction:
+    def __init__(self, connection: sqlite3.Connection):
+        self.connection = connection
+
+    def __enter__(self):
+        self.connection.execute("BEGIN IMMEDIATE")
+        return self.connection
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.connection.execute("ROLLBACK" if exc_type else "COMMIT")
+        return False
@@ -1,77 +1,140 @@
 from __future__ import annotations
 import asyncio
+import functools
 import logging
 import signal
 from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import List, Callable, Coroutine, Any
+from typing import List, Callable, Mapping, Set, TypeVar
 
 import discord
-from discord import Message, TextChannel
+from discord import Message, TextChannel, Member, VoiceState
 
-from internals import CurrencyManager, CommandContainer, Config, DataIO, Call, Watcher
+from internals import ChannelManager, CurrencyManager, CommandContainer, Config, DataIO, Call, Watcher, LogPipeline, \
+    EventBus, VoiceSessionTracker, MemberDirectory, MetricsRegistry, OutboundQueue, SamplingProfiler, metrics
+
+
+T = TypeVar("T")
 
 
 class LithilClient(discord.Client):
     def __init__(self, bot_path: Path, *args, **kwargs):
 
         super().__init__(**kwargs)
+        # Sharded processes share data/, everything they write on their own gets the shard in the file name
+        self.sharded: bool = self.shard_id is not None
         # Path setting
         self.bot_path = bot_path
         self.config_path = bot_path / "config"
         self.command_path = bot_path / "commands"
         self.data_path = bot_path / "data"
-        self.log_file = bot_path / "lithil.log"
-
-        # EventLists
-        self.on_message_events: List[Callable[[Message], Coroutine[Any, Any, None]]] = []
-        self.on_ready_events: List[Callable[[], Coroutine[Any, Any, None]]] = []
-        self.on_close_events: List[Callable[[], Coroutine[Any, Any, None]]] = []
-        self.watchers: List[Watcher] = []
-
-        # Logging
+        self.log_file = bot_path / self.shard_file_name("lithil.log")
 
-        self.logger = logging.getLogger('discord')
-        self.logger.setLevel(logging.INFO)
-        self.logging_file_handler = logging.FileHandler(filename=str(self.log_file.absolute()), encoding='utf-8',
-                                                        mode='w')
-        self.logging_file_handler.setFormatter(logging.Formatter('%(asctime)s:%(levelname)s:%(name)s: %(message)s'))
-        self.logger.addHandler(self.logging_file_handler)
 
         # Config
         self.data_manager = DataIO(self.data_path)
         self.config: Config = Config(self.config_path)
+
+        # Logging
+        self.log_pipeline = LogPipeline(self.log_file, self.config.get("logging") or {})
+        self.log_pipeline.start()
+        self.logger = logging.getLogger('lithil')
+        self.message_logger = logging.getLogger('lithil.messages')
+
+        # Metrics
+        self.metrics: MetricsRegistry = metrics
+        metrics_file = (self.config.get("metrics") or {}).get("file")
+        self.metrics_file: Path = self.data_path / self.shard_file_name(metrics_file) if metrics_file else None
+
+        # Events
+        events_config = self.config.get("events") or {}
+        self.events: EventBus = EventBus(events_config.get("max_concurrency", 16),
+                                         events_config.get("handler_timeout", 30))
+
+        self.events.subscribe("config_change", self.on_config_change)
+
         self.token = self.config["token"]
-        self.bank: CurrencyManager = CurrencyManager(self, self.config["currency"])
+        self.outbound: OutboundQueue = OutboundQueue(self, self.config.get("outbound") or {})
+        channels_config = self.config.get("info_channels") or {}
+        self.channel_manager: ChannelManager = ChannelManager(
+            self, self.data_path / self.shard_file_name(channels_config.get("file") or "info_channels.json"))
+        currency_config = self.config["currency"]
+        if self.sharded:
+            self.logger.info("Running shard {} of {}".format(self.shard_id, self.shard_count))
+            if currency_config.get("backend", "csv") != "sqlite":
+                # The csv ledger lives in memory, each shard would keep and overwrite its own copy
+                self.logger.warning("The {} ledger can't be shared between shards, using sqlite"
+                                    .format(currency_config.get("backend", "csv")))
+                currency_config = dict(currency_config, backend="sqlite")
+        self.bank: CurrencyManager = CurrencyManager(self, currency_config)
+        self.voice_tracker: VoiceSessionTracker = VoiceSessionTracker(self, self.config["currency"])
+        members_config = self.config.get("members") or {}
+        self.member_directory: MemberDirectory = MemberDirectory(
+            self, self.data_path / self.shard_file_name(members_config.get("file") or "member_names.json"),
+            members_config)
+        self.profiler: SamplingProfiler = SamplingProfiler(self, self.config.get("profiler") or {})
         self.log_channel: TextChannel = None
         self.command_container: CommandContainer = CommandContainer(self.config['commands'], self.command_path, self)
 
         self.watching_voice_channels = False
-        self.process_pool = ThreadPoolExecutor(5)
+        self.stopping = False
+        executor_config = self.config.get("executor") or {}
+        self.thread_pool = ThreadPoolExecutor(executor_config.get("pool_size", 5), thread_name_prefix="lithil")
+        self.watchers: List[Watcher] = Watcher.for_client(self)
         try:
             self.loop.add_signal_handler(signal.SIGTERM, lambda: asyncio.ensure_future(self.stop_bot()))
         except NotImplementedError:
             pass
 
+    def shard_file_name(self, name: str) -> str:
+        if not self.sharded:
+            return name
+        path = Path(name)
+        return "{}.shard{}{}".format(path.stem, self.shard_id, path.suffix)
+
+    async def send_to_log_channel(self, text: str):
+        # With several shards the log channel only exists for the one holding its guild
+        if self.log_channel is not None:
+            await self.outbound.send(self.log_channel, text)
+
+    async def run_blocking(self, func: Callable[..., T], *args, **kwargs) -> T:
+        return await self.loop.run_in_executor(self.thread_pool, functools.partial(func, *args, **kwargs))
+
     async def on_ready(self):
         self.logger.info("Logged on as {0}".format(self.user))
         self.log_channel = self.get_channel(self.config["log_channel"])
-        self.logger.info("Log channel is {0} with ID {1}".format(self.log_channel.name, self.log_channel.id))
+        if self.log_channel is not None:
+            self.logger.info("Log channel is {0} with ID {1}".format(self.log_channel.name, self.log_channel.id))
+        else:
+            self.logger.info("Log channel {0} is not visible from this shard".format(self.config["log_channel"]))
         self.logger.info("starting on_ready events")
-        for event in self.on_ready_events:
-            await event()
+        await self.events.dispatch("ready")
         self.logger.info("on_ready events done, starting watchers")
         for watcher in self.watchers:
             watcher.start_watching()
         self.logger.info("Lithil On")
-        await self.log_channel.send("Lithil On")
+        await self.send_to_log_channel("Lithil On")
+
 
+    async def on_config_change(self, config: Mapping, changed: Set[str]):
+        if "logging" in changed:
+            self.log_pipeline.configure(config.get("logging") or {})
+        if "log_channel" in changed and self.is_ready():
+            self.log_channel = self.get_channel(config["log_channel"])
 
     async def on_message(self, message: Message):
         if not message.author.bot:
-            self.logger.info('Message from {0.author}: {0.content}'.format(message))
-            for on_message_event in self.on_message_events:
-                await on_message_event(message)
+            if self.log_pipeline.should_log_message() and self.message_logger.isEnabledFor(logging.INFO):
+                self.message_logger.info('Message from %s: %s', message.author, message.content,
+                                         extra={"data": {"author_id": message.author.id,
+                                                         "channel_id": message.channel.id}})
+            await self.events.dispatch("message", message)
+
+    async def on_voice_state_update(self, member: Member, before: VoiceState, after: VoiceState):
+        await self.events.dispatch("voice_state_update", member, before, after)
+
+    async def on_member_update(self, before: Member, after: Member):
+        await self.events.dispatch("member_update", before, after)
 
     def run_bot(self):
         async def runner():
@@ -90,12 +153,20 @@ class LithilClient(discord.Client):
             future.remove_done_callback(self.loop.stop)
 
     async def stop_bot(self):
+        # SIGTERM and the end of run_bot's runner both stop the bot, and a sharded bot gets SIGTERM from the supervisor
+        if self.stopping:
+            return
+        self.stopping = True
         self.logger.info(msg="Apagando")
-        await self.log_channel.send("Lithil Off")
-        for event in self.on_close_events:
-            event()
+        await self.send_to_log_channel("Lithil Off")
+        # Before the close handlers, a THREAD watcher may still be writing the ledgers they close
+        await asyncio.gather(*(watcher.stop_and_wait() for watcher in self.watchers))
+        await self.events.dispatch("close")
         self.watching_voice_channels = False
         await self.logout()
+        # Waiting for the pool's threads would block the loop, the default executor waits instead
+        await self.loop.run_in_executor(None, functools.partial(self.thread_pool.shutdown, wait=True))
+        self.log_pipeline.stop()
         self.loop.stop()
 
     # TODO Añadir decorators para convertir las funciones en eventos automáticamente
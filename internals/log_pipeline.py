@@ -0,0 +1,108 @@
+import copy
+import json
+import logging
+import queue
+import random
+import time
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from pathlib import Path
+from typing import Dict
+
+
+class JsonLineFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        data = getattr(record, "data", None)
+        if data:
+            entry["data"] = data
+        # Formatted by LogQueueHandler, the traceback can't cross the queue
+        exception = getattr(record, "exception", None)
+        if exception:
+            entry["exception"] = exception
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class LogQueueHandler(QueueHandler):
+    # QueueHandler.prepare folds the traceback into the message and drops exc_info, keep it apart for the json
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        exception = None
+        if record.exc_info:
+            exception = logging.Formatter().formatException(record.exc_info)
+        if record.stack_info:
+            exception = "{}\n{}".format(exception, record.stack_info) if exception else record.stack_info
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        record.exc_info = None
+        record.exc_text = None
+        record.stack_info = None
+        record.exception = exception
+        return record
+
+
+class SizeAndTimeRotatingFileHandler(RotatingFileHandler):
+    # RotatingFileHandler only rolls over by size, this one also rolls over every rotation_interval seconds
+    def __init__(self, filename: str, max_bytes: int, backup_count: int, rotation_interval: float):
+        super().__init__(filename, maxBytes=max_bytes, backupCount=backup_count, encoding="utf-8")
+        self.rotation_interval: float = rotation_interval
+        self.rollover_at: float = time.time() + rotation_interval
+
+    def shouldRollover(self, record: logging.LogRecord) -> int:
+        if self.rotation_interval and time.time() >= self.rollover_at:
+            return 1
+        return super().shouldRollover(record)
+
+    def doRollover(self):
+        super().doRollover()
+        self.rollover_at = time.time() + self.rotation_interval
+
+
+class LogPipeline:
+    # Callers only put records on a queue, a QueueListener thread does the json formatting and the disk writes
+    logger_names = ["discord", "lithil"]
+
+    def __init__(self, log_file: Path, config_dict: Dict):
+        self.queue: queue.SimpleQueue = queue.SimpleQueue()
+        self.file_handler = SizeAndTimeRotatingFileHandler(str(log_file.absolute()),
+                                                           config_dict.get("max_bytes", 10 * 1024 * 1024),
+                                                           config_dict.get("backup_count", 5),
+                                                           config_dict.get("rotation_interval", 24 * 60 * 60))
+        self.file_handler.setFormatter(JsonLineFormatter())
+        self.queue_handler = LogQueueHandler(self.queue)
+        self.listener = QueueListener(self.queue, self.file_handler)
+        self.message_sample_rate: float = 1.0
+        self.running: bool = False
+
+        for name in self.logger_names:
+            logger = logging.getLogger(name)
+            logger.setLevel(logging.INFO)
+            logger.addHandler(self.queue_handler)
+        self.configure(config_dict)
+
+    def configure(self, config_dict: Dict):
+        # What can change without reopening the log file, used again when the config is reloaded
+        self.message_sample_rate = config_dict.get("message_sample_rate", 1.0)
+        for name, level in (config_dict.get("levels") or {}).items():
+            logging.getLogger(name).setLevel(level)
+
+    def start(self):
+        if not self.running:
+            self.running = True
+            self.listener.start()
+
+    def stop(self):
+        # Flushes what is queued and closes the log file, what is logged afterwards is not written anywhere
+        if self.running:
+            self.running = False
+            self.listener.stop()
+            for name in self.logger_names:
+                logging.getLogger(name).removeHandler(self.queue_handler)
+            self.file_handler.close()
+
+    def should_log_message(self) -> bool:
+        return self.message_sample_rate >= 1 or random.random() < self.message_sample_rate
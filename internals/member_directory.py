@@ -0,0 +1,146 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Set, TYPE_CHECKING
+
+import discord
+from discord import Member, Message, User
+
+from internals import DataIO, metrics
+
+if TYPE_CHECKING:
+    from internals import LithilClient
+
+logger = logging.getLogger('lithil.members')
+
+
+class MemberDirectory:
+    # Display names by guild and user id (nicknames are per guild, 0 holds the names of direct messages, like the
+    # ledger partitions), persisted so listings render right after a restart without asking discord for every user.
+    # Names are learned from the events the bot already receives, the few it never saw are queued and fetched from
+    # their guild in the background in batches, renders in the meantime fall back to a mention
+    version = 2
+
+    def __init__(self, client: 'LithilClient', file: Path, config_dict: Dict):
+        self.client = client
+        self.file: Path = file
+        self.names: Dict[int, Dict[int, str]] = {}
+        # By guild id, like names
+        self.missing: Dict[int, Set[int]] = {}
+        # Ids their guild didn't return, not asked for again until the bot restarts
+        self.not_found: Dict[int, Set[int]] = {}
+        self.dirty: bool = False
+        # A gateway member request takes at most 100 ids
+        self.batch_size: int = min(config_dict.get("fetch_batch_size", 100), 100)
+        self.max_fetches: int = config_dict.get("max_fetches_per_tick", 1000)
+        self.fetch_concurrency: asyncio.Semaphore = asyncio.Semaphore(config_dict.get("fetch_concurrency", 2))
+        self.lookups = {result: metrics.counter("lithil_member_lookups_total", "Member name lookups", result=result)
+                        for result in ("hit", "miss")}
+        self.fetched = metrics.counter("lithil_member_fetches_total", "Members fetched from discord")
+        self.load()
+
+        self.client.events.subscribe("message", self.on_message)
+        self.client.events.subscribe("member_update", self.on_member_update)
+        self.client.events.subscribe("close", self.on_close, ordered=True)
+
+    def load(self):
+        try:
+            directory = json.loads(self.file.read_text(encoding="utf-8"))
+        except FileNotFoundError:
+            return
+        except ValueError:
+            logger.warning("Ignoring unreadable member directory %s", self.file)
+            return
+        if directory.get("version") == self.version:
+            self.names = {int(guild_id): {int(user_id): name for user_id, name in names.items()}
+                          for guild_id, names in directory.get("names", {}).items()}
+
+    def store(self, names: Dict[int, Dict[int, str]]):
+        DataIO.store_text(self.file, json.dumps({"version": self.version, "names": names}))
+
+    async def persist(self):
+        # The copy is taken on the event loop, the only place that changes names
+        if self.dirty:
+            self.dirty = False
+            await self.client.run_blocking(self.store, {guild_id: dict(names)
+                                                        for guild_id, names in self.names.items()})
+
+    def remember(self, user: User):
+        guild_id = self.client.bank.partition_of(user)
+        names = self.names.setdefault(guild_id, {})
+        if names.get(user.id) != user.display_name:
+            names[user.id] = user.display_name
+            self.dirty = True
+        missing = self.missing.get(guild_id)
+        if missing is not None:
+            missing.discard(user.id)
+
+    def display_name(self, guild_id: int, user_id: int) -> str:
+        name = self.names.get(guild_id, {}).get(user_id)
+        if name is not None:
+            self.lookups["hit"].inc()
+            return name
+        self.lookups["miss"].inc()
+        guild = self.client.get_guild(guild_id) if guild_id else None
+        user = guild.get_member(user_id) if guild is not None else self.client.get_user(user_id)
+        if user is not None:
+            self.remember(user)
+            return user.display_name
+        # Only a guild can be asked for the members it doesn't have cached
+        if guild is not None and user_id not in self.not_found.get(guild_id, ()):
+            self.missing.setdefault(guild_id, set()).add(user_id)
+        return "<@{}>".format(user_id)
+
+    def display_names(self, guild_id: int, user_ids: Iterable[int]) -> List[str]:
+        return [self.display_name(guild_id, user_id) for user_id in user_ids]
+
+    async def fetch_batch(self, guild: discord.Guild, user_ids: List[int]) -> Optional[List[Member]]:
+        # None when the request failed, a missing members intent or a timeout is not an answer about the ids
+        async with self.fetch_concurrency:
+            try:
+                return await guild.query_members(user_ids=user_ids, limit=len(user_ids), cache=False)
+            except (asyncio.TimeoutError, discord.HTTPException, discord.ClientException):
+                logger.warning("Could not fetch %s members from guild %s", len(user_ids), guild.id, exc_info=True)
+                return None
+
+    async def fetch_missing(self) -> int:
+        budget = self.max_fetches
+        found = 0
+        for guild_id, missing in list(self.missing.items()):
+            guild = self.client.get_guild(guild_id)
+            if guild is None or not missing:
+                # The bot left the guild, its names can't be fetched anymore
+                del self.missing[guild_id]
+                continue
+            pending = list(missing)[:budget]
+            if not pending:
+                break
+            budget -= len(pending)
+            batches = [pending[start:start + self.batch_size] for start in range(0, len(pending), self.batch_size)]
+            for batch, members in zip(batches,
+                                      await asyncio.gather(*(self.fetch_batch(guild, batch) for batch in batches))):
+                if members is None:
+                    # Stays missing and is asked for again on the next tick
+                    continue
+                for member in members:
+                    self.remember(member)
+                    found += 1
+                not_found = missing.intersection(batch)
+                missing.difference_update(not_found)
+                self.not_found.setdefault(guild_id, set()).update(not_found)
+        self.fetched.inc(found)
+        return found
+
+    # region Events
+    async def on_message(self, message: Message):
+        self.remember(message.author)
+
+    async def on_member_update(self, before: Member, after: Member):
+        self.remember(after)
+
+    async def on_close(self):
+        await self.persist()
+    # endregion
@@ -0,0 +1,136 @@
+import time
+from bisect import bisect_left
+from typing import Dict, List, Tuple, Union
+
+
+class Counter:
+    __slots__ = ("value",)
+    type_name = "counter"
+
+    def __init__(self):
+        self.value: float = 0
+
+    def inc(self, amount: float = 1):
+        self.value += amount
+
+
+class Gauge:
+    __slots__ = ("value",)
+    type_name = "gauge"
+
+    def __init__(self):
+        self.value: float = 0
+
+    def set(self, value: float):
+        self.value = value
+
+    def inc(self, amount: float = 1):
+        self.value += amount
+
+    def dec(self, amount: float = 1):
+        self.value -= amount
+
+
+class Histogram:
+    __slots__ = ("buckets", "counts", "sum", "count", "max")
+    type_name = "histogram"
+    default_buckets = (0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 60)
+
+    def __init__(self, buckets: Tuple[float, ...] = default_buckets):
+        self.buckets: Tuple[float, ...] = buckets
+        # Per bucket counts, the last slot is +Inf. They are only made cumulative when rendering
+        self.counts: List[int] = [0] * (len(buckets) + 1)
+        self.sum: float = 0
+        self.count: int = 0
+        self.max: float = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+        if value > self.max:
+            self.max = value
+
+    def time(self) -> 'HistogramTimer':
+        return HistogramTimer(self)
+
+
+class HistogramTimer:
+    __slots__ = ("histogram", "start")
+
+    def __init__(self, histogram: Histogram):
+        self.histogram = histogram
+        self.start: float = 0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.histogram.observe(time.perf_counter() - self.start)
+        return False
+
+
+Metric = Union[Counter, Gauge, Histogram]
+
+
+class MetricsRegistry:
+    # Metrics are created once and kept by whoever records them, so recording is a single attribute update.
+    # Labels are part of the key: registry.counter("x_total", "help", command="Help")
+    def __init__(self):
+        self.metrics: Dict[str, Dict[Tuple[Tuple[str, str], ...], Metric]] = {}
+        self.help: Dict[str, str] = {}
+        self.started_at: float = time.time()
+
+    def _get(self, metric_type, name: str, help_text: str, labels: Dict[str, str]) -> Metric:
+        key = tuple(sorted((label, str(value)) for label, value in labels.items()))
+        family = self.metrics.setdefault(name, {})
+        self.help.setdefault(name, help_text)
+        metric = family.get(key)
+        if metric is None:
+            metric = family[key] = metric_type()
+        return metric
+
+    def counter(self, name: str, help_text: str = "", **labels) -> Counter:
+        return self._get(Counter, name, help_text, labels)
+
+    def gauge(self, name: str, help_text: str = "", **labels) -> Gauge:
+        return self._get(Gauge, name, help_text, labels)
+
+    def histogram(self, name: str, help_text: str = "", **labels) -> Histogram:
+        return self._get(Histogram, name, help_text, labels)
+
+    def family(self, name: str) -> List[Tuple[Dict[str, str], Metric]]:
+        return [(dict(key), metric) for key, metric in self.metrics.get(name, {}).items()]
+
+    @staticmethod
+    def _format_labels(key: Tuple[Tuple[str, str], ...], extra: Tuple[str, str] = None) -> str:
+        pairs = list(key) + ([extra] if extra else [])
+        if not pairs:
+            return ""
+        return "{" + ",".join('{}="{}"'.format(label, value.replace('"', '\\"')) for label, value in pairs) + "}"
+
+    def render_prometheus(self) -> str:
+        lines: List[str] = []
+        # Rendered from executor threads while the loop may be registering metrics, so iterate over copies
+        for name, family in list(self.metrics.items()):
+            family = list(family.items())
+            if not family:
+                continue
+            lines.append("# HELP {} {}".format(name, self.help.get(name, "")))
+            lines.append("# TYPE {} {}".format(name, family[0][1].type_name))
+            for key, metric in family:
+                if isinstance(metric, Histogram):
+                    cumulative = 0
+                    for bound, count in zip(metric.buckets + (float("inf"),), metric.counts):
+                        cumulative += count
+                        le = "+Inf" if bound == float("inf") else repr(bound)
+                        lines.append("{}_bucket{} {}".format(name, self._format_labels(key, ("le", le)), cumulative))
+                    lines.append("{}_sum{} {}".format(name, self._format_labels(key), metric.sum))
+                    lines.append("{}_count{} {}".format(name, self._format_labels(key), metric.count))
+                else:
+                    lines.append("{}{} {}".format(name, self._format_labels(key), metric.value))
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry()
@@ -0,0 +1,222 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from collections import deque
+from enum import IntEnum
+from typing import Any, Deque, Dict, Hashable, Optional, Set, Tuple, TYPE_CHECKING
+
+from discord import Message, TextChannel
+
+from internals import TokenBucket, metrics
+
+if TYPE_CHECKING:
+    from internals import LithilClient
+
+logger = logging.getLogger('lithil.outbound')
+
+
+class OutboundPriority(IntEnum):
+    INTERACTIVE = 0
+    BACKGROUND = 1
+
+
+class OutboundRequest:
+    __slots__ = ("action", "target", "content", "kwargs", "priority", "route", "future", "queued_at")
+
+    def __init__(self, action: str, target: Any, content: Optional[str], kwargs: Dict, priority: OutboundPriority,
+                 route: Tuple[str, int], future: asyncio.Future, queued_at: float):
+        self.action: str = action
+        self.target: Any = target
+        self.content: Optional[str] = content
+        self.kwargs: Dict = kwargs
+        self.priority: OutboundPriority = priority
+        self.route: Tuple[str, int] = route
+        self.future: asyncio.Future = future
+        self.queued_at: float = queued_at
+
+
+class OutboundQueue:
+    # Every message the bot sends, edits or deletes goes through here. Each route (the action and the channel, like
+    # discord's buckets) has a token bucket, so requests wait in the queue instead of in discord.py's 429 retries,
+    # interactive replies go before background traffic and an edit still queued is replaced by a newer one for the
+    # same message, so only the latest content is sent
+    default_route_limits: Dict[str, Tuple[float, float]] = {
+        "send": (1, 5),
+        "edit": (1, 5),
+        "delete": (5, 5),
+    }
+
+    def __init__(self, client: 'LithilClient', config_dict: Dict):
+        self.client = client
+        # (requests per second, burst) per action
+        self.route_limits: Dict[str, Tuple[float, float]] = dict(self.default_route_limits)
+        for action, limit in (config_dict.get("route_limits") or {}).items():
+            self.route_limits[action] = tuple(limit)
+        self.max_in_flight: int = config_dict.get("max_in_flight", 10)
+        self.queues: Dict[OutboundPriority, Deque[OutboundRequest]] = {priority: deque()
+                                                                       for priority in OutboundPriority}
+        # Queued edits by message id, a newer edit replaces the content of the one here
+        self.queued_edits: Dict[int, OutboundRequest] = {}
+        # Messages with an edit in flight, the next edit waits for it so edits are never applied out of order
+        self.editing: Set[int] = set()
+        self.buckets: Dict[Tuple[str, int], TokenBucket] = {}
+        self.in_flight: int = 0
+        self.wakeup: asyncio.Event = asyncio.Event()
+        self.worker: asyncio.Future = None
+
+        self.depth = metrics.gauge("lithil_outbound_queue_depth", "Requests waiting in the outbound queue")
+        self.wait_time = {priority: metrics.histogram("lithil_outbound_wait_seconds",
+                                                      "Time requests waited in the outbound queue",
+                                                      priority=priority.name.lower())
+                          for priority in OutboundPriority}
+        self.requests = {action: metrics.counter("lithil_outbound_requests_total", "Requests sent to discord",
+                                                 action=action)
+                         for action in self.default_route_limits}
+        self.coalesced = metrics.counter("lithil_outbound_coalesced_total",
+                                         "Edits dropped because a newer one replaced them")
+
+        self.client.events.subscribe("close", self.on_close, priority=-10, ordered=True)
+
+    def submit(self, action: str, target: Any, channel: TextChannel, content: Optional[str], kwargs: Dict,
+               priority: OutboundPriority) -> asyncio.Future:
+        now = time.monotonic()
+        request = OutboundRequest(action, target, content, kwargs, priority, (action, channel.id),
+                                  self.client.loop.create_future(), now)
+        self.depth.inc()
+        if action == "edit":
+            self.queued_edits[target.id] = request
+        # With nothing queued and the route free it goes out right away, the worker is only for what has to wait
+        if self.in_flight < self.max_in_flight and not any(self.queues.values()) and \
+                not (action == "edit" and target.id in self.editing) and not self.ready_wait(request.route, now):
+            self.start(request, now)
+            return request.future
+        if self.worker is None:
+            self.worker = asyncio.ensure_future(self.run())
+        self.queues[priority].append(request)
+        self.wakeup.set()
+        return request.future
+
+    def send(self, channel: TextChannel, content: str, priority: OutboundPriority = OutboundPriority.BACKGROUND,
+             **kwargs) -> asyncio.Future:
+        return self.submit("send", channel, channel, content, kwargs, priority)
+
+    def edit(self, message: Message, content: str, priority: OutboundPriority = OutboundPriority.BACKGROUND,
+             **kwargs) -> asyncio.Future:
+        queued = self.queued_edits.get(message.id)
+        if queued is not None:
+            queued.content = content
+            queued.kwargs = kwargs
+            self.coalesced.inc()
+            return queued.future
+        return self.submit("edit", message, message.channel, content, kwargs, priority)
+
+    def delete(self, message: Message, priority: OutboundPriority = OutboundPriority.BACKGROUND,
+               delay: float = None) -> Optional[asyncio.Future]:
+        # Like Message.delete, a delayed delete is not awaited and its errors are only logged
+        if delay is None:
+            return self.submit("delete", message, message.channel, None, {}, priority)
+        self.client.loop.call_later(delay, lambda: self.submit("delete", message, message.channel, None, {}, priority)
+                                    .add_done_callback(self.log_failure))
+        return None
+
+    @staticmethod
+    def log_failure(future: asyncio.Future):
+        # Done callback for the requests nobody awaits
+        if not future.cancelled() and future.exception() is not None:
+            logger.warning("Outbound request failed", exc_info=future.exception())
+
+    def ready_wait(self, route: Tuple[str, int], now: float) -> float:
+        # 0 when the route can take a request now, consuming its token, otherwise seconds until it can
+        rate, burst = self.route_limits.get(route[0], (1, 1))
+        bucket = self.buckets.get(route)
+        if bucket is None:
+            bucket = self.buckets[route] = TokenBucket(burst, now)
+        if bucket.consume(rate, burst, now):
+            return 0
+        return (1 - bucket.tokens) / rate
+
+    def dispatch_ready(self) -> Optional[float]:
+        # Starts every request whose route is free, interactive ones first. Returns how long until a waiting request
+        # could start, None when that depends on a request in flight finishing or nothing is queued
+        now = time.monotonic()
+        next_ready: Optional[float] = None
+        blocked: Set[Hashable] = set()
+        for priority, queue in self.queues.items():
+            waiting: Deque[OutboundRequest] = deque()
+            while queue:
+                request = queue.popleft()
+                if self.in_flight >= self.max_in_flight or request.route in blocked or \
+                        (request.action == "edit" and request.target.id in self.editing):
+                    waiting.append(request)
+                    continue
+                wait = self.ready_wait(request.route, now)
+                if wait:
+                    # Later requests on the same route stay behind this one
+                    blocked.add(request.route)
+                    waiting.append(request)
+                    next_ready = wait if next_ready is None else min(next_ready, wait)
+                    continue
+                self.start(request, now)
+            self.queues[priority] = waiting
+        return next_ready
+
+    def start(self, request: OutboundRequest, now: float):
+        self.depth.dec()
+        self.wait_time[request.priority].observe(now - request.queued_at)
+        if request.action == "edit":
+            self.queued_edits.pop(request.target.id, None)
+            self.editing.add(request.target.id)
+        self.in_flight += 1
+        asyncio.ensure_future(self.perform(request))
+
+    async def perform(self, request: OutboundRequest):
+        self.requests[request.action].inc()
+        try:
+            if request.action == "send":
+                result = await request.target.send(request.content, **request.kwargs)
+            elif request.action == "edit":
+                result = await request.target.edit(content=request.content, **request.kwargs)
+            else:
+                result = await request.target.delete()
+        except Exception as e:
+            if not request.future.done():
+                request.future.set_exception(e)
+        else:
+            if not request.future.done():
+                request.future.set_result(result)
+        finally:
+            self.in_flight -= 1
+            if request.action == "edit":
+                self.editing.discard(request.target.id)
+            self.wakeup.set()
+
+    async def run(self):
+        while True:
+            self.wakeup.clear()
+            next_ready = self.dispatch_ready()
+            if next_ready is None:
+                await self.wakeup.wait()
+            else:
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), next_ready)
+                except asyncio.TimeoutError:
+                    pass
+
+    def pending(self) -> int:
+        return sum(len(queue) for queue in self.queues.values()) + self.in_flight
+
+    async def drain(self, timeout: float):
+        deadline = time.monotonic() + timeout
+        while self.pending() and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+
+    # region Events
+    async def on_close(self):
+        # After every other close handler, so what they send still goes out before the bot logs out
+        await self.drain(10)
+        if self.worker is not None:
+            self.worker.cancel()
+            self.worker = None
+    # endregion
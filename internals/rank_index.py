@@ -0,0 +1,111 @@
+import random
+from typing import Any, Iterator, List
+
+
+class _Node:
+    __slots__ = ("key", "next", "width")
+
+    def __init__(self, key: Any, levels: int):
+        self.key = key
+        self.next: List['_Node'] = [None] * levels
+        # width[level] is how many positions next[level] is ahead of this node
+        self.width: List[int] = [1] * levels
+
+
+class RankIndex:
+    # Indexable skip list: insert, remove, rank and positional lookups are all O(log n) expected.
+    # Keys must be unique and orderable, the ledgers use (-balance, user_id) so position 0 is the richest user.
+    levels = 24
+
+    def __init__(self):
+        self._tail = _Node(None, self.levels)
+        self._head = _Node(None, self.levels)
+        self._head.next = [self._tail] * self.levels
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def _random_level(self) -> int:
+        level = 1
+        while level < self.levels and random.random() < 0.5:
+            level += 1
+        return level
+
+    def insert(self, key: Any):
+        chain: List[_Node] = [None] * self.levels
+        steps_at_level = [0] * self.levels
+        node = self._head
+        for level in reversed(range(self.levels)):
+            while node.next[level] is not self._tail and node.next[level].key < key:
+                steps_at_level[level] += node.width[level]
+                node = node.next[level]
+            chain[level] = node
+
+        new_levels = self._random_level()
+        new_node = _Node(key, new_levels)
+        steps = 0
+        for level in range(new_levels):
+            previous = chain[level]
+            new_node.next[level] = previous.next[level]
+            previous.next[level] = new_node
+            new_node.width[level] = previous.width[level] - steps
+            previous.width[level] = steps + 1
+            steps += steps_at_level[level]
+        for level in range(new_levels, self.levels):
+            chain[level].width[level] += 1
+        self._size += 1
+
+    def remove(self, key: Any):
+        chain: List[_Node] = [None] * self.levels
+        node = self._head
+        for level in reversed(range(self.levels)):
+            while node.next[level] is not self._tail and node.next[level].key < key:
+                node = node.next[level]
+            chain[level] = node
+
+        target = chain[0].next[0]
+        if target is self._tail or target.key != key:
+            raise KeyError(key)
+        for level in range(len(target.next)):
+            previous = chain[level]
+            previous.width[level] += target.width[level] - 1
+            previous.next[level] = target.next[level]
+        for level in range(len(target.next), self.levels):
+            chain[level].width[level] -= 1
+        self._size -= 1
+
+    def rank(self, key: Any) -> int:
+        # 0 based position of key
+        position = 0
+        node = self._head
+        for level in reversed(range(self.levels)):
+            while node.next[level] is not self._tail and node.next[level].key < key:
+                position += node.width[level]
+                node = node.next[level]
+        target = node.next[0]
+        if target is self._tail or target.key != key:
+            raise KeyError(key)
+        return position
+
+    def _node_at(self, index: int) -> _Node:
+        node = self._head
+        remaining = index + 1
+        for level in reversed(range(self.levels)):
+            while node.width[level] <= remaining:
+                remaining -= node.width[level]
+                node = node.next[level]
+        return node
+
+    def __getitem__(self, index: int) -> Any:
+        if not 0 <= index < self._size:
+            raise IndexError(index)
+        return self._node_at(index).key
+
+    def iterate_from(self, start: int = 0) -> Iterator[Any]:
+        if start >= self._size:
+            return
+        node = self._node_at(max(start, 0))
+        while node is not self._tail:
+            yield node.key
+            node = node.next[0]
@@ -0,0 +1,35 @@
+import time
+from collections import OrderedDict
+from typing import AnyStr, Hashable, Optional, Tuple
+
+
+class ResponseCache:
+    # Bounded LRU of command replies keyed by (command name, Command.cache_key). Entries expire after the ttl of the
+    # command, a ttl of None keeps them until they are evicted or invalidated
+    def __init__(self, max_entries: int = 512):
+        self.max_entries: int = max_entries
+        self.entries: 'OrderedDict[Tuple[str, Hashable], Tuple[Optional[float], AnyStr]]' = OrderedDict()
+
+    def get(self, key: Tuple[str, Hashable]) -> Optional[AnyStr]:
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        expires, reply = entry
+        if expires is not None and expires <= time.monotonic():
+            del self.entries[key]
+            return None
+        self.entries.move_to_end(key)
+        return reply
+
+    def put(self, key: Tuple[str, Hashable], reply: AnyStr, ttl: Optional[float]):
+        self.entries[key] = (time.monotonic() + ttl if ttl is not None else None, reply)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def invalidate(self, command_name: str = None):
+        if command_name is None:
+            self.entries.clear()
+        else:
+            for key in [key for key in self.entries if key[0] == command_name]:
+                del self.entries[key]
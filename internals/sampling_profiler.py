@@ -0,0 +1,141 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+from pathlib import Path
+from types import CodeType
+from typing import Dict, List, Tuple, TYPE_CHECKING
+
+from internals import metrics
+
+if TYPE_CHECKING:
+    from internals import LithilClient
+
+logger = logging.getLogger('lithil.profiler')
+
+
+class ProfileReport:
+    def __init__(self, stacks: Dict[Tuple[str, ...], int], samples: int, idle_samples: int, sample_seconds: float):
+        # Busy stacks, from the thread group down to the function running, and how many samples caught each
+        self.stacks: Dict[Tuple[str, ...], int] = stacks
+        self.samples: int = samples
+        self.idle_samples: int = idle_samples
+        self.sample_seconds: float = sample_seconds
+
+    def collapsed(self) -> str:
+        # One "frame;frame;frame count" line per stack, what flamegraph.pl and speedscope read
+        return "".join("{} {}\n".format(";".join(stack), count) for stack, count in self.stacks.items())
+
+    def top(self, n: int) -> List[Tuple[str, float, float]]:
+        # (function, cumulative seconds, own seconds) of the n functions with the most cumulative time
+        cumulative: Dict[str, int] = {}
+        own: Dict[str, int] = {}
+        for stack, count in self.stacks.items():
+            # A recursive function is counted once per sample
+            for label in set(stack[1:]):
+                cumulative[label] = cumulative.get(label, 0) + count
+            own[stack[-1]] = own.get(stack[-1], 0) + count
+        ranking = sorted(cumulative.items(), key=lambda item: item[1], reverse=True)[:n]
+        return [(label, count * self.sample_seconds, own.get(label, 0) * self.sample_seconds)
+                for label, count in ranking]
+
+
+class SamplingProfiler:
+    # Samples the stacks of the event loop thread and the executor threads from a thread of its own, the profiled
+    # code runs untouched so it is cheap enough for production. Threads waiting for work are counted as idle and left
+    # out of the stacks
+    # (file name, function) of the frames a thread is in while it waits for work
+    idle_frames = {("selectors.py", "select"), ("thread.py", "_worker")}
+    # thread_name_prefix of the client's thread pool, its threads are named <prefix>_<n>
+    executor_thread_prefix = "lithil_"
+    # Seconds a thread keeps the GIL while another one waits for it, while a session runs
+    switch_interval = 0.0001
+
+    def __init__(self, client: 'LithilClient', config_dict: Dict):
+        self.client = client
+        self.interval: float = config_dict.get("interval", 0.005)
+        self.max_seconds: float = config_dict.get("max_seconds", 300)
+        self.running: bool = False
+        self.sessions = metrics.counter("lithil_profiler_sessions_total", "Profiling sessions run")
+
+    def start(self, seconds: float) -> asyncio.Future:
+        # Must be called from the event loop, its thread is the one sampled as the loop. Only one session at a time
+        if self.running:
+            raise RuntimeError("A profiling session is already running")
+        self.running = True
+        self.sessions.inc()
+        return asyncio.ensure_future(self.run(min(seconds, self.max_seconds), threading.get_ident()))
+
+    async def run(self, seconds: float, loop_thread_id: int) -> Tuple[ProfileReport, Path]:
+        try:
+            stop = threading.Event()
+            result: List[ProfileReport] = []
+            sampler = threading.Thread(target=lambda: result.append(self.sample(stop, loop_thread_id)),
+                                       name="lithil-profiler", daemon=True)
+            sampler.start()
+            try:
+                await asyncio.sleep(seconds)
+            finally:
+                stop.set()
+                await self.client.run_blocking(sampler.join)
+            report = result[0]
+            file = self.client.data_path / self.client.shard_file_name(
+                "profile.{}.folded".format(time.strftime("%Y%m%d-%H%M%S")))
+            await self.client.run_blocking(self.client.data_manager.store_text, file, report.collapsed())
+            logger.info("Profiled %.0fs, %s samples written to %s", seconds, report.samples, file)
+            return report, file
+        finally:
+            self.running = False
+
+    def sample(self, stop: threading.Event, loop_thread_id: int) -> ProfileReport:
+        # Otherwise the sampler only gets the GIL when the loop gives it up waiting in select, and every sample
+        # would catch it there. With a short switch interval it takes the GIL close to where the loop really is
+        switch_interval = sys.getswitchinterval()
+        sys.setswitchinterval(self.switch_interval)
+        try:
+            return self.sample_stacks(stop, loop_thread_id)
+        finally:
+            sys.setswitchinterval(switch_interval)
+
+    def sample_stacks(self, stop: threading.Event, loop_thread_id: int) -> ProfileReport:
+        labels: Dict[CodeType, str] = {}
+        stacks: Dict[Tuple[str, ...], int] = {}
+        samples = idle_samples = ticks = 0
+        started = time.monotonic()
+        while not stop.wait(self.interval):
+            ticks += 1
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == loop_thread_id:
+                    root = "event_loop"
+                elif names.get(thread_id, "").startswith(self.executor_thread_prefix):
+                    root = "executor"
+                else:
+                    continue
+                samples += 1
+                code = frame.f_code
+                if (os.path.basename(code.co_filename), code.co_name) in self.idle_frames and \
+                        frame.f_locals.get("timeout") != 0:
+                    # A select with no timeout is the loop polling between callbacks, not waiting
+                    idle_samples += 1
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    label = labels.get(code)
+                    if label is None:
+                        label = labels[code] = "{} ({}:{})".format(code.co_name, os.path.basename(code.co_filename),
+                                                                    code.co_firstlineno)
+                    stack.append(label)
+                    frame = frame.f_back
+                stack.append(root)
+                stack.reverse()
+                key = tuple(stack)
+                stacks[key] = stacks.get(key, 0) + 1
+        # The real time between samples, the wait overshoots the interval under load
+        sample_seconds = (time.monotonic() - started) / ticks if ticks else self.interval
+        return ProfileReport(stacks, samples, idle_samples, sample_seconds)
@@ -0,0 +1,42 @@
+from typing import AnyStr, Dict, List
+
+
+class TranslationTable(dict):
+    # str.translate table that deletes every character without an entry instead of keeping it
+    def __missing__(self, key):
+        return None
+
+
+class TextTransform:
+    # A character to text mapping compiled once into a str.translate table, so applying it is a single pass in C.
+    # With ignore_case the uppercase version of every key maps to the same text
+    def __init__(self, mapping: Dict[str, str], ignore_case: bool = True, keep_unmapped: bool = False):
+        self.ignore_case: bool = ignore_case
+        self.table: Dict[int, str] = TranslationTable() if not keep_unmapped else {}
+        for char, replacement in mapping.items():
+            self.table[ord(char)] = replacement
+            if ignore_case:
+                upper = char.upper()
+                if len(upper) == 1 and upper != char:
+                    self.table.setdefault(ord(upper), replacement)
+
+    def apply(self, text: AnyStr) -> AnyStr:
+        return text.translate(self.table)
+
+
+def split_message(text: AnyStr, limit: int = 2000) -> List[AnyStr]:
+    # Splits a reply into messages of at most limit characters, cutting at the last line break, or else the last
+    # space, before the limit and only mid-word when there is neither. Blank chunks are dropped, Discord rejects them
+    chunks = []
+    while len(text) > limit:
+        cut = text.rfind("\n", 0, limit + 1)
+        if cut <= 0:
+            cut = text.rfind(" ", 0, limit + 1)
+        if cut <= 0:
+            chunks.append(text[:limit])
+            text = text[limit:]
+        else:
+            chunks.append(text[:cut])
+            text = text[cut + 1:]
+    chunks.append(text)
+    return [chunk for chunk in chunks if chunk.strip()]
@@ -0,0 +1,24 @@
+from typing import TYPE_CHECKING
+
+from internals import Command, TextTransform
+
+if TYPE_CHECKING:
+    from internals import LithilClient, Call
+
+
+class TransformCommand(Command):
+    # Base for commands that only rewrite the text after the caller, a subclass just defines transform
+    transform: TextTransform = None
+    cacheable = True
+    cache_ttl = 3600
+
+    @classmethod
+    def cache_key(cls, call: 'Call'):
+        if cls.transform.ignore_case:
+            # Every caller and capitalisation give the same text
+            return call.beheaded_content.lower()
+        return call.beheaded_content
+
+    @classmethod
+    async def action(cls, call: 'Call', client: 'LithilClient') -> str:
+        return cls.transform.apply(call.beheaded_content)
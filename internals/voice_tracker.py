@@ -0,0 +1,136 @@
+from __future__ import annotations
+
+import time
+from typing import Dict, Mapping, Set, TYPE_CHECKING, Optional
+
+from discord import Member, VoiceState, VoiceChannel
+
+if TYPE_CHECKING:
+    from internals import LithilClient
+
+
+class VoiceSessionTracker:
+    # Follows voice state updates instead of polling every guild. A member accrues time while their channel has
+    # more than one member in it, and the time is credited when that stops or on every checkpoint.
+    def __init__(self, client: 'LithilClient', config_dict: Dict):
+        self.client = client
+        self.exclude_muted: bool = config_dict.get("exclude_muted_on_voice", False)
+        self.channel_members: Dict[int, Dict[int, Member]] = {}
+        self.member_channels: Dict[int, int] = {}
+        self.muted_members: Set[int] = set()
+        self.accruing_since: Dict[int, float] = {}
+        # Seconds that did not add up to a whole payment yet, kept for the next credit
+        self.carried_seconds: Dict[int, float] = {}
+
+        self.client.events.subscribe("ready", self.on_ready)
+        self.client.events.subscribe("voice_state_update", self.on_voice_state_update, ordered=True)
+        # Open sessions are credited before the bank closes its ledger
+        self.client.events.subscribe("close", self.on_close, priority=10, ordered=True)
+        # Before the bank switches to a new rate, so the time accrued until now is paid at the old one
+        self.client.events.subscribe("config_change", self.on_config_change, priority=10, ordered=True)
+
+    @staticmethod
+    def is_muted(state: VoiceState) -> bool:
+        return state.self_mute or state.self_deaf or state.mute or state.deaf
+
+    def join(self, member: Member, channel: VoiceChannel, muted: bool):
+        self.channel_members.setdefault(channel.id, {})[member.id] = member
+        self.member_channels[member.id] = channel.id
+        if muted:
+            self.muted_members.add(member.id)
+        else:
+            self.muted_members.discard(member.id)
+
+    def leave(self, member: Member, now: float = None) -> Optional[int]:
+        channel_id = self.member_channels.pop(member.id, None)
+        self.muted_members.discard(member.id)
+        if channel_id is not None:
+            members = self.channel_members[channel_id]
+            members.pop(member.id, None)
+            if not members:
+                del self.channel_members[channel_id]
+            self.close_session(member, now)
+        return channel_id
+
+    def refresh_channel(self, channel_id: int, now: float):
+        members = self.channel_members.get(channel_id, {})
+        eligible = len(members) > 1
+        for member_id, member in members.items():
+            earning = eligible and not (self.exclude_muted and member_id in self.muted_members)
+            if earning and member_id not in self.accruing_since:
+                self.accruing_since[member_id] = now
+            elif not earning and member_id in self.accruing_since:
+                self.close_session(member, now)
+
+    def close_session(self, member: Member, now: float = None):
+        start = self.accruing_since.pop(member.id, None)
+        if start is not None:
+            self.credit(member, (now or time.monotonic()) - start)
+
+    def payment(self, member: Member, seconds: float) -> int:
+        seconds += self.carried_seconds.pop(member.id, 0)
+        minutes, remainder = divmod(seconds, 60)
+        if remainder:
+            self.carried_seconds[member.id] = remainder
+        return int(minutes) * self.client.bank.money_per_minute_on_voice
+
+    def credit(self, member: Member, seconds: float):
+        amount = self.payment(member, seconds)
+        if amount:
+            self.client.bank.accrual.accrue(member, amount)
+
+    def checkpoint(self) -> int:
+        # Credits every open session so long calls are paid regularly and a crash loses at most one interval plus
+        # the accrual window, which pays them together with the message rewards
+        now = time.monotonic()
+        for member_id, start in list(self.accruing_since.items()):
+            self.credit(self.channel_members[self.member_channels[member_id]][member_id], now - start)
+            self.accruing_since[member_id] = now
+        return len(self.accruing_since)
+
+    # region Events
+    async def on_voice_state_update(self, member: Member, before: VoiceState, after: VoiceState):
+        now = time.monotonic()
+        if before.channel == after.channel and after.channel is not None:
+            # Mute or deafen transition inside the same channel
+            self.join(member, after.channel, self.is_muted(after))
+            self.close_session(member, now)
+            self.refresh_channel(after.channel.id, now)
+            return
+        old_channel_id = self.leave(member, now)
+        if old_channel_id is not None:
+            self.refresh_channel(old_channel_id, now)
+        if after.channel is not None:
+            self.join(member, after.channel, self.is_muted(after))
+            self.refresh_channel(after.channel.id, now)
+
+    async def on_ready(self):
+        # Sessions that were already open when we connected, this is the only full walk over the voice channels.
+        # ready fires again after a reconnect that could not resume: what is open until now is paid and the state is
+        # rebuilt from scratch, whoever left voice meanwhile must not keep accruing
+        self.checkpoint()
+        self.channel_members = {}
+        self.member_channels = {}
+        self.muted_members = set()
+        self.accruing_since = {}
+        now = time.monotonic()
+        for guild in self.client.guilds:
+            for channel in guild.voice_channels:
+                for member in channel.members:
+                    self.join(member, channel, self.is_muted(member.voice))
+                if channel.members:
+                    self.refresh_channel(channel.id, now)
+
+    async def on_config_change(self, config: Mapping, changed: Set[str]):
+        if "currency.money_per_minute_on_voice" in changed:
+            self.checkpoint()
+        if "currency.exclude_muted_on_voice" in changed:
+            self.exclude_muted = config["currency"].get("exclude_muted_on_voice", False)
+            now = time.monotonic()
+            for channel_id in list(self.channel_members):
+                self.refresh_channel(channel_id, now)
+
+    async def on_close(self):
+        for member_id in list(self.accruing_since.keys()):
+            self.close_session(self.channel_members[self.member_channels[member_id]][member_id])
+    # endregion
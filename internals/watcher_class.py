@@ -1,52 +1,108 @@
+import asyncio
+import logging
 import time
 from asyncio import iscoroutinefunction
-from typing import TYPE_CHECKING, Callable
+from concurrent.futures import Future
+from enum import Enum
+from typing import TYPE_CHECKING, Callable, List, Optional, Tuple
 
-from discord import Guild, VoiceChannel
 from discord.ext import tasks
 from discord.ext.commands import Cog
 from discord.ext.tasks import Loop
 
+from internals import metrics, Histogram, Gauge, Counter
+
 if TYPE_CHECKING:
     from internals import LithilClient
 
+logger = logging.getLogger('lithil.watchers')
+
 
 class Watcher(Cog):
+    class ExecutionMode(Enum):
+        # Runs on the event loop, the only option for coroutine functions
+        INLINE = 0
+        # Runs on client.thread_pool, for blocking work like disk I/O. It must only touch thread safe state
+        THREAD = 1
+
+    # (name, tick_rate, func, log, execution) of the functions decorated with internals.watcher
+    registry: List[Tuple[str, int, Callable[['LithilClient'], None], bool, 'Watcher.ExecutionMode']] = []
+
     def __init__(self, name: str, tick_rate: int, func: Callable[['LithilClient'], None], client: 'LithilClient',
-                 log: bool = False):
+                 log: bool = False, execution: ExecutionMode = ExecutionMode.INLINE):
         self.name: str = name or func.__name__
         self.tick_rate: int = tick_rate
         self.func: Callable[['LithilClient'], None] = func
         self.watching: bool = False
         self.client: 'LithilClient' = client
-        self.client.logger.info("Registered {0}".format(self.name))
+        logger.info("Registered {0}".format(self.name))
         self.log_activation: bool = log
+        self.execution: Watcher.ExecutionMode = execution
+
+        self.tick_time: Histogram = metrics.histogram("lithil_watcher_tick_seconds", "Time spent in each watcher tick",
+                                                      watcher=self.name)
+        self.tick_drift: Gauge = metrics.gauge("lithil_watcher_drift_seconds",
+                                               "How much later than tick_rate the last tick started", watcher=self.name)
+        self.overruns: Counter = metrics.counter("lithil_watcher_overruns_total", "Ticks that took longer than tick_rate",
+                                                 watcher=self.name)
+        self.last_tick_start: float = None
+        # The last tick submitted to the executor, cancelling the loop doesn't stop it
+        self.in_flight: Optional[Future] = None
 
         if iscoroutinefunction(func):
-            @tasks.loop(seconds=self.tick_rate)
-            async def watch():
-                log_msg = await self.func(self.client)
-                if self.log_activation:
-                    self.client.logger.info(log_msg)
+            if execution != Watcher.ExecutionMode.INLINE:
+                raise ValueError("Watcher {} is a coroutine function and can only run inline".format(self.name))
+
+            async def run():
+                return await self.func(self.client)
+        elif execution == Watcher.ExecutionMode.THREAD:
+            async def run():
+                self.in_flight = self.client.thread_pool.submit(self.func, self.client)
+                return await asyncio.wrap_future(self.in_flight)
         else:
-            @tasks.loop(seconds=self.tick_rate)
-            async def watch():
-                log_msg = self.func(self.client)
-                if self.log_activation:
-                    self.client.logger.info(log_msg)
+            async def run():
+                return self.func(self.client)
+
+        @tasks.loop(seconds=self.tick_rate)
+        async def watch():
+            start = time.monotonic()
+            if self.last_tick_start is not None:
+                self.tick_drift.set(start - self.last_tick_start - self.tick_rate)
+            self.last_tick_start = start
+            log_msg = await run()
+            elapsed = time.monotonic() - start
+            self.tick_time.observe(elapsed)
+            if elapsed > self.tick_rate:
+                self.overruns.inc()
+            if self.log_activation:
+                logger.info(log_msg)
 
         @watch.before_loop
         async def before_watch():
-            self.client.logger.info("{0} Started".format(self.name))
+            logger.info("{0} Started".format(self.name))
 
         @watch.after_loop
         async def after_watch():
-            self.client.logger.info("{0} Stopped".format(self.name))
+            logger.info("{0} Stopped".format(self.name))
 
         self.watch: Loop = watch
 
+    @classmethod
+    def for_client(cls, client: 'LithilClient') -> List['Watcher']:
+        return [cls(name, tick_rate, func, client, log, execution)
+                for name, tick_rate, func, log, execution in cls.registry]
+
     def start_watching(self):
         self.watch.start()
 
     def stop_watching(self):
         self.watch.stop()
+
+    async def stop_and_wait(self):
+        # Stops right away instead of after the next tick, and returns once a tick running in the executor is done
+        self.watch.cancel()
+        task = self.watch.get_task()
+        if task is not None:
+            await asyncio.wait([task])
+        if self.in_flight is not None and not self.in_flight.done():
+            await asyncio.wait([asyncio.wrap_future(self.in_flight)])
@@ -1,32 +1,68 @@
 from typing import TYPE_CHECKING, AnyStr
 
-from discord import Guild, VoiceChannel, Member
-
 if TYPE_CHECKING:
     from internals import LithilClient
-from internals import watcher
+from internals import watcher, Watcher
 
 
 @watcher(tick_rate=60)
-def voice_channel_watcher(client: 'LithilClient') -> AnyStr:
-    output = "Voice Channel Watcher watched: "
-    for server in client.guilds:
-        server: Guild
-        for voice_channel in server.voice_channels:
-            voice_channel: VoiceChannel
-            if len(voice_channel.members) > 1:
-                for member in voice_channel.members:
-                    member: Member
-                    output += "{}, ".format(member.display_name)
-                    client.bank.add_currency(member, client.bank.money_per_minute_on_voice)
-    return output
+def voice_checkpoint(client: 'LithilClient') -> AnyStr:
+    return "Voice checkpoint credited {} open sessions".format(client.voice_tracker.checkpoint())
+
+
+@watcher(tick_rate=5)
+def accrual_flusher(client: 'LithilClient') -> AnyStr:
+    accrual = client.bank.accrual
+    if not accrual.window:
+        return "Accrual window disabled"
+    if not accrual.due():
+        return "Accrual window still open"
+    return "Accrual window paid {} users".format(accrual.flush())
 
 
 @watcher(tick_rate=10)
 async def ranking_updater(client: 'LithilClient') -> AnyStr:
-    if client.bank.ranking_update_pending:
+    if client.bank.ranking_needs_update():
         await client.bank.update_rankings()
         out = "Updated rankings"
     else:
         out = "No rankings to update"
     return out
+
+
+@watcher(tick_rate=1, execution=Watcher.ExecutionMode.THREAD)
+def ledger_persistence(client: 'LithilClient') -> AnyStr:
+    client.bank.persistence_tick()
+    return "Ledger persistence checked"
+
+
+@watcher(tick_rate=15, execution=Watcher.ExecutionMode.THREAD)
+def metrics_exporter(client: 'LithilClient') -> AnyStr:
+    if client.metrics_file is None:
+        return "Metrics export disabled"
+    client.data_manager.store_text(client.metrics_file, client.metrics.render_prometheus())
+    return "Metrics written to {}".format(client.metrics_file)
+
+
+@watcher(tick_rate=5)
+def command_reloader(client: 'LithilClient') -> AnyStr:
+    reloaded = client.command_container.reload_changed()
+    if reloaded:
+        return "Reloaded command modules {}".format(", ".join(reloaded))
+    return "No command modules changed"
+
+
+@watcher(tick_rate=30)
+async def member_resolver(client: 'LithilClient') -> AnyStr:
+    found = await client.member_directory.fetch_missing()
+    await client.member_directory.persist()
+    return "Fetched {} missing member names".format(found)
+
+
+@watcher(tick_rate=5)
+async def config_reloader(client: 'LithilClient') -> AnyStr:
+    changed = client.config.reload_if_changed()
+    if changed:
+        await client.events.dispatch("config_change", client.config.config_dict, changed)
+        return "Reloaded config, changed {}".format(", ".join(sorted(changed)))
+    return "Config unchanged"
@@ -6,6 +6,10 @@ USER="lithil"
 PROGRAM_PATH="/opt/lithil"
 DATA_PATH="$PROGRAM_PATH/data"
 LOG_FILE="$PROGRAM_PATH/lithil.log"
+# PID of Main.py, with several shards it is the supervisor and it stops the shards itself
+PID_FILE="$PROGRAM_PATH/lithil.pid"
+# Bot processes, one per shard. With more than 1 the sqlite ledger is used and each shard logs to lithil.shardN.log
+SHARD_COUNT=${LITHIL_SHARD_COUNT:-1}
 
 PYTHON=$(which ${PROGRAM_PATH}/venv/bin/python)
 
@@ -14,8 +18,8 @@ help_message(){
 Usage ${PROG} [action]
 
 Actions:
-    start:
-        Starts the bot
+    start [shards]:
+        Starts the bot, with one process per shard if shards is more than 1
     stop:
         Stops the bot
     restart:
@@ -28,15 +32,25 @@ EOF
 start_bot(){
     echo "Starting..."
     clear_logs
-    nohup ${PYTHON} ${PROGRAM_PATH}/Main.py &
+    LITHIL_SHARD_COUNT=${SHARD_COUNT} nohup ${PYTHON} ${PROGRAM_PATH}/Main.py &
+    echo $! > ${PID_FILE}
     echo "Started"
 
 }
 stop_bot(){
     echo "Stopping..."
-    PID=$(pgrep -u ${USER} python)
+    if [ ! -f "${PID_FILE}" ]; then
+        echo "Not running"
+        return
+    fi
+    PID=$(cat ${PID_FILE})
     kill -s 15 ${PID}
-    sleep 2
+    # The bot flushes its ledgers before exiting
+    for i in $(seq 30); do
+        kill -0 ${PID} 2>/dev/null || break
+        sleep 1
+    done
+    rm -f ${PID_FILE}
     echo "Stopped"
 
 }
@@ -57,7 +71,7 @@ show_logs(){
     less +F ${LOG_FILE}
 }
 clear_logs(){
-    rm ${LOG_FILE}
+    rm -f ${PROGRAM_PATH}/lithil*.log
 }
 
 if [ ! -e "$PYTHON" ]; then
@@ -71,7 +85,9 @@ COMMAND=$1
 
 case "$COMMAND" in
     start)
-
+        if [ -n "$2" ]; then
+            SHARD_COUNT=$2
+        fi
         start_bot
 
         ;;
@@ -0,0 +1,82 @@
+import tempfile
+import unittest
+from pathlib import Path
+
+from benchmarks.fakes import FakeGuild, FakeMember
+from benchmarks.run import make_client
+
+
+class AccrualWindowTest(unittest.TestCase):
+    money_per_message = 2
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.client = make_client(Path(self.directory.name), overrides={
+            "metrics": {"file": None},
+            "currency": {"money_per_message": self.money_per_message,
+                         "accrual": {"window": 60, "full_reward_messages": 0, "diminishing_factor": 1,
+                                     "max_reward_per_window": 0}}})
+        self.bank = self.client.bank
+        self.accrual = self.bank.accrual
+        self.guild = FakeGuild()
+        self.alice, self.bob = (self.guild.add_member(FakeMember()) for _ in range(2))
+
+    def tearDown(self):
+        self.bank.close_ledgers()
+        self.client.thread_pool.shutdown(wait=True)
+        self.client.log_pipeline.stop()
+        self.directory.cleanup()
+
+    def balance(self, member: FakeMember) -> int:
+        return self.bank.ledger_for(self.guild.id).get(member.id)
+
+    def configure(self, **accrual):
+        self.accrual.configure({"accrual": {"window": 60, **accrual}})
+
+    def test_rewards_are_paid_once_per_window(self):
+        for _ in range(3):
+            self.accrual.count_message(self.alice)
+        self.accrual.accrue(self.bob, 7)
+        self.assertEqual(self.balance(self.alice), 0)
+        self.assertEqual(self.bank.get_currency(self.alice), 3 * self.money_per_message)
+        self.assertEqual(self.accrual.flush(), 2)
+        self.assertEqual([self.balance(self.alice), self.balance(self.bob)], [3 * self.money_per_message, 7])
+        self.assertEqual(self.accrual.pending(self.alice), 0)
+        # Nothing is paid twice
+        self.assertEqual(self.accrual.flush(), 0)
+        self.assertEqual([self.balance(self.alice), self.balance(self.bob)], [3 * self.money_per_message, 7])
+
+    def test_a_window_is_due_after_its_length(self):
+        self.assertFalse(self.accrual.due())
+        self.accrual.window_start -= 60
+        self.assertTrue(self.accrual.due())
+        self.accrual.flush()
+        self.assertFalse(self.accrual.due())
+
+    def test_messages_after_the_full_ones_diminish(self):
+        self.configure(full_reward_messages=2, diminishing_factor=0.5)
+        for _ in range(4):
+            self.accrual.count_message(self.alice)
+        self.accrual.flush()
+        # 2 + 2 + 1 + 0.5
+        self.assertEqual(self.balance(self.alice), 5)
+
+    def test_message_rewards_are_capped_per_window(self):
+        self.configure(max_reward_per_window=5)
+        for _ in range(10):
+            self.accrual.count_message(self.alice)
+        self.accrual.accrue(self.alice, 7)
+        self.accrual.flush()
+        # Voice time is not capped
+        self.assertEqual(self.balance(self.alice), 5 + 7)
+
+    def test_without_a_window_every_reward_is_paid_at_once(self):
+        self.configure(window=0)
+        self.accrual.count_message(self.alice)
+        self.accrual.accrue(self.bob, 7)
+        self.assertEqual([self.balance(self.alice), self.balance(self.bob)], [self.money_per_message, 7])
+        self.assertEqual(self.accrual.flush(), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,63 @@
+import unittest
+
+from benchmarks.fakes import FakeGuild, FakeMember, FakeMessage, FakeRole, FakeTextChannel
+from internals.call import Call
+from internals.command_acl import CommandAcl
+
+
+class CommandAclTest(unittest.TestCase):
+    def setUp(self):
+        self.guild = FakeGuild()
+        self.channel = FakeTextChannel(self.guild)
+        self.other_channel = FakeTextChannel(self.guild)
+        self.allowed_role = FakeRole()
+        self.denied_role = FakeRole()
+        self.member = self.guild.add_member(FakeMember())
+
+    def call(self, member: FakeMember, channel: FakeTextChannel = None) -> Call:
+        return Call(FakeMessage("_test", member, channel or self.channel))
+
+    def test_permissive_allows_everyone_not_denied(self):
+        acl = CommandAcl(False, denied_users=[self.member.id])
+        self.assertTrue(acl.allows_author(self.call(self.guild.add_member(FakeMember()))))
+        self.assertFalse(acl.allows_author(self.call(self.member)))
+
+    def test_restrictive_needs_an_allowed_user_or_role(self):
+        acl = CommandAcl(True, allowed_users=[self.member.id], allowed_roles=[self.allowed_role.id])
+        self.assertTrue(acl.allows_author(self.call(self.member)))
+        other = self.guild.add_member(FakeMember())
+        self.assertFalse(acl.allows_author(self.call(other)))
+        other.roles.append(self.allowed_role)
+        self.assertTrue(acl.allows_author(self.call(other)))
+
+    def test_denials_win_over_allowances(self):
+        acl = CommandAcl(True, allowed_users=[self.member.id], allowed_roles=[self.allowed_role.id],
+                         denied_users=[self.member.id], denied_roles=[self.denied_role.id])
+        self.assertFalse(acl.allows_author(self.call(self.member)))
+        other = self.guild.add_member(FakeMember())
+        other.roles.extend([self.allowed_role, self.denied_role])
+        self.assertFalse(acl.allows_author(self.call(other)))
+
+    def test_a_role_change_changes_the_cached_decision(self):
+        acl = CommandAcl(False, denied_roles=[self.denied_role.id])
+        self.assertTrue(acl.allows_author(self.call(self.member)))
+        self.member.roles.append(self.denied_role)
+        self.assertFalse(acl.allows_author(self.call(self.member)))
+        self.member.roles.remove(self.denied_role)
+        self.assertTrue(acl.allows_author(self.call(self.member)))
+
+    def test_denied_channels_win_over_the_channel_whitelist(self):
+        acl = CommandAcl(False, allowed_channels=[self.channel.id, self.other_channel.id],
+                         denied_channels=[self.other_channel.id])
+        self.assertTrue(acl.allows_channel(self.call(self.member)))
+        self.assertFalse(acl.allows_channel(self.call(self.member, self.other_channel)))
+        self.assertFalse(acl.allows_channel(self.call(self.member, FakeTextChannel(self.guild))))
+
+    def test_restrictive_without_allowances_falls_back_to_the_admins(self):
+        acl = CommandAcl.from_config(True, {}, admin_ids=[self.member.id])
+        self.assertTrue(acl.allows_author(self.call(self.member)))
+        self.assertFalse(acl.allows_author(self.call(self.guild.add_member(FakeMember()))))
+
+
+if __name__ == "__main__":
+    unittest.main()
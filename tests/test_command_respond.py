@@ -0,0 +1,52 @@
+import asyncio
+import tempfile
+import unittest
+from pathlib import Path
+
+from benchmarks.fakes import FakeGuild, FakeMember, FakeMessage, FakeTextChannel
+from benchmarks.run import make_client
+
+
+class RespondTest(unittest.TestCase):
+    commands = 30
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        # One send every 10 seconds, the replies of the commands wait on it far longer than the test runs
+        self.client = make_client(Path(self.directory.name), overrides={
+            "currency": {"ranking_channels": []},
+            "commands": {"restricted_channels": []},
+            "metrics": {"file": None},
+            "events": {"max_concurrency": 16},
+            "outbound": {"route_limits": {"send": [0.1, 1]}}})
+
+    def tearDown(self):
+        self.client.bank.close_ledgers()
+        self.client.thread_pool.shutdown(wait=True)
+        self.client.log_pipeline.stop()
+        self.directory.cleanup()
+
+    def test_messages_are_accrued_while_the_reply_route_is_saturated(self):
+        guild = FakeGuild()
+        channel = FakeTextChannel(guild)
+        author = guild.add_member(FakeMember())
+        accrual = self.client.bank.accrual
+
+        async def run():
+            for i in range(self.commands):
+                await asyncio.wait_for(self.client.on_message(FakeMessage("_asd hola {}".format(i), author, channel)),
+                                       1)
+            await asyncio.wait_for(self.client.on_message(FakeMessage("hola", author, channel)), 1)
+            self.assertEqual(accrual.messages[accrual.bank.partition_of(author)][author.id], self.commands + 1)
+            # Only the first reply got the token, the rest are still queued
+            self.assertEqual(channel.requests["send"], 1)
+            self.assertEqual(self.client.outbound.pending(), self.commands - 1)
+            for task in asyncio.all_tasks():
+                if task is not asyncio.current_task():
+                    task.cancel()
+
+        self.client.loop.run_until_complete(run())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,42 @@
+import unittest
+
+from internals.cooldowns import TokenBucket
+
+
+class TokenBucketTest(unittest.TestCase):
+    # One call every 4 seconds after a burst of 3, a period that adds up exactly in floating point
+    rate = 1 / 4
+    burst = 3
+
+    def setUp(self):
+        self.bucket = TokenBucket(self.burst, 0)
+
+    def consume(self, now: float) -> bool:
+        return self.bucket.consume(self.rate, self.burst, now)
+
+    def test_burst_then_cooldown(self):
+        self.assertEqual([self.consume(0) for _ in range(4)], [True, True, True, False])
+
+    def test_refills_one_token_per_period(self):
+        for _ in range(self.burst):
+            self.consume(0)
+        self.assertFalse(self.consume(3.5))
+        self.assertTrue(self.consume(4))
+        self.assertFalse(self.consume(4))
+        self.assertTrue(self.consume(8))
+
+    def test_denied_calls_do_not_delay_the_refill(self):
+        for _ in range(self.burst):
+            self.consume(0)
+        for now in (1, 2, 3):
+            self.assertFalse(self.consume(now))
+        self.assertTrue(self.consume(4))
+
+    def test_refill_is_capped_at_the_burst(self):
+        for _ in range(self.burst):
+            self.consume(0)
+        self.assertEqual([self.consume(1000) for _ in range(4)], [True, True, True, False])
+
+
+if __name__ == "__main__":
+    unittest.main()
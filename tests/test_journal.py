@@ -0,0 +1,50 @@
+import tempfile
+import unittest
+from pathlib import Path
+
+from internals.journal import Journal
+
+
+class JournalReplayTest(unittest.TestCase):
+    rows = [[(1, 500), (2, 300)], [(3, 12345)], [(1, 400), (4, 100)]]
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = Path(self.directory.name)
+        journal = Journal(self.path / "full.journal")
+        for entries in self.rows:
+            journal.append_many(entries)
+        journal.close()
+        self.content = (self.path / "full.journal").read_bytes()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def expected(self, complete_rows: int):
+        data = {}
+        for entries in self.rows[:complete_rows]:
+            data.update(entries)
+        return data
+
+    def test_replay_of_journal_truncated_at_every_offset_applies_only_whole_rows(self):
+        for offset in range(len(self.content) + 1):
+            file = self.path / "torn.journal"
+            file.write_bytes(self.content[:offset])
+            complete_rows = self.content[:offset].count(b"\n")
+            self.assertEqual(Journal(file).replay({}), self.expected(complete_rows), "offset {}".format(offset))
+
+    def test_appends_after_a_torn_row_start_on_a_new_row(self):
+        for offset in range(len(self.content) + 1):
+            file = self.path / "torn.journal"
+            file.write_bytes(self.content[:offset])
+            complete_rows = self.content[:offset].count(b"\n")
+            journal = Journal(file)
+            journal.append_many([(5, 7)])
+            journal.close()
+            expected = self.expected(complete_rows)
+            expected[5] = 7
+            self.assertEqual(Journal(file).replay({}), expected, "offset {}".format(offset))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,76 @@
+import tempfile
+import unittest
+from pathlib import Path
+
+from benchmarks.fakes import FakeGuild, FakeMember
+from benchmarks.run import make_client
+from internals.currency_manager import NotEnoughCurrencyException
+
+
+class LedgerTransactionTest(unittest.TestCase):
+    backend = "csv"
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.client = make_client(Path(self.directory.name), self.backend, overrides={"metrics": {"file": None}})
+        self.bank = self.client.bank
+        self.guild = FakeGuild()
+        self.alice, self.bob, self.carol = (self.guild.add_member(FakeMember()) for _ in range(3))
+        self.bank.set_currency(self.alice, 100)
+        self.bank.set_currency(self.bob, 50)
+
+    def tearDown(self):
+        self.bank.close_ledgers()
+        self.client.thread_pool.shutdown(wait=True)
+        self.client.log_pipeline.stop()
+        self.directory.cleanup()
+
+    def balances(self):
+        ledger = self.bank.ledger_for(self.guild.id)
+        return [ledger.get(member.id) for member in (self.alice, self.bob, self.carol)]
+
+    def test_an_overdraft_applies_nothing(self):
+        transaction = self.bank.transaction(self.guild.id)
+        transaction.debit(self.alice.id, 80).debit(self.bob.id, 60).grant(self.carol.id, 140)
+        with self.assertRaises(NotEnoughCurrencyException):
+            transaction.commit()
+        self.assertEqual(self.balances(), [100, 50, 0])
+
+    def test_an_overdraft_in_a_with_block_applies_nothing(self):
+        with self.assertRaises(NotEnoughCurrencyException):
+            with self.bank.transaction(self.guild.id) as transaction:
+                transaction.transfer(self.alice.id, self.carol.id, 30)
+                transaction.transfer(self.bob.id, self.carol.id, 51)
+        self.assertEqual(self.balances(), [100, 50, 0])
+
+    def test_debits_down_to_zero_are_applied_together(self):
+        with self.bank.transaction(self.guild.id) as transaction:
+            transaction.transfer(self.alice.id, self.carol.id, 100)
+            transaction.transfer(self.bob.id, self.carol.id, 50)
+        self.assertEqual(self.balances(), [0, 0, 150])
+
+    def test_the_check_uses_the_net_change_of_the_transaction(self):
+        with self.bank.transaction(self.guild.id) as transaction:
+            transaction.debit(self.alice.id, 150).grant(self.alice.id, 60)
+        self.assertEqual(self.balances(), [10, 50, 0])
+
+    def test_an_error_in_the_with_block_applies_nothing(self):
+        with self.assertRaises(ValueError):
+            with self.bank.transaction(self.guild.id) as transaction:
+                transaction.transfer(self.alice.id, self.carol.id, 10)
+                raise ValueError
+        self.assertEqual(self.balances(), [100, 50, 0])
+
+    def test_transfers_between_guilds_are_rejected(self):
+        stranger = FakeGuild().add_member(FakeMember())
+        with self.assertRaises(ValueError):
+            self.bank.transfer(self.alice, stranger, 10)
+        self.assertEqual(self.balances(), [100, 50, 0])
+
+
+class SqliteLedgerTransactionTest(LedgerTransactionTest):
+    backend = "sqlite"
+
+
+if __name__ == "__main__":
+    unittest.main()
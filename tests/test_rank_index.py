@@ -0,0 +1,80 @@
+import bisect
+import random
+import unittest
+
+from internals.rank_index import RankIndex
+
+
+class RankIndexTest(unittest.TestCase):
+    # Every operation is checked against a sorted list, keys are (-balance, user_id) like in the ledgers
+    users = 300
+    operations = 3000
+
+    def setUp(self):
+        self.randomizer = random.Random(0)
+        random.seed(0)
+        self.index = RankIndex()
+        self.oracle = []
+        self.balances = {}
+
+    def set_balance(self, user_id: int, balance: int):
+        # An update is a remove of the old key and an insert of the new one
+        if user_id in self.balances:
+            key = (-self.balances[user_id], user_id)
+            self.index.remove(key)
+            self.oracle.remove(key)
+        self.balances[user_id] = balance
+        key = (-balance, user_id)
+        self.index.insert(key)
+        bisect.insort(self.oracle, key)
+
+    def remove_user(self, user_id: int):
+        key = (-self.balances.pop(user_id), user_id)
+        self.index.remove(key)
+        self.oracle.remove(key)
+
+    def assert_matches_oracle(self):
+        self.assertEqual(len(self.index), len(self.oracle))
+        self.assertEqual(list(self.index.iterate_from(0)), self.oracle)
+        for position, key in enumerate(self.oracle):
+            self.assertEqual(self.index.rank(key), position)
+            self.assertEqual(self.index[position], key)
+
+    def test_random_inserts_updates_and_removes_match_a_sorted_list(self):
+        for i in range(self.operations):
+            user_id = self.randomizer.randrange(self.users)
+            if user_id in self.balances and self.randomizer.random() < 0.2:
+                self.remove_user(user_id)
+            else:
+                self.set_balance(user_id, self.randomizer.randrange(1000))
+            if i % 500 == 0:
+                self.assert_matches_oracle()
+        self.assert_matches_oracle()
+
+    def test_slices_from_every_start_match_a_sorted_list(self):
+        for user_id in range(self.users):
+            self.set_balance(user_id, self.randomizer.randrange(50))
+        for start in range(len(self.oracle) + 2):
+            self.assertEqual(list(self.index.iterate_from(start)), self.oracle[start:])
+
+    def test_missing_keys_raise(self):
+        self.set_balance(1, 10)
+        with self.assertRaises(KeyError):
+            self.index.rank((-11, 1))
+        with self.assertRaises(KeyError):
+            self.index.remove((-10, 2))
+        with self.assertRaises(IndexError):
+            self.index[1]
+        self.assert_matches_oracle()
+
+    def test_removing_everything_leaves_an_empty_index(self):
+        for user_id in range(self.users):
+            self.set_balance(user_id, self.randomizer.randrange(1000))
+        for user_id in self.randomizer.sample(range(self.users), self.users):
+            self.remove_user(user_id)
+        self.assert_matches_oracle()
+        self.assertEqual(list(self.index.iterate_from(0)), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,61 @@
+import random
+import unittest
+
+from internals.text_transform import TextTransform, split_message
+
+
+class SplitMessageTest(unittest.TestCase):
+    limit = 20
+
+    def test_text_up_to_the_limit_is_one_message(self):
+        text = "a" * self.limit
+        self.assertEqual(split_message(text, self.limit), [text])
+        self.assertEqual(split_message("", self.limit), [])
+
+    def test_cuts_at_the_last_line_break_before_the_limit(self):
+        self.assertEqual(split_message("uno dos\ntres cuatro cinco seis", self.limit),
+                         ["uno dos", "tres cuatro cinco", "seis"])
+
+    def test_a_line_break_right_at_the_limit_is_used(self):
+        first = "a" * self.limit
+        self.assertEqual(split_message(first + "\nb", self.limit), [first, "b"])
+
+    def test_cuts_at_the_last_space_without_line_breaks(self):
+        self.assertEqual(split_message("aaaa bbbb cccc dddd eeee", self.limit), ["aaaa bbbb cccc dddd", "eeee"])
+
+    def test_cuts_mid_word_without_separators(self):
+        text = "a" * (self.limit * 2 + 5)
+        self.assertEqual(split_message(text, self.limit), ["a" * self.limit, "a" * self.limit, "a" * 5])
+
+    def test_blank_chunks_are_dropped(self):
+        self.assertEqual(split_message("a" * self.limit + "\n" + " " * self.limit + "\nb", self.limit),
+                         ["a" * self.limit, "b"])
+
+    def test_random_text_never_exceeds_the_limit_or_loses_words(self):
+        randomizer = random.Random(0)
+        for _ in range(200):
+            text = "".join(randomizer.choice("ab \n") for _ in range(randomizer.randrange(200)))
+            chunks = split_message(text, self.limit)
+            self.assertTrue(all(0 < len(chunk) <= self.limit for chunk in chunks))
+            self.assertEqual("".join(chunks).replace(" ", "").replace("\n", ""),
+                             text.replace(" ", "").replace("\n", ""))
+
+
+class TextTransformTest(unittest.TestCase):
+    def test_unmapped_characters_are_deleted(self):
+        self.assertEqual(TextTransform({"a": "1", "b": "2"}).apply("abc!"), "12")
+
+    def test_unmapped_characters_are_kept_when_asked(self):
+        self.assertEqual(TextTransform({"a": "1"}, keep_unmapped=True).apply("abc"), "1bc")
+
+    def test_uppercase_maps_like_lowercase(self):
+        self.assertEqual(TextTransform({"a": "1"}).apply("aA"), "11")
+        self.assertEqual(TextTransform({"a": "1"}, ignore_case=False).apply("aA"), "1")
+
+    def test_an_explicit_uppercase_mapping_wins(self):
+        self.assertEqual(TextTransform({"A": "2", "a": "1"}).apply("aA"), "12")
+        self.assertEqual(TextTransform({"a": "1", "A": "2"}).apply("aA"), "12")
+
+
+if __name__ == "__main__":
+    unittest.main()